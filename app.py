@@ -1,29 +1,101 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response
 import subprocess, sys
 from pathlib import Path
 from config import load_config, save_config
-import shutil, os
+import contextlib, shutil, os, tempfile, threading, time
 import signal, psutil
+from modules import governor, job_queue, metrics, pipeline, profiling, uploads
 
 current_process = None
 app = Flask(__name__)
 ROOT = Path(__file__).parent
 
-def run_step(cmd, timeout=None):
-    """執行單一步驟，回傳 (returncode, output)"""
-    proc = subprocess.run(
-        [sys.executable, *cmd],
-        cwd=ROOT,
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        timeout=timeout
-    )
-    out = (proc.stdout or "") + ("\n" + proc.stderr if proc.stderr else "")
+# config "metrics": "on" 時啟用指標收集（/metrics）；關閉時記錄呼叫不做任何事
+metrics.enable(str(load_config().get("metrics") or "off").lower() in ("on", "true", "1"))
+
+def _drain(pipe, chunks):
+    """持續讀取子行程輸出，避免管線緩衝區（約 64 KB）滿了讓子行程卡在寫入"""
+    with pipe:
+        for line in pipe:
+            chunks.append(line)
+
+
+def start_step(cmd, profile=None, lease=None):
+    """
+    背景啟動單一步驟，回傳 Popen；以 finish_step 取得結果
+    stdout / stderr 由背景執行緒持續讀取，呼叫端同時等待其他步驟時子行程也不會卡住
+    profile: None 或 {"dir": 輸出資料夾, "mode": "on" | "sample"}（見 modules/profiling.py）
+    lease: 已取得的資源額度（多個步驟同時執行時共用一份，由呼叫端釋放）；
+        None 時先向 governor 取得此步驟的額度（不足時排隊），finish_step 時釋放
+    """
+    stage = Path(cmd[0]).stem
+    own_lease = None
+    if lease is None:
+        lease = own_lease = governor.get().acquire(stage)
+    # 子行程的數值函式庫執行緒上限 = 此步驟的執行緒預算
+    env = {**os.environ, **governor.thread_env(governor.get().budget_for(stage)[0])}
+    metrics_file = None
+    if metrics.enabled():
+        # 子行程把指標寫到暫存檔，結束後再合併回 app
+        fd, metrics_file = tempfile.mkstemp(prefix=f"metrics_{stage}_", suffix=".json")
+        os.close(fd)
+        env.update({metrics.ENV_FILE: metrics_file, metrics.ENV_STAGE: stage})
+    if profile:
+        env.update({profiling.ENV_DIR: str(profile["dir"]), profiling.ENV_MODE: profile["mode"]})
+    if metrics_file or profile:
+        cmd = ["-m", "modules.stage_runner", *cmd]
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, *cmd],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            env=env,
+        )
+    except BaseException:
+        if own_lease is not None:
+            own_lease.release()
+        raise
+    proc.stage, proc.metrics_file, proc.t0, proc.lease = stage, metrics_file, time.perf_counter(), own_lease
+    proc.output = {"stdout": [], "stderr": []}
+    proc.readers = [threading.Thread(target=_drain, args=(getattr(proc, name), chunks), daemon=True)
+                    for name, chunks in proc.output.items()]
+    for t in proc.readers:
+        t.start()
+    return proc
+
+
+def finish_step(proc, timeout=None):
+    """等待背景步驟結束，回傳 (returncode, output)"""
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        for t in proc.readers:
+            t.join()
+        if proc.lease is not None:
+            proc.lease.release()
+        if proc.metrics_file:
+            metrics.observe("subtitle_stage_duration_seconds", time.perf_counter() - proc.t0, stage=proc.stage)
+            metrics.inc("subtitle_stage_runs_total", stage=proc.stage,
+                        result="ok" if proc.returncode == 0 else "error")
+            metrics.merge_file(proc.metrics_file)
+    stdout, stderr = "".join(proc.output["stdout"]), "".join(proc.output["stderr"])
+    out = stdout + ("\n" + stderr if stderr else "")
     return proc.returncode, out
 
 
+def run_step(cmd, timeout=None, profile=None, lease=None):
+    """執行單一步驟，回傳 (returncode, output)"""
+    return finish_step(start_step(cmd, profile=profile, lease=lease), timeout=timeout)
+
+
 @app.get("/")
 def index():
     # 不自動帶值到欄位，但仍可由模板使用 cfg 判斷
@@ -49,16 +121,31 @@ def run_pipeline():
     output_dir = Path(cfg.get("output_dir") or "output")
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    # 剖析（請求欄位 profile 優先，其次 config）：每個步驟的剖析檔放在 output/profiles/<job_id>/
+    profile_mode = profiling.normalize_mode(data.get("profile") or cfg.get("profile"))
+    profile = None
+    if profile_mode:
+        job_id = job_queue.new_job_id()
+        profile = {"dir": (output_dir / "profiles" / job_id).resolve(), "mode": profile_mode}
+
     logs = []
 
+    def respond(ok, **extra):
+        if profile and profile["dir"].is_dir():
+            extra["profiles"] = [
+                f"/files/{p.relative_to(output_dir.resolve()).as_posix()}"
+                for p in sorted(profile["dir"].iterdir())
+            ]
+        return jsonify({"ok": ok, "logs": logs, **extra})
+
     # 1) download_assets
-    code, out = run_step(["download_assets.py"])
+    code, out = run_step(["download_assets.py"], profile=profile)
     logs.append(("download_assets.py", code, out))
     if code != 0:
-        return jsonify({"ok": False, "logs": logs})
+        return respond(False)
 
     # 2) ocr_paddle
-    # code, out = run_step(["ocr_paddle.py"])
+    # code, out = run_step(["ocr_paddle.py"], profile=profile)
     # logs.append(("ocr_paddle.py", code, out))
     # if code != 0:
     #     return jsonify({"ok": False, "logs": logs})
@@ -66,43 +153,70 @@ def run_pipeline():
     # 2) OCR：根據前端選擇執行 Paddle 或 Gemini
     ocr_choice = data.get("ocr", "paddle").strip().lower()
 
-    if ocr_choice == "gemini":
-        # 執行 ocr_gemini.py
-        code, out = run_step(["ocr_gemini.py"])
-        logs.append(("ocr_gemini.py", code, out))
-    else:
-        # 預設執行 ocr_paddle.py
-        code, out = run_step(["ocr_paddle.py"])
-        logs.append(("ocr_paddle.py", code, out))
+    # 只有單一語言且需要翻譯時，翻譯與 OCR 同時執行：
+    # trans.py --follow 會追讀 OCR 逐筆寫出的 data/img_to_text_*.jsonl，每滿一批就先翻譯
+    translate_mode = (cfg.get("translate") or "none").lower()
+    single_lang = bool(cfg.get("file_name_en")) != bool(cfg.get("file_name_ch"))
+    ocr_script = {"gemini": "ocr_gemini.py", "cascade": "ocr_cascade.py"}.get(ocr_choice, "ocr_paddle.py")
+    follow = translate_mode != "none" and single_lang
+    trans_result = None
+
+    # 兩者同時執行時一起取得額度（分開排隊的話，翻譯可能佔著額度等一個排不進來的 OCR）；
+    # 離開 with 時一定釋放（含中途丟出例外），否則之後的步驟會永遠排隊
+    shared_budget = governor.get().acquire("trans", Path(ocr_script).stem) if follow else contextlib.nullcontext()
+    with shared_budget as shared:
+        trans_proc = None
+        if follow:
+            # 明確指定要追讀的語言；先刪掉上一次執行留下的中繼檔（已有 _eof，會被當成這次的結果讀完）
+            src_lang = "en" if cfg.get("file_name_en") else "ch"
+            (ROOT / "data" / f"img_to_text_{src_lang}.jsonl").unlink(missing_ok=True)
+            trans_proc = start_step(["trans.py", "--follow", "--lang", src_lang, "--since", str(time.time())],
+                                    profile=profile, lease=shared)
+        try:
+            # gemini：ocr_gemini.py；cascade：PaddleOCR 先辨識，低信心的圖片再送 Gemini；預設 ocr_paddle.py
+            code, out = run_step([ocr_script], profile=profile, lease=shared)
+            logs.append((ocr_script, code, out))
+            if trans_proc is not None:
+                if code != 0 or not any((ROOT / "data").glob("img_to_text_*.jsonl")):
+                    # OCR 失敗或沒有產出任何結果，翻譯不必再等
+                    trans_proc.kill()
+                trans_result = finish_step(trans_proc)
+        finally:
+            if trans_proc is not None and trans_proc.poll() is None:
+                trans_proc.kill()
+                trans_proc.wait()
 
     if code != 0:
-        return jsonify({"ok": False, "logs": logs})
+        return respond(False)
 
 
     # 3) translate
-    translate_mode = (cfg.get("translate") or "none").lower()
-
     if translate_mode == "none":
         logs.append(("trans.py", 0, "Skip translation."))
+    elif trans_result is not None:
+        code, out = trans_result
+        logs.append(("trans.py", code, out))
+        if code != 0:
+            return respond(False)
     else:
-        code, out = run_step(["trans.py"])
+        code, out = run_step(["trans.py"], profile=profile)
         logs.append(("trans.py", code, out))
         if code != 0:
-            return jsonify({"ok": False, "logs": logs})
+            return respond(False)
 
 
 
-    # 4) xml_to_srt
-    code, out = run_step(["xml_to_srt.py"])
+    # 4) xml_to_srt（不與 OCR 同時執行：需要兩種語言的 OCR / 翻譯結果都完成，且會改寫整份 XML）
+    code, out = run_step(["xml_to_srt.py"], profile=profile)
     logs.append(("xml_to_srt.py", code, out))
     if code != 0:
-        return jsonify({"ok": False, "logs": logs})
+        return respond(False)
 
     # 5) merge_srt（產出固定檔名 merged.srt）
-    code, out = run_step(["merge_srt.py"])
+    code, out = run_step(["merge_srt.py"], profile=profile)
     logs.append(("merge_srt.py", code, out))
     if code != 0:
-        return jsonify({"ok": False, "logs": logs})
+        return respond(False)
 
     # 6) 掃描輸出檔（英文 .srt、中文 .srt、merged.srt）
     en_name = zh_name = merge_name = None
@@ -145,7 +259,9 @@ def run_pipeline():
         "merge": f"/files/{merge_name}" if merge_name else None,
     }
 
-    return jsonify({"ok": True, "logs": logs, "files": files})
+    # 工作完成：上傳的 zip 不必再保留在快取中（見 modules/uploads.py）
+    uploads.release(cfg.get("drive_url_en"), cfg.get("drive_url_ch"))
+    return respond(True, files=files)
 
 def _wipe_dir_contents(root: Path) -> dict:
     """刪除資料夾底下所有檔案與子資料夾，不刪 root 本身。"""
@@ -195,6 +311,134 @@ def reset_workspace():
 
 
 
+@app.get("/governor")
+def governor_status():
+    """執行緒 / 記憶體預算的使用狀況（容量、使用中、執行中的步驟、排隊數）"""
+    return jsonify(governor.get().snapshot())
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    if not metrics.enabled():
+        return Response("metrics disabled\n", status=404, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --------- 可續傳的分段上傳：完成後以 "upload:<id>" 當作 drive_url_* 使用 ---------
+def _upload_error(e):
+    return jsonify({"ok": False, "error": str(e), "offset": e.offset}), e.status
+
+
+@app.post("/uploads")
+def create_upload():
+    data = request.get_json(force=True) or {}
+    try:
+        meta = uploads.create(data.get("filename") or "", size=data.get("size"), sha256=data.get("sha256"))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    part_mb = float(load_config().get("upload_part_mb") or 8)
+    return jsonify({"ok": True, **meta, "part_size": int(part_mb * 1024 * 1024)})
+
+
+@app.get("/uploads/<upload_id>")
+def upload_status(upload_id):
+    try:
+        return jsonify({"ok": True, **uploads.status(upload_id)})
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+
+@app.put("/uploads/<upload_id>")
+def upload_part(upload_id):
+    # Upload-Offset：這一段的起點；X-Part-SHA256：這一段內容的 SHA-256（hex）
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"ok": False, "error": "缺少 Upload-Offset"}), 400
+    try:
+        meta = uploads.write_part(upload_id, offset, request.stream, request.headers.get("X-Part-SHA256", ""),
+                                  length=request.content_length)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return jsonify({"ok": True, **meta})
+
+
+@app.post("/uploads/<upload_id>/complete")
+def complete_upload(upload_id):
+    try:
+        return jsonify({"ok": True, **uploads.complete(upload_id)})
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
+
+# --------- 工作佇列：只負責排入與查詢，實際執行由 worker.py ---------
+_JOB_FIELDS = ["file_name_en", "drive_url_en", "file_name_ch", "drive_url_ch",
+               "api_key", "translate", "ocr", "xml_file_name_en", "xml_file_name_ch"]
+
+
+def _job_work_dir(job_id):
+    root = Path(load_config().get("queue_work_dir") or "jobs")
+    return (root if root.is_absolute() else ROOT / root) / job_id
+
+
+@app.post("/jobs")
+def enqueue_job():
+    data = request.get_json(force=True) or {}
+    title = {k: str(data[k]).strip() for k in _JOB_FIELDS if str(data.get(k) or "").strip()}
+    if not (title.get("file_name_en") or title.get("file_name_ch")):
+        return jsonify({"ok": False, "error": "至少需要 file_name_en 或 file_name_ch"}), 400
+    try:
+        shards = max(1, int(data.get("ocr_shards") or 1))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "ocr_shards 必須是正整數"}), 400
+
+    job_id = job_queue.new_job_id()
+    tasks = pipeline.plan_tasks(title, ocr_shards=shards)
+    q = job_queue.JobQueue()
+    try:
+        q.enqueue_job(title, _job_work_dir(job_id), tasks, job_id=job_id)
+    finally:
+        q.close()
+    return jsonify({"ok": True, "job_id": job_id, "tasks": [t["name"] for t in tasks]})
+
+
+@app.get("/jobs")
+def list_jobs():
+    q = job_queue.JobQueue()
+    try:
+        return jsonify({"ok": True, "jobs": q.list_jobs()})
+    finally:
+        q.close()
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    q = job_queue.JobQueue()
+    try:
+        job = q.job_status(job_id)
+    finally:
+        q.close()
+    if job is None:
+        return jsonify({"ok": False, "error": "找不到 job"}), 404
+    job["title"].pop("api_key", None)
+    out_dir = Path(job["work_dir"]) / "output"
+    if job["status"] == "done" and out_dir.is_dir():
+        job["files"] = [f"/jobs/{job_id}/files/{p.name}" for p in sorted(out_dir.glob("*.srt"))]
+    return jsonify({"ok": True, "job": job})
+
+
+@app.get("/jobs/<job_id>/files/<path:filename>")
+def job_file(job_id, filename):
+    q = job_queue.JobQueue()
+    try:
+        job = q.job_status(job_id)
+    finally:
+        q.close()
+    if job is None:
+        return jsonify({"ok": False, "error": "找不到 job"}), 404
+    return send_from_directory(Path(job["work_dir"]) / "output", filename, as_attachment=True)
+
+
 @app.get("/files/<path:filename>")
 def download_file(filename):
     cfg = load_config()
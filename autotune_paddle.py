@@ -0,0 +1,123 @@
+# autotune_paddle.py
+# 以實際的字幕圖片測試 PaddleOCR 各種 CPU 推論設定，挑出準確度在容許範圍內最快的一組寫回 config.json
+#
+# 用法：
+#     python autotune_paddle.py 再見柏林中文 [--limit 100] [--mode rec]
+#                               [--threads 2,4,8] [--mkldnn on,off] [--precisions fp32]
+#                               [--batch-sizes 8,16,32] [--variants server,mobile]
+#                               [--tolerance 0.01] [--truth 校對過的.jsonl] [--dry-run] [--json out.json]
+#
+# - 每組設定重建模型，模型載入與第一張圖（暖機）不計時
+# - 基準：--truth 有提供時以它計算 CER，容許比目前設定的 CER 多 --tolerance；
+#   未提供時以目前設定（config 的 paddle_*）的辨識結果為準，與它的 CER 不超過 --tolerance
+# - 設定組合為各參數的笛卡兒積，圖片多時請用 --limit / 縮小各清單控制時間
+# - 無法建立的組合（例如環境不支援 fp16）略過
+
+import argparse, itertools, json, os, sys, time
+
+import config
+from bench_ocr import score
+from modules import handoff, image_source, ocr_ocr
+
+
+def _split(text, cast=str):
+    return [cast(v.strip()) for v in str(text).split(",") if v.strip()]
+
+
+def _default_threads():
+    n = os.cpu_count() or 1
+    return sorted({max(1, n // 4), max(1, n // 2), n})
+
+
+def _measure(file_name, names, mode, overrides):
+    """套用設定後辨識 names；回傳 (秒數, 結果)"""
+    ocr_ocr.configure(overrides)
+    ocr_ocr.warm_up(mode)
+    ocr_ocr.run(file_name, names=names[:1], mode=mode)
+    t0 = time.perf_counter()
+    out = ocr_ocr.run(file_name, names=names, mode=mode)
+    return time.perf_counter() - t0, out
+
+
+def _label(s):
+    return (f"threads={s['paddle_cpu_threads'] or 'default'} mkldnn={s['paddle_enable_mkldnn']} "
+            f"{s['paddle_precision']} batch={s['paddle_rec_batch_size']} {s['paddle_model_variant']}")
+
+
+def main(argv=None):
+    cfg = config.load_config()
+    ap = argparse.ArgumentParser(description="PaddleOCR CPU 推論設定自動調校")
+    ap.add_argument("file_name", help="圖片資料夾 / zip 名稱（data/ 底下）")
+    ap.add_argument("--limit", type=int, default=100, help="只測前 N 張（0 = 全部）")
+    ap.add_argument("--mode", default=cfg.get("ocr_mode") or "full", choices=ocr_ocr.MODES)
+    ap.add_argument("--threads", default=",".join(map(str, _default_threads())), help="執行緒數，逗號分隔")
+    ap.add_argument("--mkldnn", default="on,off", help="on / off / auto，逗號分隔")
+    ap.add_argument("--precisions", default="fp32", help="fp32 / fp16，逗號分隔")
+    ap.add_argument("--batch-sizes", default="8,16,32", help="辨識批次，逗號分隔")
+    ap.add_argument("--variants", default="server,mobile", help=f"模型（{' / '.join(ocr_ocr.VARIANTS)}），逗號分隔")
+    ap.add_argument("--tolerance", type=float, default=0.01, help="可接受的 CER 增加量（0.01 = 1 個百分點）")
+    ap.add_argument("--truth", default="", help="基準文字（JSONL / JSON）；未提供時以目前設定的結果為準")
+    ap.add_argument("--dry-run", action="store_true", help="只列出結果，不寫回 config.json")
+    ap.add_argument("--json", default="", help="另存結果為 JSON")
+    args = ap.parse_args(argv)
+
+    with image_source.open_source(args.file_name) as src:
+        names = src.names()
+    if args.limit:
+        names = names[:args.limit]
+    if not names:
+        print("❌ 找不到任何圖片")
+        return 1
+
+    current = ocr_ocr.settings()
+    grid = [dict(zip(("paddle_cpu_threads", "paddle_enable_mkldnn", "paddle_precision",
+                      "paddle_rec_batch_size", "paddle_model_variant"), combo))
+            for combo in itertools.product(_split(args.threads, int), _split(args.mkldnn),
+                                           _split(args.precisions), _split(args.batch_sizes, int),
+                                           _split(args.variants))]
+    print(f"共 {len(names)} 張，模式 {args.mode}，{len(grid)} 組設定（另加目前設定作為基準）", flush=True)
+
+    base_seconds, base_out = _measure(args.file_name, names, args.mode, current)
+    truth = handoff.load_texts(args.truth) if args.truth else base_out
+    base_cer = score(base_out, truth).get("cer", 0.0) if args.truth else 0.0
+    limit_cer = base_cer + args.tolerance
+    rows = [{"settings": current, "seconds": round(base_seconds, 3), **score(base_out, truth), "baseline": True}]
+
+    for i, s in enumerate(grid, 1):
+        print(f"\n[{i}/{len(grid)}] {_label(s)}", flush=True)
+        try:
+            seconds, out = _measure(args.file_name, names, args.mode, s)
+        except Exception as e:
+            print(f"⚠️ 略過：{e}")
+            rows.append({"settings": s, "error": str(e)})
+            continue
+        rows.append({"settings": s, "seconds": round(seconds, 3), **score(out, truth)})
+    ocr_ocr.configure(None)
+
+    ok = [r for r in rows if "seconds" in r and r.get("cer", 0.0) <= limit_cer + 1e-12]
+    best = min(ok, key=lambda r: r["seconds"])
+
+    print(f"\n{'sec':>8} {'img/s':>7} {'exact':>7} {'CER':>7}  設定   （CER 上限 {limit_cer:.2%}）")
+    for r in sorted((r for r in rows if "seconds" in r), key=lambda r: r["seconds"]):
+        mark = "★" if r is best else ("✓" if r in ok else "✗")
+        exact = f"{r['exact']:.1%}" if "exact" in r else "-"
+        cer = f"{r['cer']:.2%}" if "cer" in r else "-"
+        base = "（目前）" if r.get("baseline") else ""
+        print(f"{r['seconds']:>8.1f} {len(names) / r['seconds']:>7.2f} {exact:>7} {cer:>7}  "
+              f"{mark} {_label(r['settings'])}{base}")
+
+    print(f"\n最佳：{_label(best['settings'])}，{base_seconds / best['seconds']:.2f}x（相對目前設定）")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(names), "mode": args.mode, "cer_limit": limit_cer,
+                       "best": best["settings"], "results": rows}, f, ensure_ascii=False, indent=2)
+    if best.get("baseline") or args.dry_run:
+        print("未寫回 config.json" + ("（--dry-run）" if args.dry_run else "（目前設定已是最快）"))
+        return 0
+    config.save_config({k: str(v) for k, v in best["settings"].items()})
+    print(f"✅ 已寫入 {config.CONFIG_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# batch.py
+# 一次處理整季（多部片）的批次入口
+#
+# 用法：
+#     python batch.py season.json [--workers 4] [--out batch_runs/第一季] [--gemini-rpm 10]
+#
+# manifest（JSON 陣列或 CSV，欄位與 config.json 相同，未填的欄位使用 config.json 的值）：
+#     [
+#       {"file_name_en": "EP01_英文", "drive_url_en": "https://...",
+#        "file_name_ch": "EP01_中文", "drive_url_ch": "https://...",
+#        "ocr": "paddle", "translate": "none"},
+#       ...
+#     ]
+#
+# - 每部片有自己的工作目錄 <out>/<片名>/（data/、output/、log.txt）
+# - 多個 worker 行程平行處理；每個 worker 只載入一次 PaddleOCR 與 SentenceTransformer
+# - Gemini 請求的每分鐘額度由所有 worker 共用
+# - 結束時輸出 <out>/summary.json 與 summary.txt（各片各步驟耗時與失敗原因）
+
+import argparse, csv, json, multiprocessing as mp, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from modules import pipeline, rate_limit
+
+
+def load_manifest(path):
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            titles = [dict(row) for row in csv.DictReader(f)]
+    else:
+        titles = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(titles, dict):
+            titles = titles.get("titles", [])
+    if not isinstance(titles, list) or not titles:
+        raise ValueError(f"manifest 內沒有任何片子：{path}")
+    return titles
+
+
+def _safe_dir_name(name, used):
+    base = re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("_") or "untitled"
+    out, i = base, 2
+    while out in used:
+        out, i = f"{base}_{i}", i + 1
+    used.add(out)
+    return out
+
+
+def _init_worker(lock, value, rpm, engines):
+    rate_limit.share(lock, value, rpm)
+    pipeline.warm_up(engines)
+
+
+def write_summary(reports, out_dir, wall):
+    out_dir = Path(out_dir)
+    (out_dir / "summary.json").write_text(
+        json.dumps({"wall_seconds": round(wall, 3), "titles": reports}, ensure_ascii=False, indent=2),
+        encoding="utf-8")
+
+    stages = [s for s, _ in pipeline.STAGES]
+    header = ["title", "status"] + stages + ["total"]
+    rows = []
+    for r in reports:
+        timings = r.get("timings", {})
+        rows.append([r["name"], "ok" if r["ok"] else f"FAIL@{r.get('failed_stage')}"]
+                    + [f"{timings[s]:.1f}" if s in timings else "-" for s in stages]
+                    + [f"{sum(timings.values()):.1f}"])
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    lines = ["  ".join(str(x).ljust(w) for x, w in zip(row, widths)) for row in [header] + rows]
+    failed = [r for r in reports if not r["ok"]]
+    lines += ["", f"共 {len(reports)} 部，成功 {len(reports) - len(failed)}，失敗 {len(failed)}，總耗時 {wall:.1f}s"]
+    for r in failed:
+        lines.append(f"  ✖ {r['name']}（{r.get('failed_stage')}）：{r.get('error')}  → {r['work_dir']}/log.txt")
+    text = "\n".join(lines) + "\n"
+    (out_dir / "summary.txt").write_text(text, encoding="utf-8")
+    return text
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="批次處理多部片的字幕流程")
+    ap.add_argument("manifest", help="JSON 或 CSV，列出每部片的 file_name_* / drive_url_* 等欄位")
+    ap.add_argument("--workers", type=int, default=0, help="worker 行程數（預設依 CPU 數推估）")
+    ap.add_argument("--out", default="", help="輸出資料夾（預設 batch_runs/<時間>）")
+    ap.add_argument("--gemini-rpm", type=float, default=None, help="所有 worker 共用的 Gemini 每分鐘請求數")
+    args = ap.parse_args(argv)
+
+    titles = load_manifest(args.manifest)
+    out_dir = Path(args.out or Path("batch_runs") / time.strftime("%Y%m%d_%H%M%S")).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # PaddleOCR / torch 本身就會用多執行緒，worker 數預設為 CPU 數的 1/4
+    workers = args.workers or max(1, min(len(titles), (os.cpu_count() or 1) // 4))
+    engines = sorted({pipeline.title_settings(t)["ocr"] for t in titles})
+
+    # spawn：避免 fork 已載入的執行緒 / 模型狀態
+    ctx = mp.get_context("spawn")
+    lock, value = rate_limit.make_shared(ctx)
+
+    used = set()
+    jobs = [(t, out_dir / _safe_dir_name(pipeline.title_name(t), used)) for t in titles]
+    print(f"共 {len(jobs)} 部，{workers} 個 worker，輸出：{out_dir}", flush=True)
+
+    reports = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(lock, value, args.gemini_rpm, engines)) as pool:
+        futures = {pool.submit(pipeline.run_title, t, d): (t, d) for t, d in jobs}
+        for fut in as_completed(futures):
+            t, d = futures[fut]
+            try:
+                r = fut.result()
+            except Exception as e:  # worker 崩潰等
+                r = {"name": pipeline.title_name(t), "ok": False, "timings": {}, "failed_stage": "worker",
+                     "error": f"{type(e).__name__}: {e}", "work_dir": str(d)}
+            reports.append(r)
+            mark = "✔" if r["ok"] else f"✖ {r.get('failed_stage')}: {r.get('error')}"
+            print(f"[{len(reports)}/{len(jobs)}] {r['name']} {mark}", flush=True)
+
+    order = {str(d): i for i, (_, d) in enumerate(jobs)}
+    reports.sort(key=lambda r: order.get(r["work_dir"], 0))
+    print(write_summary(reports, out_dir, time.perf_counter() - t0))
+    return 0 if all(r["ok"] for r in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
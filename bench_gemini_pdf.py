@@ -0,0 +1,73 @@
+# bench_gemini_pdf.py
+# 比較 Gemini OCR 各種 PDF 頁面編碼的上傳大小、延遲與辨識一致性
+#
+# 用法：
+#     python bench_gemini_pdf.py 再見柏林中文 [--limit 100] [--encodings rgb,gray,bilevel,jpeg]
+#                                [--chunk-size 100] [--transport auto|inline|files]
+#                                [--truth 校對過的.jsonl] [--json out.json]
+#
+# - 每種編碼辨識同一批圖片（會實際呼叫 Gemini，請注意額度）
+# - 一致性以 --truth 為準；未提供時以 rgb（原本的編碼）結果為基準
+#   exact：文字完全相同的比例；CER：字元錯誤率
+
+import argparse, json, sys, time
+
+from bench_ocr import score
+from modules import handoff, image_source, ocr_gemini
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Gemini OCR PDF 編碼比較")
+    ap.add_argument("file_name", help="圖片資料夾 / zip 名稱（data/ 底下）")
+    ap.add_argument("--limit", type=int, default=100, help="只測前 N 張（0 = 全部）")
+    ap.add_argument("--encodings", default=",".join(ocr_gemini.ENCODINGS), help="要比較的編碼，逗號分隔")
+    ap.add_argument("--chunk-size", type=int, default=100, help="每個 chunk 的頁數")
+    ap.add_argument("--transport", default=None, choices=ocr_gemini.TRANSPORTS,
+                    help="傳送方式（預設讀 config 的 gemini_transport）")
+    ap.add_argument("--truth", default="", help="基準文字（JSONL / JSON）；未提供時以 rgb 為準")
+    ap.add_argument("--json", default="", help="另存結果為 JSON")
+    args = ap.parse_args(argv)
+
+    encodings = [e.strip() for e in args.encodings.split(",") if e.strip()]
+    with image_source.open_source(args.file_name) as src:
+        names = src.names("*.png")
+    if args.limit:
+        names = names[:args.limit]
+    print(f"共 {len(names)} 張，編碼：{', '.join(encodings)}", flush=True)
+
+    outputs, report = {}, {}
+    for enc in encodings:
+        chunks = []
+        t0 = time.perf_counter()
+        outputs[enc] = ocr_gemini.run(args.file_name, names=names, encoding=enc,
+                                      chunk_size=args.chunk_size, chunk_stats=chunks,
+                                      transport=args.transport)
+        report[enc] = {
+            "seconds": round(time.perf_counter() - t0, 3),
+            "bytes": sum(c.get("bytes", 0) for c in chunks),
+            "rpcs": sum(c.get("rpcs", 0) for c in chunks),
+            "upload_seconds": round(sum(c.get("upload_seconds", 0) for c in chunks), 3),
+            "generate_seconds": round(sum(c.get("generate_seconds", 0) for c in chunks), 3),
+            "chunks": chunks,
+        }
+
+    truth = handoff.load_texts(args.truth) if args.truth else outputs.get("rgb", {})
+    base = "truth" if args.truth else "rgb"
+    for enc in encodings:
+        report[enc].update(score(outputs[enc], truth))
+
+    print(f"\n{'encoding':<8} {'MB':>8} {'RPC':>5} {'upload':>8} {'total':>8} {'exact':>7} {'CER':>7}   （基準：{base}）")
+    for enc in encodings:
+        r = report[enc]
+        exact = f"{r['exact']:.1%}" if "exact" in r else "-"
+        cer = f"{r['cer']:.2%}" if "cer" in r else "-"
+        print(f"{enc:<8} {r['bytes'] / 1e6:>8.2f} {r['rpcs']:>5} {r['upload_seconds']:>7.1f}s {r['seconds']:>7.1f}s {exact:>7} {cer:>7}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(names), "baseline": base, "encodings": report}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# bench_ocr.py
+# PaddleOCR 各模式（完整流程 / 只辨識）的速度與準確度比較
+#
+# 用法：
+#     python bench_ocr.py 再見柏林中文 [--limit 200] [--modes full,rec] [--truth 校對過的.jsonl]
+#
+# - 圖片來源與 OCR 步驟相同（data/{file_name}.zip 或 data/{file_name}/）
+# - 模型載入時間不計入；每個模式辨識同一批圖片
+# - 準確度以 --truth（JSONL 或 {檔名: 文字} 的 JSON）為準；未提供時以 full 模式的結果當基準
+#   exact：文字完全相同的比例；CER：字元錯誤率（編輯距離 / 基準字數）
+
+import argparse, json, sys, time
+
+from modules import handoff, image_source, ocr_ocr
+
+
+def edit_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _norm(text):
+    return " ".join(str(text or "").split())
+
+
+def score(results, truth):
+    keys = [k for k in results if k in truth]
+    if not keys:
+        return {"compared": 0}
+    exact = sum(_norm(results[k]) == _norm(truth[k]) for k in keys)
+    errors = sum(edit_distance(_norm(results[k]), _norm(truth[k])) for k in keys)
+    chars = sum(len(_norm(truth[k])) for k in keys) or 1
+    return {"compared": len(keys), "exact": exact / len(keys), "cer": errors / chars}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="PaddleOCR 模式效能比較")
+    ap.add_argument("file_name", help="圖片資料夾 / zip 名稱（data/ 底下）")
+    ap.add_argument("--limit", type=int, default=0, help="只測前 N 張（0 = 全部）")
+    ap.add_argument("--modes", default="full,rec", help="要比較的模式，逗號分隔")
+    ap.add_argument("--truth", default="", help="基準文字（JSONL / JSON）；未提供時以 full 模式為準")
+    ap.add_argument("--json", default="", help="另存結果為 JSON")
+    args = ap.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    with image_source.open_source(args.file_name) as src:
+        names = src.names()
+    if args.limit:
+        names = names[:args.limit]
+    print(f"共 {len(names)} 張，模式：{', '.join(modes)}", flush=True)
+
+    outputs, report = {}, {}
+    for mode in modes:
+        ocr_ocr.warm_up(mode)
+        t0 = time.perf_counter()
+        outputs[mode] = ocr_ocr.run(args.file_name, names=names, mode=mode)
+        elapsed = time.perf_counter() - t0
+        report[mode] = {"seconds": round(elapsed, 3),
+                        "images_per_second": round(len(names) / elapsed, 2) if elapsed > 0 else None}
+
+    truth = handoff.load_texts(args.truth) if args.truth else outputs.get("full", {})
+    base = "truth" if args.truth else "full"
+    for mode in modes:
+        report[mode].update(score(outputs[mode], truth))
+
+    ref = report.get("full", {}).get("seconds")
+    print(f"\n{'mode':<6} {'sec':>8} {'img/s':>8} {'speedup':>8} {'exact':>7} {'CER':>7}   （基準：{base}）")
+    for mode in modes:
+        r = report[mode]
+        speedup = f"{ref / r['seconds']:.2f}x" if ref and r["seconds"] else "-"
+        exact = f"{r['exact']:.1%}" if "exact" in r else "-"
+        cer = f"{r['cer']:.2%}" if "cer" in r else "-"
+        print(f"{mode:<6} {r['seconds']:>8.1f} {r['images_per_second'] or 0:>8.2f} {speedup:>8} {exact:>7} {cer:>7}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"images": len(names), "baseline": base, "modes": report}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
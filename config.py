@@ -13,10 +13,79 @@ DEFAULT_CFG = {
     "api_key": "",
     "API_key": "",          # 與 api_key 同步，兼容舊程式
     "translate": "none",
+    # 翻譯：每批送給 Gemini 的字幕筆數；與 OCR 同時執行時，OCR 超過 trans_follow_idle_timeout 秒沒有新結果就放棄等待
+    "trans_batch_size": "100",
+    "trans_follow_idle_timeout": "600",
     "output_dir": "output",
     # 若其他腳本需要，可保留這兩鍵
     "xml_file_name_en": "subtitle_en.xml",
     "xml_file_name_ch": "subtitle_ch.xml",
+    # 下載快取（zip 與解壓後目錄；以 MB 計的總容量上限，超過依 LRU 淘汰）
+    "download_cache_dir": "cache/downloads",
+    "download_cache_max_mb": "20480",
+    # 分段上傳（/uploads）的暫存目錄與建議的每段大小（MB）
+    # upload_pin_hours：完成的上傳在下載快取中保留幾小時不被淘汰（使用它的工作完成時提早解除；0 = 不保留）
+    "upload_dir": "cache/uploads",
+    "upload_part_mb": "8",
+    "upload_pin_hours": "72",
+    # 圖片來源："zip" 直接從 zip 讀圖（不解壓）；"dir" 解壓到 data/{file_name}/
+    "image_source": "zip",
+    # "on" 時由 app.py 收集各步驟指標，於 /metrics 以 Prometheus 文字格式輸出
+    "metrics": "off",
+    # 步驟剖析："off" / "on"（cProfile + tracemalloc）/ "sample"（再加取樣堆疊）；/run 的 profile 欄位可覆蓋
+    "profile": "off",
+    # Gemini 每分鐘請求數上限（0 = 不限制）；批次模式下由所有 worker 共用
+    "gemini_rpm": "0",
+    # Gemini 避險：請求超過最近 gemini_hedge_window 次成功延遲的百分位數（0 = 不避險）時再送一份，先回應的為準
+    # 至少累積 gemini_hedge_min_samples 筆樣本才開始；gemini_job_deadline：每個 OCR / 翻譯工作的整體期限秒數（0 = 不限制）
+    "gemini_hedge_percentile": "0.95",
+    "gemini_hedge_window": "50",
+    "gemini_hedge_min_samples": "5",
+    "gemini_job_deadline": "0",
+    # PaddleOCR 模式："full" 偵測 + 辨識；"rec" 略過偵測，依水平投影切行後只跑辨識模型（切不出來的退回 full）
+    "ocr_mode": "full",
+    # OCR 預檢："on" 只辨識字幕 XML 的 <Graphic> 引用到的圖片（依 XML 順序），"off" 辨識全部檔案
+    "ocr_preflight": "on",
+    # PaddleOCR CPU 推論設定（可用 autotune_paddle.py 實測後自動寫入）：
+    # 執行緒數（0 = 預設）、MKL-DNN（on / off / auto）、精度（fp32 / fp16）、辨識批次、模型（default / server / mobile）
+    "paddle_cpu_threads": "0",
+    "paddle_enable_mkldnn": "auto",
+    "paddle_precision": "fp32",
+    "paddle_rec_batch_size": "16",
+    "paddle_model_variant": "default",
+    # Gemini OCR 的 PDF 頁面編碼："rgb" / "gray" / "bilevel"（二值 CCITT G4）/ "jpeg"（灰階、限制寬度與品質）
+    "gemini_pdf_encoding": "rgb",
+    "gemini_pdf_max_width": "1280",
+    "gemini_pdf_jpeg_quality": "60",
+    # Gemini OCR 傳送方式："auto" chunk 不超過 gemini_inline_max_mb 時直接夾帶在請求裡，超過才用 Files API；
+    # "inline" / "files" 強制其中一種
+    "gemini_transport": "auto",
+    "gemini_inline_max_mb": "18",
+    # Gemini OCR 每個 chunk 的頁數自動調整（AIMD）：從 gemini_chunk_initial 開始（或上次學到的值，記在 gemini_chunk_state），
+    # 介於 min / max；順利且耗時在 target_seconds 的 80% 內 + step，逾時 / 缺頁 / 輸出截斷減半，超過目標 × 0.75
+    "gemini_chunk_initial": "100",
+    "gemini_chunk_min": "10",
+    "gemini_chunk_max": "200",
+    "gemini_chunk_step": "10",
+    "gemini_chunk_target_seconds": "120",
+    "gemini_chunk_state": "cache/gemini_chunk_sizes.json",
+    # OCR 串接（/run 的 ocr 選 cascade）：PaddleOCR 分數低於門檻或為空的圖片，每批 cascade_batch_size 張送 Gemini
+    "cascade_threshold": "0.9",
+    "cascade_batch_size": "50",
+    # 中英合併："tiered" 時間重疊明顯勝出（領先 merge_margin）的只看時間，其餘才做語意比對；"full" 全部語意比對
+    # merge_audit：抽查只看時間之結果的比例（回報與完整比對的不一致率，0 = 不抽查）；
+    #   抽查需要語意模型，即使沒有需要語意比對的字幕也會載入，因此預設關閉
+    "merge_mode": "tiered",
+    "merge_margin": "0.5",
+    "merge_audit": "0",
+    # app.py 的資源預算：總執行緒數（0 = CPU 核心數）、總記憶體 MB（0 = 實體記憶體的 80%），
+    # 各步驟預算覆寫（"步驟=執行緒:MB"，逗號分隔，例如 "ocr_paddle=4:3072"）；額度不足的步驟排隊等待
+    "governor_threads": "0",
+    "governor_memory_mb": "0",
+    "governor_budgets": "",
+    # 工作佇列（SQLite，多台機器共用時放在共用檔案系統上）與各 job 的工作目錄
+    "queue_path": "cache/queue.sqlite",
+    "queue_work_dir": "jobs",
 }
 
 def load_config() -> dict:
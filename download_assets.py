@@ -1,7 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from config import load_config
 from modules import load_en_images, load_ch_images
 
 if __name__ == "__main__":
     cfg = load_config()
-    load_en_images.run(cfg["file_name_en"], cfg["drive_url_en"])
-    load_ch_images.run(cfg["file_name_ch"], cfg["drive_url_ch"])
\ No newline at end of file
+    # 中英文兩個 zip 同時下載，各自邊下載邊解壓
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(load_en_images.run, cfg["file_name_en"], cfg["drive_url_en"]),
+            pool.submit(load_ch_images.run, cfg["file_name_ch"], cfg["drive_url_ch"]),
+        ]
+        for fut in futures:
+            fut.result()
@@ -1,8 +1,36 @@
-from modules.merge_srt import merge_bilingual_srt
+import argparse
+import os
+from modules.merge_srt import merge_bilingual_srt, merge_tracks
+
+
+def _target(text):
+    """--target 的值：語言=檔名（兩邊都不可為空）"""
+    lang, sep, name = text.partition("=")
+    if not sep or not lang.strip() or not name.strip():
+        raise argparse.ArgumentTypeError(f"格式應為 語言=檔名：{text}")
+    return lang.strip(), name.strip()
 
 if __name__ == "__main__":
-    merge_bilingual_srt(
-        ch_srt_name="subtitle_ch.srt",
-        en_srt_name="subtitle_en.srt",
-        output_dir="output"
-    )
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="合併字幕：預設中英 → output/merged.srt；指定 --target 時一次合併多語")
+    ap.add_argument("--ref", default="subtitle_en.srt", help="參考字幕（output/ 底下）")
+    ap.add_argument("--ref-lang", default="en")
+    ap.add_argument("--target", action="append", default=[], type=_target, metavar="語言=檔名",
+                    help="目標字幕（output/ 底下），可重複，例如 --target ch=subtitle_ch.srt --target ja=subtitle_ja.srt")
+    args = ap.parse_args()
+
+    if args.target:
+        targets = {}
+        for lang, name in args.target:
+            if lang in targets:
+                ap.error(f"--target 的語言重複：{lang}")
+            targets[lang] = name
+        merge_tracks(os.path.join("output", args.ref),
+                     {lang: os.path.join("output", name) for lang, name in targets.items()},
+                     output_dir="output",
+                     reference_lang=args.ref_lang)
+    else:
+        merge_bilingual_srt(
+            ch_srt_name="subtitle_ch.srt",
+            en_srt_name="subtitle_en.srt",
+            output_dir="output"
+        )
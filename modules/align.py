@@ -0,0 +1,148 @@
+# modules/align.py
+# 功能：合併前估計兩份字幕之間的時間偏移（offset）與線性漂移（drift）
+# 中英 XML 來自不同交付時，時間軸常整體差一個常數，或隨片長線性偏移（例如 23.976 / 24 fps 混用）
+#
+# 做法：
+# 1. 粗估：兩邊字幕起始時間各做成直方圖（bin_size 秒一格、稍微平滑），以 FFT 求互相關，
+#    在 ±max_offset 內取最大值；把目標字幕切成數段各算一次，對各段的 offset 擬合直線得到初始 drift
+# 2. 細修：以目前的對應把每個目標起始時間配到最近的參考起始時間，
+#    距離在 tolerance 內的當作配對，對配對做穩健直線擬合 ref ≈ scale * tgt + offset
+#    （最小平方 + 以 MAD 剔除離群值，反覆數次）
+# 3. 對齊後起始時間相差 ≤ inlier_tolerance 的配對太少（接近隨機巧合的程度）時不調整；
+#    漂移不合理時只保留 offset
+#
+# 回傳的 Alignment 可用 .apply(t) 把目標時間換算到參考時間軸
+
+from __future__ import annotations
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+
+class Alignment(NamedTuple):
+    offset: float = 0.0     # 秒
+    scale: float = 1.0      # ref ≈ scale * tgt + offset
+    matched: int = 0        # 參與擬合的配對數
+    total: int = 0          # 目標字幕數
+    method: str = "none"    # none / offset / offset+drift
+
+    def apply(self, t: float) -> float:
+        return self.scale * t + self.offset
+
+    @property
+    def drift_per_hour(self) -> float:
+        """每小時累積的漂移秒數"""
+        return (self.scale - 1.0) * 3600.0
+
+    def describe(self) -> str:
+        if self.method == "none":
+            return f"不調整（配對 {self.matched}/{self.total}）"
+        return (f"offset {self.offset:+.3f}s，drift {self.drift_per_hour:+.2f}s/小時"
+                f"（scale {self.scale:.6f}），配對 {self.matched}/{self.total}，方法 {self.method}")
+
+
+IDENTITY = Alignment()
+
+
+def _histogram(starts: np.ndarray, lo: float, n_bins: int, bin_size: float) -> np.ndarray:
+    idx = np.clip(((starts - lo) / bin_size).astype(np.int64), 0, n_bins - 1)
+    hist = np.bincount(idx, minlength=n_bins).astype(np.float64)
+    # 三角形核平滑，容忍 ±2 格的抖動
+    kernel = np.array([1.0, 2.0, 3.0, 2.0, 1.0])
+    return np.convolve(hist, kernel / kernel.sum(), mode="same")
+
+
+def coarse_offset(ref: np.ndarray, tgt: np.ndarray, max_offset: float = 60.0,
+                  bin_size: float = 0.1) -> float:
+    """onset 直方圖的互相關；回傳讓 tgt + offset 最接近 ref 的 offset"""
+    lo = min(ref.min(), tgt.min()) - max_offset
+    hi = max(ref.max(), tgt.max()) + max_offset
+    n_bins = int(np.ceil((hi - lo) / bin_size)) + 1
+    h_ref = _histogram(ref, lo, n_bins, bin_size)
+    h_tgt = _histogram(tgt, lo, n_bins, bin_size)
+
+    size = 1 << int(np.ceil(np.log2(2 * n_bins)))
+    corr = np.fft.irfft(np.fft.rfft(h_ref, size) * np.conj(np.fft.rfft(h_tgt, size)), size)
+    # corr[k] 對應 ref 相對 tgt 往後 k 格；負的位移在陣列尾端
+    max_lag = int(max_offset / bin_size)
+    lags = np.concatenate([np.arange(0, max_lag + 1), np.arange(-max_lag, 0)])
+    values = np.concatenate([corr[:max_lag + 1], corr[size - max_lag:]])
+    return float(lags[int(np.argmax(values))] * bin_size)
+
+
+def _match(ref: np.ndarray, mapped: np.ndarray, tolerance: float):
+    """每個 mapped 時間配最近的 ref；回傳 (tgt 索引, ref 索引)，只留距離 ≤ tolerance 的"""
+    pos = np.clip(np.searchsorted(ref, mapped), 1, len(ref) - 1)
+    left, right = ref[pos - 1], ref[pos]
+    nearest = np.where(np.abs(mapped - left) <= np.abs(right - mapped), pos - 1, pos)
+    keep = np.abs(ref[nearest] - mapped) <= tolerance
+    return np.nonzero(keep)[0], nearest[keep]
+
+
+def _robust_line(x: np.ndarray, y: np.ndarray, rounds: int = 4):
+    """y ≈ a*x + b；每輪剔除殘差超過 3×MAD 的點"""
+    mask = np.ones(len(x), dtype=bool)
+    a, b = 1.0, float(np.median(y - x))
+    for _ in range(rounds):
+        if mask.sum() < 2:
+            break
+        a, b = np.polyfit(x[mask], y[mask], 1)
+        resid = np.abs(y - (a * x + b))
+        mad = np.median(resid[mask]) * 1.4826 + 1e-3
+        new_mask = resid <= 3 * mad
+        if (new_mask == mask).all():
+            break
+        mask = new_mask
+    return float(a), float(b), int(mask.sum())
+
+
+def _initial_guess(ref: np.ndarray, tgt: np.ndarray, windows: int, max_offset: float,
+                   bin_size: float):
+    """整體與分段的互相關；回傳 (scale, offset)"""
+    offset = coarse_offset(ref, tgt, max_offset=max_offset, bin_size=bin_size)
+    centers, offsets = [], []
+    for seg in np.array_split(tgt, windows):
+        if len(seg) >= 10:
+            centers.append(float(np.median(seg)))
+            offsets.append(coarse_offset(ref, seg, max_offset=max_offset, bin_size=bin_size))
+    if len(centers) < 3:
+        return 1.0, offset
+    # 各段 offset 與位置成直線：ref = tgt + (d * tgt + c) = (1 + d) * tgt + c
+    d, c, n = _robust_line(np.array(centers), np.array(offsets))
+    if n < 3:
+        return 1.0, offset
+    return 1.0 + d, c
+
+
+def estimate_alignment(ref_starts: Sequence[float], tgt_starts: Sequence[float], *,
+                       max_offset: float = 60.0, bin_size: float = 0.1, tolerance: float = 0.5,
+                       inlier_tolerance: float = 0.25, windows: int = 6, max_drift: float = 0.01,
+                       min_match_ratio: float = 0.3) -> Alignment:
+    """
+    估計把 tgt 時間換算到 ref 時間軸的 offset 與 scale。
+    max_drift：|scale - 1| 超過此值視為不合理，只保留 offset
+    min_match_ratio：對齊後吻合的起始時間少於兩邊字幕數較小者的這個比例時不調整
+    """
+    ref = np.sort(np.asarray(ref_starts, dtype=np.float64))
+    tgt = np.sort(np.asarray(tgt_starts, dtype=np.float64))
+    total = len(tgt)
+    if len(ref) < 2 or total < 2:
+        return IDENTITY._replace(total=total)
+
+    scale, offset = _initial_guess(ref, tgt, windows, max_offset, bin_size)
+    method = "offset+drift"
+    if abs(scale - 1.0) > max_drift:
+        scale, offset = 1.0, coarse_offset(ref, tgt, max_offset=max_offset, bin_size=bin_size)
+    for _ in range(3):
+        ti, ri = _match(ref, scale * tgt + offset, tolerance)
+        if len(ti) < 2:
+            break
+        a, b, _n = _robust_line(tgt[ti], ref[ri])
+        if abs(a - 1.0) > max_drift:
+            a, b, method = 1.0, float(np.median(ref[ri] - tgt[ti])), "offset"
+        scale, offset = a, b
+
+    matched = len(_match(ref, scale * tgt + offset, inlier_tolerance)[0])
+    if matched < max(5, int(min_match_ratio * min(total, len(ref)))):
+        return IDENTITY._replace(matched=matched, total=total)
+    return Alignment(offset, scale, matched, total, method)
@@ -0,0 +1,99 @@
+# modules/chunk_sizer.py
+# 功能：Gemini OCR 每個 chunk 頁數的自動調整（AIMD：順利時加法遞增，出問題時乘法遞減）
+# 依據每個 chunk 的實際結果調整下一個 chunk 的大小：
+#   - 逾時 / 連線錯誤：減半，並以較小的 chunk 重送同一段
+#   - 回傳頁數少於送出頁數（缺頁）、輸出因 token 上限被截斷：減半
+#   - 延遲超過目標（gemini_chunk_target_seconds）：× 0.75
+#   - 延遲在目標的 80% 以內且頁數完整：+ gemini_chunk_step
+# 學到的大小依引擎 / 模型記在 gemini_chunk_state（JSON），下一次執行從這個值開始
+# 每次改變都印出新舊大小與原因（會出現在步驟 log）
+
+from __future__ import annotations
+import json, os, threading, time
+from pathlib import Path
+from typing import Dict, Optional
+
+import config
+from modules import metrics
+
+_file_lock = threading.Lock()
+
+
+def _state_path() -> Path:
+    path = Path(config.load_config().get("gemini_chunk_state") or "cache/gemini_chunk_sizes.json")
+    if not path.is_absolute():
+        path = Path(config.CONFIG_PATH).parent / path
+    return path
+
+
+def _load_state() -> Dict:
+    try:
+        return json.loads(_state_path().read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+class ChunkSizer:
+    """
+    key：引擎 / 模型，例如 "ocr/gemini-flash-latest"
+    fixed：指定時固定使用這個大小（不調整、不記錄），相當於原本的 chunk_size 參數
+    """
+
+    def __init__(self, key: str, fixed: Optional[int] = None):
+        cfg = config.load_config()
+        self.key = key
+        self.min_size = max(1, int(cfg.get("gemini_chunk_min") or 10))
+        self.max_size = max(self.min_size, int(cfg.get("gemini_chunk_max") or 200))
+        self.step = max(1, int(cfg.get("gemini_chunk_step") or 10))
+        self.target_seconds = float(cfg.get("gemini_chunk_target_seconds") or 120)
+        self.fixed = fixed is not None
+        if self.fixed:
+            self.size = max(1, int(fixed))
+            return
+        learned = _load_state().get(key, {}).get("size")
+        initial = learned or int(cfg.get("gemini_chunk_initial") or 100)
+        self.size = self._clamp(initial)
+        print(f"📐 {key} chunk 大小 {self.size} 頁（{'上次學到的值' if learned else '初始值'}）")
+        metrics.set_gauge("subtitle_gemini_chunk_size", self.size, key=key)
+
+    def _clamp(self, n: float) -> int:
+        return int(min(self.max_size, max(self.min_size, round(n))))
+
+    def _change(self, new: float, reason: str) -> str:
+        new = self._clamp(new)
+        if self.fixed or new == self.size:
+            return ""
+        print(f"📐 chunk 大小 {self.size} → {new} 頁（{reason}）")
+        self.size = new
+        metrics.set_gauge("subtitle_gemini_chunk_size", new, key=self.key)
+        return reason
+
+    def on_result(self, pages: int, returned: int, seconds: float, truncated: bool = False) -> str:
+        """一個 chunk 成功回應後呼叫；回傳調整原因（沒有調整時為空字串）"""
+        if truncated:
+            return self._change(self.size * 0.5, "輸出達到 token 上限被截斷")
+        if returned < pages:
+            return self._change(self.size * 0.5, f"缺頁：送出 {pages} 頁只回傳 {returned} 頁")
+        if seconds > self.target_seconds:
+            return self._change(self.size * 0.75, f"耗時 {seconds:.0f}s 超過目標 {self.target_seconds:.0f}s")
+        if pages >= self.size and seconds <= 0.8 * self.target_seconds:
+            # 只有跑滿目前大小的 chunk 才能證明更大也沒問題（最後一塊通常較小）
+            return self._change(self.size + self.step, f"{pages} 頁 {seconds:.0f}s 內完成")
+        return ""
+
+    def on_timeout(self, error: str) -> str:
+        """逾時 / 連線中斷時呼叫"""
+        return self._change(self.size * 0.5, f"請求失敗：{error}")
+
+    def save(self) -> None:
+        """把學到的大小寫回狀態檔（固定大小時不寫）"""
+        if self.fixed:
+            return
+        path = _state_path()
+        with _file_lock:
+            state = _load_state()
+            state[self.key] = {"size": self.size, "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, path)
@@ -0,0 +1,338 @@
+# modules/download_cache.py
+# 功能：字幕圖片 zip 的本地下載快取
+# 1. 以 URL 為鍵、內容 SHA-256 + 檔案大小驗證；同內容不同 URL 只存一份
+#    每次查詢都比對大小；每個行程第一次使用某個項目、或 mtime 有變動時重新計算 SHA-256
+#    （mtime 不變的損壞，例如磁碟 / 複製錯誤，也不會一直被沿用並 hardlink 進 data/）
+# 2. 總容量上限，超過時依最久未使用（LRU）淘汰；pinned_until 未到期的項目（完成的上傳）不淘汰
+# 3. 命中時直接從快取的 zip 解壓；若已有解壓好的目錄，改用 hardlink 放到工作目錄（不再複製 PNG）
+#
+# 快取目錄結構（預設 cache/downloads/，不在 data/ 內，/reset 不會清掉）：
+#   index.json            {"urls": {url: sha}, "entries": {sha: {...}}}
+#   blobs/<sha>.zip       原始 zip
+#   trees/<sha>/          解壓後的目錄（__MACOSX 已移除）
+#
+# ⚠️ 工作目錄中的檔案與快取共用 inode，只可讀取或改名，不可原地修改內容
+
+from __future__ import annotations
+import hashlib, json, os, shutil, threading, time, zipfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import config
+from modules import stream_fetch
+
+_CHUNK = 1024 * 1024
+_thread_lock = threading.Lock()
+# 本行程已重新計算過雜湊的 blob 路徑
+_verified: set = set()
+
+
+def sha256_file(path, chunk: int = _CHUNK) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class _IndexLock:
+    """跨執行緒 + 跨行程的簡易鎖（以 O_EXCL 建立鎖檔）；鎖檔超過 stale 秒視為殘留"""
+
+    def __init__(self, path: Path, stale: float = 600):
+        self.path = path
+        self.stale = stale
+
+    def __enter__(self):
+        _thread_lock.acquire()
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - self.path.stat().st_mtime > self.stale:
+                        self.path.unlink(missing_ok=True)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        try:
+            self.path.unlink(missing_ok=True)
+        finally:
+            _thread_lock.release()
+
+
+class DownloadCache:
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        cfg = config.load_config()
+        self.root = Path(root or cfg.get("download_cache_dir") or "cache/downloads")
+        if not self.root.is_absolute():
+            # 相對路徑以專案根目錄為準，批次模式切換工作目錄時仍共用同一份快取
+            self.root = Path(config.CONFIG_PATH).parent / self.root
+        if max_bytes is None:
+            max_bytes = int(float(cfg.get("download_cache_max_mb") or 20480) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.blobs = self.root / "blobs"
+        self.trees = self.root / "trees"
+        self.tmp = self.root / "tmp"
+        for d in (self.blobs, self.trees, self.tmp):
+            d.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.root / "index.json"
+        self._lock = _IndexLock(self.root / ".lock")
+
+    # --------- index ---------
+    def _load(self) -> Dict:
+        try:
+            data = json.loads(self._index_path.read_text(encoding="utf-8"))
+            if isinstance(data, dict):
+                data.setdefault("urls", {})
+                data.setdefault("entries", {})
+                return data
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return {"urls": {}, "entries": {}}
+
+    def _save(self, index: Dict) -> None:
+        tmp = self._index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self._index_path)
+
+    def blob_path(self, sha: str) -> Path:
+        return self.blobs / f"{sha}.zip"
+
+    def tree_path(self, sha: str) -> Path:
+        return self.trees / sha
+
+    # --------- 驗證 ---------
+    def _valid(self, sha: str, entry: Dict) -> bool:
+        """大小一致，且（本行程第一次使用或 mtime 有變動時）重新計算雜湊一致才算有效"""
+        blob = self.blob_path(sha)
+        try:
+            st = blob.stat()
+        except FileNotFoundError:
+            return False
+        if st.st_size != entry.get("size"):
+            return False
+        key = str(blob)
+        if st.st_mtime_ns != entry.get("mtime_ns") or key not in _verified:
+            if sha256_file(blob) != sha:
+                _verified.discard(key)
+                return False
+            entry["mtime_ns"] = st.st_mtime_ns
+            _verified.add(key)
+        return True
+
+    def _drop(self, index: Dict, sha: str) -> None:
+        index["entries"].pop(sha, None)
+        for url in [u for u, s in index["urls"].items() if s == sha]:
+            index["urls"].pop(url, None)
+        self.blob_path(sha).unlink(missing_ok=True)
+        _verified.discard(str(self.blob_path(sha)))
+        shutil.rmtree(self.tree_path(sha), ignore_errors=True)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """命中回傳內容 sha；無效項目會順便移除"""
+        with self._lock:
+            index = self._load()
+            sha = index["urls"].get(url)
+            if not sha:
+                return None
+            entry = index["entries"].get(sha)
+            if entry is None or not self._valid(sha, entry):
+                print(f"⚠️ 快取項目驗證失敗，重新下載：{url}")
+                self._drop(index, sha)
+                self._save(index)
+                return None
+            entry["last_used"] = time.time()
+            self._save(index)
+            return sha
+
+    def add(self, url: str, file_path, sha: Optional[str] = None, pin_until: Optional[float] = None) -> str:
+        """
+        把下載好的檔案移入快取（檔案會被搬走），回傳 sha
+        pin_until：在這個時間（Unix 時間戳）之前不淘汰，直到 unpin()
+        """
+        file_path = Path(file_path)
+        sha = sha or sha256_file(file_path)
+        blob = self.blob_path(sha)
+        with self._lock:
+            index = self._load()
+            if blob.exists() and sha in index["entries"]:
+                file_path.unlink(missing_ok=True)
+            else:
+                os.replace(file_path, blob)
+                _verified.add(str(blob))  # sha 就是剛才由這份內容算出來的
+            st = blob.stat()
+            entry = index["entries"].setdefault(sha, {"tree_bytes": 0})
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, last_used=time.time())
+            if pin_until:
+                entry["pinned_until"] = max(pin_until, entry.get("pinned_until") or 0)
+            index["urls"][url] = sha
+            self._evict(index, keep=sha)
+            self._save(index)
+        return sha
+
+    def entry(self, url: str) -> Optional[Dict]:
+        """url 目前的快取項目（不驗證、不更新使用時間）；不在快取中回傳 None"""
+        with self._lock:
+            index = self._load()
+            sha = index["urls"].get(url)
+            entry = index["entries"].get(sha) if sha else None
+            return None if entry is None else {"sha256": sha, **entry}
+
+    def unpin(self, url: str) -> bool:
+        """解除 url 的保留，之後與一般項目一樣依 LRU 淘汰；回傳原本是否有保留"""
+        with self._lock:
+            index = self._load()
+            entry = index["entries"].get(index["urls"].get(url) or "")
+            if entry is None or "pinned_until" not in entry:
+                return False
+            entry.pop("pinned_until")
+            entry["last_used"] = time.time()
+            self._evict(index)
+            self._save(index)
+            return True
+
+    def _evict(self, index: Dict, keep: Optional[str] = None) -> None:
+        def used(e):
+            return e.get("size", 0) + e.get("tree_bytes", 0)
+
+        now = time.time()
+        total = sum(used(e) for e in index["entries"].values())
+        for sha, entry in sorted(index["entries"].items(), key=lambda kv: kv[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if sha == keep or (entry.get("pinned_until") or 0) > now:
+                continue
+            total -= used(entry)
+            print(f"🧹 快取超過上限，淘汰：{sha[:12]}（{used(entry) / 1e6:.1f} MB）")
+            self._drop(index, sha)
+
+    # --------- 下載 / 解壓 ---------
+    def fetch(self, url: str, downloader: Callable[[str], object]) -> str:
+        """
+        取得 url 對應的 zip：命中直接回傳 sha；未命中呼叫 downloader(暫存路徑) 下載後加入快取
+        """
+        sha = self.lookup(url)
+        if sha:
+            print(f"♻️ 使用下載快取：{url}")
+            return sha
+        tmp = self.tmp / f"{os.getpid()}_{threading.get_ident()}_{time.time_ns()}.zip"
+        try:
+            downloader(str(tmp))
+            if not tmp.exists():
+                raise FileNotFoundError(f"下載失敗：{url}")
+            return self.add(url, tmp)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def ensure_tree(self, sha: str) -> Path:
+        """確保 trees/<sha>/ 已解壓好（移除 __MACOSX），回傳目錄"""
+        tree = self.tree_path(sha)
+        if tree.is_dir():
+            return tree
+        staging = self.tmp / f"tree_{sha}_{os.getpid()}_{threading.get_ident()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        print("正在解壓縮...")
+        with zipfile.ZipFile(self.blob_path(sha), "r") as zip_ref:
+            zip_ref.extractall(staging)
+            tree_bytes = sum(i.file_size for i in zip_ref.infolist())
+        shutil.rmtree(staging / "__MACOSX", ignore_errors=True)
+        self._commit_tree(sha, staging, tree_bytes)
+        return tree
+
+    def _commit_tree(self, sha: str, staging: Path, tree_bytes: int) -> None:
+        tree = self.tree_path(sha)
+        with self._lock:
+            if tree.is_dir():
+                shutil.rmtree(staging, ignore_errors=True)  # 其他行程已先完成
+            else:
+                os.replace(staging, tree)
+            index = self._load()
+            if sha in index["entries"]:
+                index["entries"][sha]["tree_bytes"] = tree_bytes
+                self._evict(index, keep=sha)
+                self._save(index)
+
+    def fetch_streaming(self, url: str, downloader: Callable[[object], object], *, label: str = "",
+                        extract: bool = True) -> str:
+        """
+        與 fetch 相同，但未命中時邊下載邊解壓：downloader 收到的是可 write() 的物件，
+        資料同時寫入快取 zip、計算雜湊並串流解壓到 trees/<sha>/。
+        zip 內容無法串流時，改由 ensure_tree 在下載完成後解壓。
+        extract=False 時只下載（直接從 zip 讀圖的模式）。
+        """
+        sha = self.lookup(url)
+        if sha:
+            print(f"♻️ 使用下載快取：{url}")
+            return sha
+        token = f"{os.getpid()}_{threading.get_ident()}_{time.time_ns()}"
+        tmp = self.tmp / f"{token}.zip"
+        staging = self.tmp / f"tree_{token}"
+        try:
+            sink = stream_fetch.PipelineSink(tmp, staging if extract else None, label=label)
+            try:
+                downloader(sink)
+            finally:
+                digest = sink.close()
+            if sink.bytes == 0:
+                raise FileNotFoundError(f"下載失敗：{url}")
+            sha = self.add(url, tmp, sha=digest)
+            unzip = sink.unzip
+            if unzip is None:
+                pass
+            elif unzip.done and not unzip.fallback:
+                shutil.rmtree(staging / "__MACOSX", ignore_errors=True)
+                self._commit_tree(sha, staging, unzip.total_bytes)
+            else:
+                print(f"⚠️ 無法邊下載邊解壓（{unzip.fallback}），改為下載完成後解壓")
+        finally:
+            tmp.unlink(missing_ok=True)
+            shutil.rmtree(staging, ignore_errors=True)
+        return sha
+
+    def materialize(self, url: str, work_dir, downloader: Callable[[object], object], *,
+                    label: str = "") -> List[str]:
+        """
+        下載（或命中快取）並把解壓後的內容以 hardlink 放到 work_dir，
+        回傳放進 work_dir 的第一層檔名/目錄名。
+        downloader(output) 的 output 為可 write() 的物件（邊下載邊解壓）
+        """
+        sha = self.fetch_streaming(url, downloader, label=label)
+        tree = self.ensure_tree(sha)
+        work_dir = Path(work_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        top = sorted(p.name for p in tree.iterdir())
+        for name in top:
+            link_tree(tree / name, work_dir / name)
+        return top
+
+
+    def link_zip(self, url: str, dst, downloader: Callable[[object], object], *, label: str = "") -> Path:
+        """
+        下載（或命中快取）後把 zip 本身以 hardlink 放到 dst，不解壓
+        """
+        sha = self.fetch_streaming(url, downloader, label=label, extract=False)
+        dst = Path(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        link_tree(self.blob_path(sha), dst)
+        return dst
+
+
+def link_tree(src: Path, dst: Path) -> None:
+    """以 hardlink 複製目錄樹；跨檔案系統等無法 hardlink 時改用一般複製"""
+    if src.is_dir():
+        dst.mkdir(parents=True, exist_ok=True)
+        for child in src.iterdir():
+            link_tree(child, dst / child.name)
+        return
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -0,0 +1,199 @@
+# modules/governor.py
+# 功能：整台機器的執行緒 / 記憶體預算（app.py 啟動步驟子行程前先取得額度）
+# 1. 總預算：config 的 governor_threads（0 = CPU 核心數）與 governor_memory_mb（0 = 實體記憶體的 80%）
+# 2. 每個步驟的預算：STAGE_BUDGETS，可用 config 的 governor_budgets 覆寫，例如 "ocr_paddle=4:3072,merge_srt=2:2048"
+# 3. 額度不足時依到達順序排隊（先到先服務，避免大步驟一直被小步驟插隊）
+# 4. 子行程的 OMP / MKL / OpenBLAS 等執行緒上限設為該步驟的執行緒預算（thread_env()），
+#    PaddleOCR 未指定 paddle_cpu_threads 時也以 SUBTITLE_THREAD_BUDGET 為準
+# 5. 使用率：snapshot()（/governor）與 metrics 的 subtitle_governor_*
+#
+# 用法：
+#     lease = governor.get().acquire("ocr_paddle")
+#     env = {**os.environ, **governor.thread_env(lease.threads)}
+#     ...
+#     lease.release()
+
+from __future__ import annotations
+import itertools, os, threading, time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import config
+from modules import metrics
+
+ENV_THREADS = "SUBTITLE_THREAD_BUDGET"
+
+# 各步驟預設的 (執行緒數, 記憶體 MB)；未列出的步驟用 _DEFAULT_BUDGET
+STAGE_BUDGETS: Dict[str, Tuple[int, int]] = {
+    "download_assets": (1, 512),
+    "ocr_paddle": (4, 3072),
+    "ocr_cascade": (4, 3072),
+    "ocr_gemini": (2, 2048),      # _images_to_pdf 會把整批圖片載入記憶體
+    "trans": (1, 256),
+    "xml_to_srt": (1, 256),
+    "merge_srt": (2, 2048),       # SentenceTransformer
+}
+_DEFAULT_BUDGET = (1, 512)
+
+# 子行程的數值函式庫執行緒上限
+_THREAD_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "FLAGS_cpu_math_library_num_threads")
+
+
+def _total_memory_mb() -> int:
+    try:
+        import psutil
+        return psutil.virtual_memory().total // (1024 * 1024)
+    except ImportError:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+
+def _parse_budgets(text: str) -> Dict[str, Tuple[int, int]]:
+    """ "ocr_paddle=4:3072,merge_srt=2:2048" → {"ocr_paddle": (4, 3072), ...}"""
+    out = {}
+    for item in str(text or "").split(","):
+        if not item.strip():
+            continue
+        name, _, spec = item.partition("=")
+        threads, _, mem = spec.partition(":")
+        try:
+            out[name.strip()] = (int(threads), int(mem or _DEFAULT_BUDGET[1]))
+        except ValueError:
+            raise ValueError(f"governor_budgets 格式錯誤：{item}（應為 步驟=執行緒:MB）")
+    return out
+
+
+def thread_env(threads: int) -> Dict[str, str]:
+    """子行程的執行緒上限環境變數"""
+    n = str(max(1, int(threads)))
+    return {**{k: n for k in _THREAD_VARS}, ENV_THREADS: n}
+
+
+class Lease:
+    """一次取得的額度；release() 可重複呼叫"""
+
+    def __init__(self, gov: "Governor", stage: str, threads: int, memory_mb: int, waited: float):
+        self._gov = gov
+        self.stage, self.threads, self.memory_mb, self.waited = stage, threads, memory_mb, waited
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._gov._release(self)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class Governor:
+    def __init__(self, threads: Optional[int] = None, memory_mb: Optional[int] = None,
+                 budgets: Optional[Dict[str, Tuple[int, int]]] = None):
+        cfg = config.load_config()
+        threads = threads or int(cfg.get("governor_threads") or 0) or (os.cpu_count() or 1)
+        memory_mb = memory_mb or int(cfg.get("governor_memory_mb") or 0) or int(_total_memory_mb() * 0.8)
+        self.total_threads, self.total_memory_mb = int(threads), int(memory_mb)
+        self.budgets = {**STAGE_BUDGETS, **_parse_budgets(cfg.get("governor_budgets")), **(budgets or {})}
+        self.used_threads = self.used_memory_mb = 0
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._tickets = itertools.count()
+        self._running: List[Lease] = []
+        self._publish()
+
+    def budget_for(self, *stages: str) -> Tuple[int, int]:
+        """一或多個步驟（同時執行）的預算總和，不超過總預算"""
+        threads = sum(self.budgets.get(s, _DEFAULT_BUDGET)[0] for s in stages)
+        memory = sum(self.budgets.get(s, _DEFAULT_BUDGET)[1] for s in stages)
+        return min(threads, self.total_threads), min(memory, self.total_memory_mb)
+
+    def _fits(self, threads: int, memory_mb: int) -> bool:
+        return (self.used_threads + threads <= self.total_threads
+                and self.used_memory_mb + memory_mb <= self.total_memory_mb)
+
+    def acquire(self, *stages: str, timeout: Optional[float] = None) -> Lease:
+        """
+        取得 stages（同時執行的一或多個步驟）的額度；不足時排隊等待
+        timeout 到了仍未取得時丟 TimeoutError
+        """
+        name = "+".join(stages)
+        threads, memory_mb = self.budget_for(*stages)
+        ticket = next(self._tickets)
+        t0 = time.monotonic()
+        with self._cond:
+            self._queue.append(ticket)
+            self._publish()
+            try:
+                announced = False
+                while not (self._queue[0] == ticket and self._fits(threads, memory_mb)):
+                    if not announced:
+                        print(f"⏸️ {name} 等待資源（需 {threads} 執行緒 / {memory_mb} MB，"
+                              f"使用中 {self.used_threads}/{self.total_threads}、"
+                              f"{self.used_memory_mb}/{self.total_memory_mb} MB，排隊 {len(self._queue) - 1}）",
+                              flush=True)
+                        announced = True
+                    left = None if timeout is None else timeout - (time.monotonic() - t0)
+                    if left is not None and left <= 0:
+                        raise TimeoutError(f"{name} 等待資源逾時")
+                    self._cond.wait(left)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                self._publish()
+                raise
+            self._queue.popleft()
+            self.used_threads += threads
+            self.used_memory_mb += memory_mb
+            lease = Lease(self, name, threads, memory_mb, time.monotonic() - t0)
+            self._running.append(lease)
+            self._publish()
+            # 後面排隊的也許放得下
+            self._cond.notify_all()
+        metrics.observe("subtitle_governor_wait_seconds", lease.waited, stage=name)
+        return lease
+
+    def _release(self, lease: Lease) -> None:
+        with self._cond:
+            self.used_threads -= lease.threads
+            self.used_memory_mb -= lease.memory_mb
+            self._running.remove(lease)
+            self._publish()
+            self._cond.notify_all()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("subtitle_governor_threads", self.total_threads, kind="capacity")
+        metrics.set_gauge("subtitle_governor_threads", self.used_threads, kind="in_use")
+        metrics.set_gauge("subtitle_governor_memory_bytes", self.total_memory_mb * 1024 * 1024, kind="capacity")
+        metrics.set_gauge("subtitle_governor_memory_bytes", self.used_memory_mb * 1024 * 1024, kind="in_use")
+        metrics.set_gauge("subtitle_governor_queued", len(self._queue))
+        metrics.set_max("subtitle_governor_threads_peak", self.used_threads)
+        metrics.set_max("subtitle_governor_memory_peak_bytes", self.used_memory_mb * 1024 * 1024)
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                "threads": {"capacity": self.total_threads, "in_use": self.used_threads,
+                            "utilization": round(self.used_threads / self.total_threads, 3)},
+                "memory_mb": {"capacity": self.total_memory_mb, "in_use": self.used_memory_mb,
+                              "utilization": round(self.used_memory_mb / self.total_memory_mb, 3)},
+                "running": [{"stage": l.stage, "threads": l.threads, "memory_mb": l.memory_mb}
+                            for l in self._running],
+                "queued": len(self._queue),
+                "budgets": {k: {"threads": t, "memory_mb": m} for k, (t, m) in sorted(self.budgets.items())},
+            }
+
+
+_governor: Optional[Governor] = None
+_governor_lock = threading.Lock()
+
+
+def get() -> Governor:
+    """行程共用的 Governor（第一次呼叫時依 config 建立）"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = Governor()
+        return _governor
@@ -0,0 +1,161 @@
+# modules/handoff.py
+# 功能：OCR → 翻譯 → SRT 各階段之間的中繼檔
+# 1. JsonlWriter：逐筆附加寫入 data/img_to_text_{語言}.jsonl
+#    每行一筆 {"key": "subtitle_0001.png", "text": "..."}，寫完再補一行 {"_eof": true}
+# 2. iter_records()：讀取中繼檔；follow=True 時會持續追讀成長中的檔案，直到讀到 _eof
+# 3. load_texts()：回傳 {key: text}；同一個 key 出現多次時以最後一筆為準
+#    也相容舊版整份 JSON（img_to_text_{語言}.json）
+
+from __future__ import annotations
+import json, os, time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+PathLike = Union[str, "os.PathLike[str]"]
+EOF_KEY = "_eof"
+
+
+def texts_path(lang: str, data_dir: PathLike = "data", *, prefer_existing: bool = True) -> Path:
+    """
+    回傳某語言的中繼檔路徑：優先 .jsonl；若只有舊版 .json 則回傳 .json。
+    prefer_existing=False 時一律回傳 .jsonl（寫入端使用）。
+    """
+    jsonl = Path(data_dir) / f"img_to_text_{lang}.jsonl"
+    if not prefer_existing or jsonl.exists():
+        return jsonl
+    legacy = jsonl.with_suffix(".json")
+    return legacy if legacy.exists() else jsonl
+
+
+def shard_path(lang: str, shard: int, data_dir: PathLike = "data") -> Path:
+    """分片 OCR（工作佇列）各分片的中繼檔；全部完成後由 collect 步驟合併成 texts_path()"""
+    return Path(data_dir) / f"img_to_text_{lang}.part{shard:03d}.jsonl"
+
+
+class JsonlWriter:
+    """
+    逐筆寫入 JSONL；第一筆寫入時才建立檔案（沒有結果就不留空檔）。
+    每筆寫完即 flush，讓下游可以邊寫邊讀。
+
+    用法：
+        with JsonlWriter("data/img_to_text_en.jsonl") as w:
+            w.write("subtitle_0001.png", "Hello")
+    """
+
+    def __init__(self, path: PathLike, *, fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.count = 0
+        self._f = None
+
+    def _open(self):
+        if self._f is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._f = open(self.path, "w", encoding="utf-8")
+        return self._f
+
+    def write(self, key: str, text: str, **extra) -> None:
+        rec = {"key": key, "text": text, **extra}
+        self.write_record(rec)
+
+    def write_record(self, rec: dict) -> None:
+        f = self._open()
+        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        self.count += 1
+
+    def __call__(self, key: str, text: str, **extra) -> None:
+        # 可直接當作 on_result 回呼
+        self.write(key, text, **extra)
+
+    def close(self, error: Optional[str] = None) -> None:
+        if self._f is None:
+            return
+        eof = {EOF_KEY: True, "count": self.count}
+        if error:
+            eof["error"] = error
+        self._f.write(json.dumps(eof, ensure_ascii=False) + "\n")
+        self._f.close()
+        self._f = None
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(error=f"{exc_type.__name__}: {exc}" if exc_type else None)
+
+
+def wait_for(paths: Iterable[PathLike], *, timeout: Optional[float] = None,
+             poll: float = 0.5) -> Optional[Path]:
+    """等待任一路徑出現，回傳第一個存在的路徑；逾時回傳 None"""
+    paths = [Path(p) for p in paths]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        for p in paths:
+            if p.exists():
+                return p
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        time.sleep(poll)
+
+
+def iter_records(path: PathLike, *, follow: bool = False, poll: float = 0.5,
+                 idle_timeout: Optional[float] = None) -> Iterator[dict]:
+    """
+    逐筆讀取中繼檔，產生 {"key":..., "text":..., ...}。
+    - .json（舊版）：整份讀入後依序產生
+    - .jsonl：逐行讀取；follow=True 時讀到檔尾會等待新資料，直到 _eof 或閒置超過 idle_timeout 秒
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"字幕 JSON 應為 dict 格式 {{key: value}}：{path}")
+        for k, v in data.items():
+            yield {"key": str(k), "text": "" if v is None else str(v)}
+        return
+
+    if follow and wait_for([path], timeout=idle_timeout, poll=poll) is None:
+        raise TimeoutError(f"等待中繼檔逾時：{path}")
+
+    with open(path, "r", encoding="utf-8") as f:
+        partial = ""
+        last_data = time.monotonic()
+        while True:
+            line = f.readline()
+            if line and not line.endswith("\n"):
+                # 寫入端尚未寫完這一行，先暫存
+                partial += line
+                line = ""
+            if not line:
+                if not follow:
+                    if partial.strip():
+                        rec = json.loads(partial)
+                        if EOF_KEY not in rec:
+                            yield rec
+                    return
+                if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                    raise TimeoutError(f"中繼檔閒置逾時：{path}")
+                time.sleep(poll)
+                continue
+            line, partial = partial + line, ""
+            last_data = time.monotonic()
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec.get(EOF_KEY):
+                if rec.get("error"):
+                    print(f"⚠️ 上游階段異常結束：{rec['error']}")
+                return
+            yield rec
+
+
+def load_texts(path: PathLike, *, follow: bool = False, **kwargs) -> Dict[str, str]:
+    """讀成 {key: text}；同 key 以最後一筆為準"""
+    out: Dict[str, str] = {}
+    for rec in iter_records(path, follow=follow, **kwargs):
+        out[str(rec["key"])] = "" if rec.get("text") is None else str(rec["text"])
+    return out
@@ -0,0 +1,176 @@
+# modules/hedge.py
+# 功能：Gemini 請求的避險（hedging）與整體期限
+# 1. LatencyTracker：依操作（ocr / translate）記錄最近成功請求的延遲（以每單位秒數計，例如每頁 / 每筆），
+#    取滾動百分位數（config 的 gemini_hedge_percentile）作為避險門檻
+# 2. call()：請求超過門檻仍未回應時，再送一份相同請求；先成功的為準，另一份收到取消訊號
+#    （進行中的 HTTP 請求無法中斷，取消只在請求函式的步驟之間生效，例如上傳完不再送辨識）
+# 3. Deadline：單一工作的整體期限（config 的 gemini_job_deadline 秒，0 = 不限制），
+#    每次請求的 timeout 不超過剩餘時間，剩餘時間不夠時不再重試、也不再避險
+#
+# 用法：
+#     deadline = hedge.Deadline.from_config()
+#     text = hedge.call(lambda cancel: _gemini_ocr_one(..., cancel=cancel), op="ocr", units=pages, deadline=deadline)
+
+from __future__ import annotations
+import math, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+import config
+from modules import metrics, rate_limit
+
+T = TypeVar("T")
+
+
+class Cancelled(Exception):
+    """避險請求中落敗的一方在步驟之間發現已被取消"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """工作的整體期限已到，不再送出請求"""
+
+
+class LatencyTracker:
+    """最近 window 次成功請求的每單位延遲；樣本數不足 min_samples 時不避險"""
+
+    def __init__(self, window: int = 50, min_samples: int = 5):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, units: float = 1) -> None:
+        with self._lock:
+            self._samples.append(seconds / max(units, 1e-9))
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            data = sorted(self._samples)
+        idx = min(len(data) - 1, max(0, math.ceil(q * len(data)) - 1))
+        return data[idx]
+
+
+class Deadline:
+    """整體期限；seconds 為 None / 0 時不限制"""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.end = time.monotonic() + seconds if seconds else None
+
+    @classmethod
+    def from_config(cls) -> "Deadline":
+        try:
+            seconds = float(config.load_config().get("gemini_job_deadline") or 0)
+        except (TypeError, ValueError):
+            seconds = 0.0
+        return cls(seconds)
+
+    def remaining(self) -> float:
+        return math.inf if self.end is None else max(0.0, self.end - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, timeout_sec: float) -> float:
+        """單次請求可用的 timeout（不超過剩餘時間）；期限已到時丟 DeadlineExceeded"""
+        left = self.remaining()
+        if left <= 0:
+            metrics.inc("subtitle_gemini_deadline_exceeded_total")
+            raise DeadlineExceeded("已超過工作期限（gemini_job_deadline），不再送出請求")
+        return min(float(timeout_sec), left)
+
+    def allows(self, seconds: float) -> bool:
+        """剩餘時間是否還夠等 seconds（用來決定要不要再重試）"""
+        return self.remaining() > seconds
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker(op: str) -> LatencyTracker:
+    with _trackers_lock:
+        t = _trackers.get(op)
+        if t is None:
+            cfg = config.load_config()
+            t = _trackers[op] = LatencyTracker(
+                window=int(cfg.get("gemini_hedge_window") or 50),
+                min_samples=int(cfg.get("gemini_hedge_min_samples") or 5),
+            )
+        return t
+
+
+def _percentile() -> float:
+    try:
+        return float(config.load_config().get("gemini_hedge_percentile") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def expected_seconds(op: str, units: float = 1) -> Optional[float]:
+    """目前的中位數延遲估計（重試前判斷剩餘時間夠不夠用）"""
+    p50 = tracker(op).percentile(0.5)
+    return None if p50 is None else p50 * units
+
+
+def call(fn: Callable[[threading.Event], T], *, op: str, units: float = 1,
+         deadline: Optional[Deadline] = None) -> T:
+    """
+    執行 fn(cancel)，必要時避險。fn 應在各步驟之間檢查 cancel.is_set()（已被取消就丟 Cancelled）
+    - 門檻 = 該 op 的滾動百分位延遲 × units；gemini_hedge_percentile 為 0 或樣本不足時不避險
+    - 剩餘期限不到門檻的兩倍時也不避險（多送一份來不及回應，只會浪費額度）
+    - 兩份都失敗時丟出先送出那份的例外
+    """
+    q = _percentile()
+    lat = tracker(op)
+    per_unit = lat.percentile(q) if 0 < q < 1 else None
+    delay = None if per_unit is None else per_unit * units
+    if delay is not None and deadline is not None and not deadline.allows(2 * delay):
+        delay = None
+
+    t0 = time.perf_counter()
+    if delay is None:
+        result = fn(threading.Event())
+        lat.record(time.perf_counter() - t0, units)
+        return result
+
+    cancels = [threading.Event(), threading.Event()]
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"gemini-{op}")
+    try:
+        primary = pool.submit(fn, cancels[0])
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            result = primary.result()
+            lat.record(time.perf_counter() - t0, units)
+            return result
+
+        metrics.inc("subtitle_gemini_hedges_total", op=op)
+        print(f"⏳ Gemini {op} 請求超過 {delay:.1f}s（p{q * 100:g}），送出避險請求")
+
+        def hedged(cancel):
+            rate_limit.acquire()
+            if cancel.is_set():
+                raise Cancelled()
+            return fn(cancel)
+
+        futures = {primary: ("primary", 0), pool.submit(hedged, cancels[1]): ("hedge", 1)}
+        pending = set(futures)
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, idx = futures[fut]
+                if fut.exception() is None:
+                    lat.record(time.perf_counter() - t0, units)
+                    metrics.inc("subtitle_gemini_hedge_wins_total", op=op, winner=name)
+                    # 落敗的一方：通知取消，進行中的 RPC 結果會被丟棄
+                    cancels[1 - idx].set()
+                    if pending:
+                        metrics.inc("subtitle_gemini_hedge_wasted_total", op=op)
+                    return fut.result()
+                if name == "primary" or first_error is None:
+                    first_error = fut.exception()
+        raise first_error
+    finally:
+        pool.shutdown(wait=False)
@@ -0,0 +1,131 @@
+# modules/image_source.py
+# 功能：字幕圖片來源抽象
+# - DirImageSource：已解壓的 data/{file_name}/ 資料夾
+# - ZipImageSource：直接從 data/{file_name}.zip 隨機讀取成員，不必解壓（省下寫入與 inode）
+# 兩者都以「檔名（不含路徑）」作為 key，與原本 os.walk 取得的 file 相同；
+# 不同資料夾裡有同名檔案時無法分辨，直接丟 ValueError（不讓後者默默蓋掉前者）
+#
+# 用法：
+#     with image_source.open_source("再見柏林中文") as src:
+#         for name in src.names("*.png"):
+#             img = src.open_image(name)
+
+from __future__ import annotations
+import abc, fnmatch, io, os, zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_XML_NAME = "subtitle.xml"
+
+
+def _skip(member: str) -> bool:
+    parts = member.replace("\\", "/").split("/")
+    return "__MACOSX" in parts or parts[-1].startswith("._") or parts[-1] == ".DS_Store"
+
+
+class ImageSource(abc.ABC):
+    """共用介面；子類別建立 _index（以 _add 加入）並實作 read_bytes"""
+
+    label = ""
+
+    def __init__(self):
+        self._index: Dict[str, str] = {}
+
+    def names(self, pattern: Optional[str] = None) -> List[str]:
+        """依檔名排序回傳所有檔案（不含 subtitle.xml）；pattern 為 fnmatch 樣式"""
+        out = [n for n in self._index if n != _XML_NAME]
+        if pattern:
+            out = [n for n in out if fnmatch.fnmatch(n.lower(), pattern.lower())]
+        return sorted(out)
+
+    def _add(self, member: str) -> None:
+        """以檔名為 key 加入 member（完整路徑）；檔名重複時丟 ValueError"""
+        name = member.replace("\\", "/").rsplit("/", 1)[-1]
+        if name in self._index:
+            raise ValueError(f"{self.label} 內有重複的檔名 {name}：{self._index[name]} 與 {member}")
+        self._index[name] = member
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    @abc.abstractmethod
+    def read_bytes(self, name: str) -> bytes:
+        """讀取 name 的原始內容"""
+
+    def local_path(self, name: str) -> Optional[str]:
+        """若圖片本來就在磁碟上，回傳路徑（OCR 引擎可直接讀檔）；否則 None"""
+        return None
+
+    def open_image(self, name: str):
+        """回傳已載入記憶體的 PIL.Image"""
+        from PIL import Image
+        im = Image.open(io.BytesIO(self.read_bytes(name)))
+        im.load()
+        return im
+
+    def read_xml(self) -> Optional[bytes]:
+        return self.read_bytes(_XML_NAME) if _XML_NAME in self._index else None
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "ImageSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class DirImageSource(ImageSource):
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = Path(folder)
+        self.label = str(self.folder)
+        for root, dirs, files in os.walk(self.folder):
+            for file in files:
+                path = os.path.join(root, file)
+                if not _skip(os.path.relpath(path, self.folder)):
+                    self._add(path)
+
+    def read_bytes(self, name: str) -> bytes:
+        with open(self._index[name], "rb") as f:
+            return f.read()
+
+    def local_path(self, name: str) -> Optional[str]:
+        return self._index[name]
+
+
+class ZipImageSource(ImageSource):
+    def __init__(self, zip_path):
+        super().__init__()
+        self.zip_path = Path(zip_path)
+        self.label = str(self.zip_path)
+        self._zip = zipfile.ZipFile(self.zip_path, "r")
+        try:
+            for info in self._zip.infolist():
+                if not (info.is_dir() or _skip(info.filename)):
+                    self._add(info.filename)
+        except ValueError:
+            self._zip.close()
+            raise
+
+    def read_bytes(self, name: str) -> bytes:
+        return self._zip.read(self._index[name])
+
+    def close(self) -> None:
+        self._zip.close()
+
+
+def zip_path_for(file_name: str, data_dir: str = "data") -> Path:
+    return Path(data_dir) / f"{file_name}.zip"
+
+
+def open_source(file_name: str, data_dir: str = "data") -> ImageSource:
+    """優先使用 data/{file_name}.zip，其次 data/{file_name}/ 資料夾"""
+    zp = zip_path_for(file_name, data_dir)
+    if zp.is_file():
+        return ZipImageSource(zp)
+    folder = Path(data_dir) / file_name
+    if folder.is_dir():
+        return DirImageSource(folder)
+    raise FileNotFoundError(f"找不到字幕圖片：{zp} 或 {folder}/")
@@ -0,0 +1,222 @@
+# modules/job_queue.py
+# 功能：以 SQLite 實作的步驟層級工作佇列（可放在多台機器共用的檔案系統上）
+# - job：一部片；task：job 內的一個步驟（下載、OCR 分片、翻譯、合併…），可設定相依
+# - worker 以 claim() 取得 task 並取得租約（lease），執行期間定期 heartbeat() 延長租約
+# - 租約過期（worker 當掉、斷線）的 task 會在下次 claim 時放回佇列重試，超過 max_attempts 視為失敗
+# - 任一 task 最終失敗 → job 失敗，尚未執行的後續 task 取消
+#
+# 不使用 WAL（網路檔案系統上不可靠），以 BEGIN IMMEDIATE + busy timeout 序列化寫入
+
+from __future__ import annotations
+import json, os, socket, sqlite3, time, uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    title       TEXT NOT NULL,
+    work_dir    TEXT NOT NULL,
+    status      TEXT NOT NULL,            -- pending / running / done / failed
+    error       TEXT,
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id        TEXT NOT NULL REFERENCES jobs(id),
+    name          TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL,          -- pending / leased / done / failed / cancelled
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    heartbeat_at  REAL,
+    result        TEXT,
+    error         TEXT,
+    started       REAL,
+    finished      REAL,
+    created       REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS task_deps (
+    task_id INTEGER NOT NULL REFERENCES tasks(id),
+    dep_id  INTEGER NOT NULL REFERENCES tasks(id),
+    PRIMARY KEY (task_id, dep_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_job ON tasks(job_id);
+"""
+
+
+def new_job_id() -> str:
+    return time.strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6]
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, path: Optional[str] = None, *, busy_timeout: float = 60):
+        cfg = config.load_config()
+        path = Path(path or cfg.get("queue_path") or "cache/queue.sqlite")
+        if not path.is_absolute():
+            path = Path(config.CONFIG_PATH).parent / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(str(path), timeout=busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    # --------- 交易 ---------
+    def _tx(self):
+        db = self._db
+
+        class _Tx:
+            def __enter__(self_):
+                db.execute("BEGIN IMMEDIATE")
+                return db
+
+            def __exit__(self_, exc_type, *exc):
+                db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+        return _Tx()
+
+    # --------- 建立 ---------
+    def enqueue_job(self, title: Dict, work_dir: str, tasks: Sequence[Dict],
+                    job_id: Optional[str] = None, max_attempts: int = 3) -> str:
+        """
+        tasks：[{"name": 唯一名稱, "kind": 種類, "payload": {...}, "deps": [其他 task 的 name]}]
+        """
+        job_id = job_id or new_job_id()
+        now = time.time()
+        with self._tx() as db:
+            db.execute("INSERT INTO jobs (id, title, work_dir, status, created, updated) VALUES (?,?,?,?,?,?)",
+                       (job_id, json.dumps(title, ensure_ascii=False), str(work_dir), "pending", now, now))
+            ids: Dict[str, int] = {}
+            for t in tasks:
+                cur = db.execute(
+                    "INSERT INTO tasks (job_id, name, kind, payload, status, max_attempts, created) "
+                    "VALUES (?,?,?,?,?,?,?)",
+                    (job_id, t["name"], t["kind"], json.dumps(t.get("payload") or {}, ensure_ascii=False),
+                     "pending", t.get("max_attempts", max_attempts), now))
+                ids[t["name"]] = cur.lastrowid
+                for dep in t.get("deps", []):
+                    db.execute("INSERT INTO task_deps (task_id, dep_id) VALUES (?,?)", (cur.lastrowid, ids[dep]))
+        return job_id
+
+    # --------- 租約 ---------
+    def _requeue_expired(self, db, now: float) -> None:
+        expired = db.execute("SELECT id, job_id, attempts, max_attempts FROM tasks "
+                             "WHERE status='leased' AND lease_expires < ?", (now,)).fetchall()
+        for row in expired:
+            if row["attempts"] >= row["max_attempts"]:
+                self._fail_task(db, row["id"], row["job_id"], "租約過期且已達重試上限", now)
+            else:
+                db.execute("UPDATE tasks SET status='pending', lease_owner=NULL, lease_expires=NULL, "
+                           "error=? WHERE id=?", ("租約過期，重新排入佇列", row["id"]))
+
+    def claim(self, worker_id: Optional[str] = None, lease_seconds: float = 300,
+              kinds: Optional[Sequence[str]] = None) -> Optional[Dict]:
+        """取得一個相依皆已完成的 pending task；沒有可做的回傳 None"""
+        worker_id = worker_id or default_worker_id()
+        now = time.time()
+        kind_sql, args = "", []
+        if kinds:
+            kind_sql = f" AND t.kind IN ({','.join('?' * len(kinds))})"
+            args = list(kinds)
+        with self._tx() as db:
+            self._requeue_expired(db, now)
+            row = db.execute(
+                "SELECT t.* FROM tasks t JOIN jobs j ON j.id=t.job_id "
+                "WHERE t.status='pending' AND j.status IN ('pending','running')" + kind_sql +
+                " AND NOT EXISTS (SELECT 1 FROM task_deps d JOIN tasks p ON p.id=d.dep_id "
+                "                 WHERE d.task_id=t.id AND p.status!='done') "
+                "ORDER BY t.id LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET status='leased', lease_owner=?, lease_expires=?, heartbeat_at=?, "
+                       "attempts=attempts+1, started=? WHERE id=?",
+                       (worker_id, now + lease_seconds, now, now, row["id"]))
+            db.execute("UPDATE jobs SET status='running', updated=? WHERE id=? AND status='pending'",
+                       (now, row["job_id"]))
+            job = db.execute("SELECT title, work_dir FROM jobs WHERE id=?", (row["job_id"],)).fetchone()
+        task = dict(row)
+        task["payload"] = json.loads(task["payload"])
+        task["attempts"] += 1
+        task["title"] = json.loads(job["title"])
+        task["work_dir"] = job["work_dir"]
+        return task
+
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float = 300) -> bool:
+        """延長租約；回傳 False 表示租約已被收回（不應再提交結果）"""
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute("UPDATE tasks SET lease_expires=?, heartbeat_at=? "
+                             "WHERE id=? AND lease_owner=? AND status='leased'",
+                             (now + lease_seconds, now, task_id, worker_id))
+            return cur.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result=None) -> bool:
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute("UPDATE tasks SET status='done', result=?, finished=?, lease_expires=NULL "
+                             "WHERE id=? AND lease_owner=? AND status='leased'",
+                             (json.dumps(result, ensure_ascii=False), now, task_id, worker_id))
+            if cur.rowcount != 1:
+                return False
+            job_id = db.execute("SELECT job_id FROM tasks WHERE id=?", (task_id,)).fetchone()["job_id"]
+            left = db.execute("SELECT COUNT(*) FROM tasks WHERE job_id=? AND status!='done'", (job_id,)).fetchone()[0]
+            if left == 0:
+                db.execute("UPDATE jobs SET status='done', updated=? WHERE id=?", (now, job_id))
+            return True
+
+    def fail(self, task_id: int, worker_id: str, error: str, retry: bool = True) -> bool:
+        now = time.time()
+        with self._tx() as db:
+            row = db.execute("SELECT job_id, attempts, max_attempts FROM tasks "
+                             "WHERE id=? AND lease_owner=? AND status='leased'", (task_id, worker_id)).fetchone()
+            if row is None:
+                return False
+            if retry and row["attempts"] < row["max_attempts"]:
+                db.execute("UPDATE tasks SET status='pending', lease_owner=NULL, lease_expires=NULL, error=? "
+                           "WHERE id=?", (error, task_id))
+            else:
+                self._fail_task(db, task_id, row["job_id"], error, now)
+            return True
+
+    def _fail_task(self, db, task_id: int, job_id: str, error: str, now: float) -> None:
+        db.execute("UPDATE tasks SET status='failed', error=?, finished=?, lease_expires=NULL WHERE id=?",
+                   (error, now, task_id))
+        db.execute("UPDATE tasks SET status='cancelled' WHERE job_id=? AND status='pending'", (job_id,))
+        db.execute("UPDATE jobs SET status='failed', error=?, updated=? WHERE id=?", (error, now, job_id))
+
+    # --------- 查詢 ---------
+    def job_status(self, job_id: str) -> Optional[Dict]:
+        job = self._db.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        tasks = self._db.execute(
+            "SELECT id, name, kind, status, attempts, lease_owner, error, started, finished "
+            "FROM tasks WHERE job_id=? ORDER BY id", (job_id,)).fetchall()
+        out = dict(job)
+        out["title"] = json.loads(out["title"])
+        out["tasks"] = [dict(t) for t in tasks]
+        return out
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        rows = self._db.execute("SELECT id, status, error, created, updated FROM jobs "
+                                "ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def pending_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending','leased')").fetchone()[0]
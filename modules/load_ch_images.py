@@ -1,8 +1,9 @@
 import os
-import zipfile
-import gdown
+import shutil
+import config
+from modules import download_cache, image_source, stream_fetch
 
-def run(file_name_ch: str, url: str, work_dir: str = "data/"):
+def run(file_name_ch: str, url: str, work_dir: str = "data/", mode: str | None = None):
     """
     下載英文字幕圖片 zip 檔並解壓到本地資料夾。
 
@@ -10,29 +11,54 @@ def run(file_name_ch: str, url: str, work_dir: str = "data/"):
         file_name_en (str): 資料夾命名（例："輕量版__中文測試"）
         url (str): Google Drive 檔案連結
         work_dir (str): 解壓後的工作路徑，預設 data/en_imgs
+        mode (str|None): "zip" 只保留 zip（OCR 直接從 zip 讀圖）；"dir" 解壓成資料夾。
+            預設讀 config 的 image_source
     """
     os.makedirs(work_dir, exist_ok=True)
-    output = os.path.join(work_dir, "ch_images.zip")
 
-    print(f"下載中：{url}")
-    gdown.download(url=url, output=output, fuzzy=True)
+    def _download(output):
+        print(f"下載中：{url}")
+        stream_fetch.download(url, output)
 
-    print("正在解壓縮...")
-    with zipfile.ZipFile(output, 'r') as zip_ref:
-        zip_ref.extractall(work_dir)
+    cache = download_cache.DownloadCache()
+    mode = (mode or config.load_config().get("image_source") or "zip").lower()
 
-    os.remove(output)  # 刪除 zip
+    if mode == "zip":
+        # 不解壓：zip 放到 data/{file_name_ch}.zip，只取出 subtitle.xml
+        zip_path = cache.link_zip(url, image_source.zip_path_for(file_name_ch, work_dir), _download, label="ch")
+        with image_source.ZipImageSource(zip_path) as source:
+            xml = source.read_xml()
+            print(f"共 {len(source.names())} 個檔案，直接從 zip 讀取")
+        if xml is not None:
+            with open(os.path.join(work_dir, "subtitle_ch.xml"), "wb") as f:
+                f.write(xml)
+        print("字幕圖片載入完成（zip 模式）！")
+        return
 
-    # 移除 __MACOSX 與多餘資料夾
-    macosx = os.path.join(work_dir, "__MACOSX")
-    if os.path.exists(macosx):
-        import shutil
-        shutil.rmtree(macosx)
+    # 經由下載快取：同一個 URL 已下載過就不再重抓；已解壓過則直接 hardlink
+    # 未命中時邊下載邊解壓，進度（MB/s、已解壓檔案數）會印在 log
+    # 先解壓到各語言自己的暫存目錄：中英文同時下載時，第一層同名的檔案 / 資料夾不會互相覆蓋
+    staging = os.path.join(work_dir, ".staging_ch")
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)  # 上次中斷留下的暫存
+    top = cache.materialize(url, staging, _download, label="ch")
+    stale_zip = image_source.zip_path_for(file_name_ch, work_dir)
+    if stale_zip.exists():
+        stale_zip.unlink()  # 避免 OCR 讀到上次 zip 模式留下的檔案
 
-    # 找出最新資料夾並重新命名
-    latest = max([d for d in os.listdir(work_dir) if os.path.isdir(os.path.join(work_dir, d))],
-                 key=lambda d: os.path.getmtime(os.path.join(work_dir, d)))
-    os.rename(os.path.join(work_dir, latest), os.path.join(work_dir, file_name_ch))
+    # 找出 zip 內的資料夾，搬到 data/{file_name_ch}
+    dirs = [d for d in top if d != "__MACOSX" and os.path.isdir(os.path.join(staging, d))]
+    target = os.path.join(work_dir, file_name_ch)
+    if os.path.isdir(target):
+        shutil.rmtree(target)  # 上次執行留下的舊目錄
+    if dirs:
+        os.rename(os.path.join(staging, dirs[0]), target)
+    else:
+        # zip 第一層直接是圖片 → 收進同名資料夾
+        os.makedirs(target, exist_ok=True)
+        for name in top:
+            os.rename(os.path.join(staging, name), os.path.join(target, name))
+    shutil.rmtree(staging, ignore_errors=True)
 
     # 如果有 subtitle.xml，統一命名
     src_xml = os.path.join(work_dir, file_name_ch, "subtitle.xml")
@@ -1,148 +1,315 @@
+import bisect
 import os
+import random
 import re
-from sentence_transformers import SentenceTransformer, util
+import config
+from modules import align, srt_, metrics
 
-def merge_bilingual_srt(ch_srt_name="subtitle_ch.srt",
-                        en_srt_name="subtitle_en.srt",
-                        output_dir="output",
-                        semantic_weight=0.5,
-                        time_weight=0.5):
-    """
-    合併中英 SRT 檔案（放在 output/ 資料夾中），
-    產生 merged.srt
-    """
+MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+_model = None
 
-    os.makedirs(output_dir, exist_ok=True)
+# 以全形空白連接多人對話的語言；其餘語言用半形空白
+_CJK_LANGS = {"ch", "zh", "cht", "chs", "ja"}
 
-    # ====== 1. 讀取並解析 srt 檔案 ======
-    def parse_srt(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        blocks = content.strip().split("\n\n")
-        srt_list = []
-        for block in blocks:
-            lines = block.strip().splitlines()
-            if len(lines) >= 3:
-                index = lines[0].strip()
-                timecode = lines[1].strip()
-                text = "\n".join(lines[2:]).strip()
-                srt_list.append([index, timecode, text])
-        return srt_list
-
-    def print_first_n(records, n=10):
-        for rec in records[:n]:
-            print(rec)
-
-    # ====== 2. 處理兩人講話的格式 ======
-    def process_dialogue(text, lang="ch"):
-        lines = [line.strip() for line in text.splitlines() if line.strip() != ""]
-        processed_lines = []
-        for i, line in enumerate(lines):
-            if i == 0:
-                processed_lines.append(line)
-            else:
-                if not line.startswith("-"):
-                    processed_lines.append("-" + line)
-                else:
-                    processed_lines.append(line)
-        if lang == "ch":
-            return "\u3000".join(processed_lines)
+
+def _get_model():
+    """同一行程只載入一次語意模型（批次模式下每個 worker 各載一次）"""
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+# ====== 1. 讀取並解析 srt 檔案（串流解析，見 modules/srt_.py） ======
+def _parse_srt(file_path):
+    return [[cue.index, cue.timecode, cue.text.strip()]
+            for cue in srt_.iter_srt(file_path) if cue.text.strip()]
+
+
+def _print_first_n(records, n=10):
+    for rec in records[:n]:
+        print(rec)
+
+
+# ====== 2. 處理兩人講話的格式 ======
+def _process_dialogue(text, lang="ch"):
+    lines = [line.strip() for line in text.splitlines() if line.strip() != ""]
+    processed_lines = []
+    for i, line in enumerate(lines):
+        if i == 0:
+            processed_lines.append(line)
         else:
-            return " ".join(processed_lines)
-
-    # ====== 3. 時間解析相關 ======
-    def time_str_to_seconds(t):
-        h, m, s_milli = t.split(":")
-        s, milli = s_milli.split(",")
-        return int(h) * 3600 + int(m) * 60 + int(s) + int(milli) / 1000.0
-
-    def get_time_bounds(timecode):
-        start_str, end_str = timecode.split(" --> ")
-        start_seconds = time_str_to_seconds(start_str)
-        end_seconds = time_str_to_seconds(end_str)
-        return start_seconds, end_seconds
-
-    def compute_overlap(start1, end1, start2, end2):
-        overlap = max(0, min(end1, end2) - max(start1, start2))
-        return overlap
-
-    # ====== 4. 合併邏輯 ======
-    def merge_subtitles(ch_srt, en_srt, semantic_weight=0.5, time_weight=0.5):
-        model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-
-        chinese_records = []
-        for rec in ch_srt:
-            index, timecode, text = rec
-            start, end = get_time_bounds(timecode)
-            processed_text = process_dialogue(text, lang="ch")
-            ch_embedding = model.encode(processed_text, convert_to_tensor=True)
-            chinese_records.append({
+            if not line.startswith("-"):
+                processed_lines.append("-" + line)
+            else:
+                processed_lines.append(line)
+    if lang in _CJK_LANGS:
+        return "\u3000".join(processed_lines)
+    else:
+        return " ".join(processed_lines)
+
+
+# ====== 3. 時間解析相關 ======
+def _compute_overlap(start1, end1, start2, end2):
+    overlap = max(0, min(end1, end2) - max(start1, start2))
+    return overlap
+
+
+def _clear_winner(overlaps, margin):
+    """時間重疊比例第一名領先第二名至少 margin 時回傳其位置，否則 None"""
+    if not overlaps:
+        return None
+    order = sorted(range(len(overlaps)), key=lambda k: overlaps[k], reverse=True)
+    best = overlaps[order[0]]
+    second = overlaps[order[1]] if len(order) > 1 else 0.0
+    return order[0] if best > 0 and best - second >= margin else None
+
+
+# ====== 4. 合併邏輯 ======
+def _reference_records(ref_srt, lang):
+    records = []
+    for index, timecode, text in ref_srt:
+        start, end = srt_.parse_timecode(timecode)
+        records.append({"index": index, "timecode": timecode, "start": start, "end": end,
+                        "text": _process_dialogue(text, lang=lang)})
+    return records
+
+
+class _Track:
+    """一條目標字幕：時間換算到參考時間軸後，為每段參考字幕找出候選與重疊比例"""
+
+    def __init__(self, lang, srt_list, reference, alignment, time_window, mode, margin):
+        self.lang = lang
+        self.records = []
+        for index, timecode, text in srt_list:
+            start, end = srt_.parse_timecode(timecode)
+            self.records.append({
                 "index": index,
                 "timecode": timecode,
-                "start": start,
-                "end": end,
-                "text": processed_text,
-                "embedding": ch_embedding
+                "start": alignment.apply(start),
+                "end": alignment.apply(end),
+                "text": _process_dialogue(text, lang=lang),
             })
+        # 依起始時間排序，供時間窗口以二分搜尋找候選
+        self.records.sort(key=lambda r: r["start"])
+        starts = [r["start"] for r in self.records]
+        max_duration = max((r["end"] - r["start"] for r in self.records), default=0.0)
+
+        self.candidates, self.overlaps = [], []
+        for ref in reference:
+            start_e, end_e = ref["start"], ref["end"]
+            if time_window is None:
+                cands = self.records
+            else:
+                lo = bisect.bisect_left(starts, start_e - time_window - max_duration)
+                hi = bisect.bisect_right(starts, end_e + time_window)
+                cands = [c for c in self.records[lo:hi] if c["end"] >= start_e - time_window]
+            duration = end_e - start_e
+            self.candidates.append(cands)
+            self.overlaps.append([_compute_overlap(start_e, end_e, c["start"], c["end"]) / duration
+                                  if duration > 0 else 0 for c in cands])
+
+        # 第一層：時間重疊有明顯勝出者的直接決定（tiered 模式）
+        self.chosen = {}
+        if mode == "tiered":
+            for i, overlaps in enumerate(self.overlaps):
+                k = _clear_winner(overlaps, margin)
+                if k is not None:
+                    self.chosen[i] = self.candidates[i][k]
+        self.by_timing = len(self.chosen)
+        self.ambiguous = [i for i in range(len(reference)) if i not in self.chosen and self.candidates[i]]
+        self.audited = []
+        self.disagreements = 0
 
+    def merged(self, reference):
         merged_records = []
-        used_ch_indices = set()
+        used_indices = set()
+        for i, ref in enumerate(reference):
+            best_candidate = self.chosen.get(i)
+            if best_candidate is not None and best_candidate["index"] not in used_indices:
+                merged_records.append({
+                    "index": len(merged_records) + 1,
+                    "timecode": ref["timecode"],
+                    "text": best_candidate["text"],
+                    "ref": i,
+                })
+                used_indices.add(best_candidate["index"])
+        return merged_records
+
+
+def _score_tracks(reference, tracks, semantic_weight, time_weight):
+    """
+    第二層：所有目標字幕中需要語意比對的部分一起處理——
+    參考字幕只編碼一次（只編需要的段），各目標的候選合併成一批編碼
+    """
+    ref_needed = sorted({i for tr in tracks for i in tr.ambiguous + tr.audited})
+    if not ref_needed:
+        return
+    from sentence_transformers import util
+    model = _get_model()
 
-        for rec in en_srt:
-            index, timecode, text = rec
-            start_e, end_e = get_time_bounds(timecode)
-            en_text_proc = process_dialogue(text, lang="en")
-            en_embedding = model.encode(en_text_proc, convert_to_tensor=True)
+    ref_row = {i: row for row, i in enumerate(ref_needed)}
+    ref_emb = model.encode([reference[i]["text"] for i in ref_needed], convert_to_tensor=True)
 
+    needed = {}
+    for tr in tracks:
+        for i in tr.ambiguous + tr.audited:
+            for c in tr.candidates[i]:
+                needed.setdefault(id(c), c)
+    pos = {key: k for k, key in enumerate(needed)}
+    cand_emb = model.encode([c["text"] for c in needed.values()], convert_to_tensor=True)
+
+    for tr in tracks:
+        for i in tr.ambiguous + tr.audited:
+            cands = tr.candidates[i]
+            sims = util.cos_sim(ref_emb[ref_row[i]], cand_emb[[pos[id(c)] for c in cands]])[0].tolist()
             best_score = -1.0
             best_candidate = None
-
-            for c_rec in chinese_records:
-                overlap = compute_overlap(start_e, end_e, c_rec["start"], c_rec["end"])
-                duration = end_e - start_e
-                overlap_ratio = overlap / duration if duration > 0 else 0
-                cosine_similarity = util.cos_sim(en_embedding, c_rec["embedding"]).item()
+            for c_rec, overlap_ratio, cosine_similarity in zip(cands, tr.overlaps[i], sims):
                 final_score = time_weight * overlap_ratio + semantic_weight * cosine_similarity
                 if final_score > best_score:
                     best_score = final_score
                     best_candidate = c_rec
+            if i in tr.chosen:
+                tr.disagreements += best_candidate is not tr.chosen[i]
+            else:
+                tr.chosen[i] = best_candidate
 
-            if best_candidate is not None and best_candidate["index"] not in used_ch_indices:
-                merged_records.append({
-                    "index": len(merged_records) + 1,
-                    "timecode": timecode,
-                    "text": best_candidate["text"]
-                })
-                used_ch_indices.add(best_candidate["index"])
 
-        return merged_records
+def _settings(mode, margin, audit):
+    cfg = config.load_config()
+    mode = str(mode or cfg.get("merge_mode") or "tiered").lower()
+    margin = float(cfg.get("merge_margin") or 0.5) if margin is None else float(margin)
+    audit = float(cfg.get("merge_audit") or 0) if audit is None else float(audit)
+    return mode, margin, audit
 
-    # ====== 5. 儲存合併後的 SRT ======
-    def save_srt(merged_records, output_path):
-        with open(output_path, "w", encoding="utf-8") as f:
-            for rec in merged_records:
-                f.write(str(rec["index"]) + "\n")
-                f.write(rec["timecode"] + "\n")
-                f.write(rec["text"] + "\n\n")
-        print("✅ 合併後的 srt 檔案已儲存為:", output_path)
 
-    # ====== 主流程 ======
-    chinese_srt_file = os.path.join(output_dir, ch_srt_name)
-    english_srt_file = os.path.join(output_dir, en_srt_name)
+def merge_tracks(reference,
+                 targets,
+                 output_dir="output",
+                 reference_lang="en",
+                 semantic_weight=0.5,
+                 time_weight=0.5,
+                 align_timing=True,
+                 time_window=10.0,
+                 mode=None,
+                 margin=None,
+                 audit=None,
+                 output_names=None,
+                 combined_name="merged_all.srt",
+                 include_reference=True,
+                 preview=0):
+    """
+    以一條參考字幕（通常是英文）為時間軸，一次合併任意多條目標字幕。
+    reference: 參考 SRT 路徑；targets: {語言: SRT 路徑}（依順序排列在合併檔中）
+    每條目標各輸出 output_names[語言]（預設 merged_{語言}.srt）：參考字幕的時間碼 + 配對到的目標文字；
+    combined_name 不為 None 時另輸出一個多行檔：每段依序為參考文字（include_reference）與各語言文字
+    參考字幕只解析、編碼一次；各目標需要語意比對的部分合併成同一批計算
+    其餘參數同 merge_bilingual_srt；回傳 {語言: 輸出路徑, "combined": 合併檔路徑}
+    """
+    mode, margin, audit = _settings(mode, margin, audit)
+    os.makedirs(output_dir, exist_ok=True)
+    output_names = output_names or {}
+
+    ref_srt = _parse_srt(reference)
+    reference_records = _reference_records(ref_srt, reference_lang)
+    ref_starts = [r["start"] for r in reference_records]
+    metrics.inc("subtitle_merge_cues_total", len(ref_srt), kind=reference_lang)
+    if preview:
+        print(f"\n前 {preview} 筆參考（{reference_lang}）srt 資料檢查：")
+        _print_first_n(ref_srt, preview)
 
-    ch_srt_list = parse_srt(chinese_srt_file)
-    en_srt_list = parse_srt(english_srt_file)
+    tracks = []
+    for lang, path in targets.items():
+        srt_list = _parse_srt(path)
+        metrics.inc("subtitle_merge_cues_total", len(srt_list), kind=lang)
+        if preview:
+            print(f"\n前 {preview} 筆 {lang} srt 資料檢查：")
+            _print_first_n(srt_list, preview)
 
-    print("前 10 筆中文 srt 資料檢查：")
-    print_first_n(ch_srt_list, 10)
+        alignment, window = align.IDENTITY, time_window
+        if align_timing:
+            alignment = align.estimate_alignment(ref_starts,
+                                                 [srt_.parse_timecode(r[1])[0] for r in srt_list])
+            print(f"⏱️ 時間對齊（{lang} → {reference_lang}）：" + alignment.describe())
+            if alignment.method == "none" and window is not None:
+                # 估不出對應關係時不能保證時間接近，退回與全部字幕比對
+                print(f"⚠️ 無法估計 {lang} 的時間對齊，改為與全部字幕比對")
+                window = None
+        tr = _Track(lang, srt_list, reference_records, alignment, window, mode, margin)
+        if audit > 0 and tr.chosen:
+            tr.audited = random.Random(0).sample(sorted(tr.chosen), max(1, int(len(tr.chosen) * audit)))
+        tracks.append(tr)
+
+    _score_tracks(reference_records, tracks, semantic_weight, time_weight)
+
+    outputs = {}
+    merged_by_lang = {}
+    for tr in tracks:
+        print(f"🔗 {tr.lang} 比對方式：只看時間 {tr.by_timing} 筆，語意比對 {len(tr.ambiguous)} 筆")
+        metrics.inc("subtitle_merge_decisions_total", tr.by_timing, kind="timing")
+        metrics.inc("subtitle_merge_decisions_total", len(tr.ambiguous), kind="semantic")
+        if tr.audited:
+            ratio = tr.disagreements / len(tr.audited)
+            print(f"🔎 {tr.lang} 抽查 {len(tr.audited)} 筆只看時間的結果，"
+                  f"與完整比對不一致 {tr.disagreements} 筆（{ratio:.1%}）")
+            metrics.set_gauge("subtitle_merge_audit_disagreement_ratio", ratio, lang=tr.lang)
+
+        merged_records = tr.merged(reference_records)
+        merged_by_lang[tr.lang] = merged_records
+        metrics.inc("subtitle_merge_cues_total", len(merged_records), kind="merged")
+        output_path = os.path.join(output_dir, output_names.get(tr.lang) or f"merged_{tr.lang}.srt")
+        srt_.write_srt(output_path, merged_records)
+        print("✅ 合併後的 srt 檔案已儲存為:", output_path)
+        outputs[tr.lang] = output_path
 
-    print("\n前 10 筆英文 srt 資料檢查：")
-    print_first_n(en_srt_list, 10)
+    if combined_name:
+        lines = {i: [r["text"]] if include_reference else [] for i, r in enumerate(reference_records)}
+        for tr in tracks:
+            for rec in merged_by_lang[tr.lang]:
+                lines[rec["ref"]].append(rec["text"])
+        combined = [(i + 1, reference_records[i]["timecode"], "\n".join(lines[i]))
+                    for i in range(len(reference_records)) if lines[i]]
+        combined_path = os.path.join(output_dir, combined_name)
+        srt_.write_srt(combined_path, combined, renumber=True)
+        print("✅ 多語合併檔已儲存為:", combined_path)
+        outputs["combined"] = combined_path
+    return outputs
 
-    merged_records = merge_subtitles(ch_srt_list, en_srt_list,
-                                     semantic_weight=semantic_weight,
-                                     time_weight=time_weight)
 
-    output_path = os.path.join(output_dir, "merged.srt")
-    save_srt(merged_records, output_path)
-    return output_path
+def merge_bilingual_srt(ch_srt_name="subtitle_ch.srt",
+                        en_srt_name="subtitle_en.srt",
+                        output_dir="output",
+                        semantic_weight=0.5,
+                        time_weight=0.5,
+                        align_timing=True,
+                        time_window=10.0,
+                        mode=None,
+                        margin=None,
+                        audit=None):
+    """
+    合併中英 SRT 檔案（放在 output/ 資料夾中），
+    產生 merged.srt
+    align_timing: 先估計中文相對英文的時間偏移與線性漂移（modules/align.py），換算後再比對
+    time_window: 只比對時間相距在這個秒數內的中文字幕；None 表示與全部中文字幕比對
+    mode: "full" 每段都做語意比對；"tiered" 時間重疊第一名領先第二名至少 margin（重疊比例）時
+          直接採用，只有其餘字幕才載入模型做語意比對。未指定時讀 config 的 merge_mode
+    margin / audit: tiered 的領先門檻與抽查比例（抽查只憑時間決定的結果，回報與完整比對的不一致率）；
+          未指定時讀 config 的 merge_margin / merge_audit
+    """
+    outputs = merge_tracks(os.path.join(output_dir, en_srt_name),
+                           {"ch": os.path.join(output_dir, ch_srt_name)},
+                           output_dir=output_dir,
+                           reference_lang="en",
+                           semantic_weight=semantic_weight,
+                           time_weight=time_weight,
+                           align_timing=align_timing,
+                           time_window=time_window,
+                           mode=mode,
+                           margin=margin,
+                           audit=audit,
+                           output_names={"ch": "merged.srt"},
+                           combined_name=None,
+                           preview=10)
+    return outputs["ch"]
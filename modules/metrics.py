@@ -0,0 +1,273 @@
+# modules/metrics.py
+# 功能：輕量的 Prometheus 風格指標
+# - 各模組以 inc / observe / set_gauge / timer 記錄，未啟用時每個呼叫只是一個 if 判斷
+# - app.py 內啟用（config "metrics": "on"）→ 直接記在記憶體，由 /metrics 輸出文字格式
+# - 步驟子行程：app.py 透過環境變數 SUBTITLE_METRICS_FILE 指定暫存檔，
+#   子行程結束時（atexit）把記錄與 peak RSS 寫入，app.py 再合併回來
+#
+# 用法：
+#     from modules import metrics
+#     with metrics.timer("subtitle_gemini_request_seconds", op="ocr"):
+#         ...
+#     metrics.inc("subtitle_ocr_images_total", n, engine="paddle")
+
+from __future__ import annotations
+import atexit, json, os, sys, threading, time
+from typing import Dict, List, Optional, Tuple
+
+ENV_FILE = "SUBTITLE_METRICS_FILE"
+ENV_STAGE = "SUBTITLE_METRICS_STAGE"
+
+# 預設的 histogram 桶（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# name → (type, help, buckets)
+METRICS: Dict[str, Tuple[str, str, Optional[tuple]]] = {
+    "subtitle_stage_duration_seconds": ("histogram", "各步驟執行時間", DEFAULT_BUCKETS),
+    "subtitle_stage_runs_total": ("counter", "各步驟執行次數（依結果）", None),
+    "subtitle_stage_peak_rss_bytes": ("gauge", "各步驟子行程的最高 RSS", None),
+    "subtitle_governor_threads": ("gauge", "資源預算：執行緒（capacity / in_use）", None),
+    "subtitle_governor_memory_bytes": ("gauge", "資源預算：記憶體（capacity / in_use）", None),
+    "subtitle_governor_threads_peak": ("gauge", "資源預算：同時使用的執行緒最高值", None),
+    "subtitle_governor_memory_peak_bytes": ("gauge", "資源預算：同時使用的記憶體最高值", None),
+    "subtitle_governor_queued": ("gauge", "等待資源額度的步驟數", None),
+    "subtitle_governor_wait_seconds": ("histogram", "步驟等待資源額度的時間", DEFAULT_BUCKETS),
+    "subtitle_ocr_images_total": ("counter", "已辨識圖片數", None),
+    "subtitle_ocr_seconds_total": ("counter", "OCR 累計耗時", None),
+    "subtitle_ocr_images_per_second": ("gauge", "最近一次 OCR 的每秒圖片數", None),
+    "subtitle_ocr_skipped_total": ("counter", "預檢略過的圖片數（missing：XML 引用但不存在；unreferenced：未被引用）", None),
+    "subtitle_ocr_escalated_total": ("counter", "串接模式中因信心度低而改送 Gemini 的圖片數", None),
+    "subtitle_gemini_requests_total": ("counter", "Gemini 請求數（依結果）", None),
+    "subtitle_gemini_request_seconds": ("histogram", "Gemini 請求延遲", DEFAULT_BUCKETS),
+    "subtitle_gemini_upload_bytes_total": ("counter", "送給 Gemini 的檔案位元組數（依傳送方式 inline / files）", None),
+    "subtitle_gemini_chunk_size": ("gauge", "Gemini OCR 目前的 chunk 頁數（自動調整）", None),
+    "subtitle_gemini_rpcs_total": ("counter", "Gemini OCR 的 RPC 次數（upload / generate / delete）", None),
+    "subtitle_gemini_upload_seconds": ("histogram", "上傳檔案給 Gemini 的耗時", DEFAULT_BUCKETS),
+    "subtitle_gemini_retries_total": ("counter", "Gemini 重試次數", None),
+    "subtitle_gemini_rate_limited_total": ("counter", "Gemini 429 / ResourceExhausted 次數", None),
+    "subtitle_gemini_hedges_total": ("counter", "Gemini 請求超過延遲百分位而送出的避險請求數", None),
+    "subtitle_gemini_hedge_wins_total": ("counter", "送出避險後先回應的一方（primary / hedge）", None),
+    "subtitle_gemini_hedge_wasted_total": ("counter", "避險後落敗、結果被丟棄的請求數", None),
+    "subtitle_gemini_deadline_exceeded_total": ("counter", "因工作期限不足而放棄的請求 / 重試次數", None),
+    "subtitle_translation_tokens_total": ("counter", "翻譯使用的 token 數", None),
+    "subtitle_merge_cues_total": ("counter", "合併時處理的字幕段數", None),
+    "subtitle_merge_decisions_total": ("counter", "合併時各字幕段的比對方式（timing / semantic）", None),
+    "subtitle_merge_audit_disagreement_ratio": ("gauge", "抽查中只憑時間決定與完整語意比對不一致的比例（依語言）", None),
+}
+
+_enabled = False
+_lock = threading.Lock()
+_counters: Dict[tuple, float] = {}
+_gauges: Dict[tuple, float] = {}
+_hists: Dict[tuple, list] = {}  # key → [桶計數..., sum, count]
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def describe(name: str, kind: str, help_text: str, buckets: Optional[tuple] = None) -> None:
+    """註冊額外的指標（其他模組擴充用）"""
+    METRICS[name] = (kind, help_text, buckets)
+
+
+def _buckets(name: str) -> tuple:
+    spec = METRICS.get(name)
+    return (spec[2] if spec and spec[2] else DEFAULT_BUCKETS)
+
+
+# --------- 記錄 API（未啟用時立即返回） ---------
+def inc(name: str, value: float = 1, **labels) -> None:
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def set_max(name: str, value: float, **labels) -> None:
+    if not _enabled:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = max(_gauges.get(k, value), value)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    if not _enabled:
+        return
+    buckets = _buckets(name)
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [0] * len(buckets) + [0.0, 0]
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "t0", "elapsed")
+
+    def __init__(self, name, labels):
+        self.name, self.labels, self.elapsed = name, labels, 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.t0
+        observe(self.name, self.elapsed, **self.labels)
+
+
+class _NullTimer:
+    elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str, **labels):
+    """with metrics.timer(...)：結束時把秒數記進 histogram；未啟用時回傳共用的空 context"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+# --------- 子行程 ↔ app.py ---------
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except (ImportError, AttributeError):
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", None) or info.rss
+        except Exception:
+            return None
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": [[n, dict(l), v] for (n, l), v in _counters.items()],
+            "gauges": [[n, dict(l), v] for (n, l), v in _gauges.items()],
+            "hists": [[n, dict(l), h] for (n, l), h in _hists.items()],
+        }
+
+
+def merge(snap: dict) -> None:
+    """合併子行程的記錄：counter / histogram 相加，gauge 以新值覆蓋（peak RSS 取最大）"""
+    if not _enabled:
+        return
+    with _lock:
+        for n, l, v in snap.get("counters", []):
+            k = _key(n, l)
+            _counters[k] = _counters.get(k, 0) + v
+        for n, l, v in snap.get("gauges", []):
+            k = _key(n, l)
+            _gauges[k] = max(_gauges.get(k, v), v) if n.endswith("peak_rss_bytes") else v
+        for n, l, h in snap.get("hists", []):
+            k = _key(n, l)
+            cur = _hists.get(k)
+            _hists[k] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+
+
+def merge_file(path: str) -> None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            merge(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _dump_at_exit(path: str) -> None:
+    rss = peak_rss_bytes()
+    if rss is not None:
+        set_max("subtitle_stage_peak_rss_bytes", rss, stage=os.environ.get(ENV_STAGE, "unknown"))
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snapshot(), f, ensure_ascii=False)
+    except OSError:
+        pass
+
+
+# --------- 文字格式輸出 ---------
+def _fmt_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+def render() -> str:
+    """Prometheus text exposition format (0.0.4)"""
+    lines: List[str] = []
+    with _lock:
+        series: Dict[str, list] = {}
+        for (n, l), v in _counters.items():
+            series.setdefault(n, []).append((l, v))
+        for (n, l), v in _gauges.items():
+            series.setdefault(n, []).append((l, v))
+        for (n, l), h in _hists.items():
+            series.setdefault(n, []).append((l, h))
+
+        for name in sorted(series):
+            kind, help_text, _ = METRICS.get(name, ("untyped", "", None))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, v in sorted(series[name], key=lambda x: x[0]):
+                if kind == "histogram":
+                    buckets = _buckets(name)
+                    for b, c in zip(buckets, v[:len(buckets)]):
+                        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', b),))} {c}")
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {v[-1]}")
+                    lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(v[-2])}")
+                    lines.append(f"{name}_count{_fmt_labels(labels)} {v[-1]}")
+                else:
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+    return "\n".join(lines) + "\n"
+
+
+# 子行程：有指定暫存檔就自動啟用，結束時寫出
+if os.environ.get(ENV_FILE):
+    enable()
+    atexit.register(_dump_at_exit, os.environ[ENV_FILE])
@@ -0,0 +1,69 @@
+# modules/ocr_cascade.py
+# 功能：PaddleOCR → Gemini 的信心度串接
+# 1. 本機 PaddleOCR 先辨識全部圖片（每張附辨識分數）
+# 2. 分數低於門檻或辨識結果為空的圖片，才分批送 Gemini 重新辨識
+# 3. 結果記錄每筆由哪個引擎產生
+#
+# on_result 會依序收到 Paddle 的結果（engine="paddle"），之後升級的圖片再收到一次 Gemini 的結果
+# （engine="gemini"）；寫入 JSONL 時同一個 key 以最後一筆為準（見 modules/handoff.py）
+
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional
+
+import config
+from modules import metrics
+
+
+def run(
+    file_name: str,
+    *,
+    threshold: Optional[float] = None,
+    batch_size: Optional[int] = None,
+    api_key: Optional[str] = None,
+    on_result: Optional[Callable[..., None]] = None,
+    names: Optional[List[str]] = None,
+) -> Dict[str, Dict]:
+    """
+    回傳 {檔名: {"text": 文字, "engine": "paddle" | "gemini", "score": Paddle 分數}}
+    threshold / batch_size 未指定時讀 config 的 cascade_threshold / cascade_batch_size
+    """
+    from modules import ocr_ocr
+
+    cfg = config.load_config()
+    threshold = float(cfg.get("cascade_threshold") or 0.9) if threshold is None else float(threshold)
+    batch_size = int(cfg.get("cascade_batch_size") or 50) if batch_size is None else int(batch_size)
+
+    results: Dict[str, Dict] = {}
+
+    def on_paddle(key, text, score=0.0):
+        results[key] = {"text": text, "engine": "paddle", "score": score}
+        if on_result is not None:
+            on_result(key, text, score=score, engine="paddle")
+
+    ocr_ocr.run(file_name, on_result=on_paddle, names=names)
+
+    low = [k for k in sorted(results)
+           if not results[k]["text"].strip() or results[k]["score"] < threshold]
+    metrics.inc("subtitle_ocr_escalated_total", len(low))
+    print(f"🔀 信心度低於 {threshold} 或為空：{len(low)}/{len(results)} 張改送 Gemini")
+    if not low:
+        return results
+
+    def on_gemini(key, text):
+        # Gemini 也讀不出字時保留 Paddle 的結果
+        if not text.strip():
+            return
+        results[key] = {"text": text, "engine": "gemini", "score": results[key]["score"]}
+        if on_result is not None:
+            on_result(key, text, score=results[key]["score"], engine="gemini")
+
+    from modules import ocr_gemini
+    try:
+        ocr_gemini.run(file_name, chunk_size=batch_size, api_key=api_key, on_result=on_gemini, names=low)
+    except Exception as e:
+        # 升級失敗不影響已有的 Paddle 結果
+        print(f"⚠️ Gemini 重新辨識失敗，保留 PaddleOCR 結果：{e}")
+
+    upgraded = sum(1 for k in low if results[k]["engine"] == "gemini")
+    print(f"✅ 串接辨識完成：PaddleOCR {len(results) - upgraded} 張，Gemini {upgraded} 張")
+    return results
@@ -1,92 +1,235 @@
 # modules/ocr_gemini.py
 # 功能：
-# 1. 若 data/{file_name}.pdf 不存在 → 將 data/{file_name}/*.png 合併成 PDF
-# 2. 將 PDF 切割成多個 chunk（預設每 100 頁）
-# 3. 呼叫 Gemini 逐塊 OCR
+# 1. 若 data/{file_name}.pdf 不存在 → 將 data/{file_name}/*.png（或 data/{file_name}.zip 內的 png）合併成 PDF
+#    頁面編碼（config 的 gemini_pdf_encoding）：
+#    - rgb：彩色 JPEG（原本的做法）
+#    - gray：灰階 JPEG
+#    - bilevel：二值化後以 CCITT G4 壓縮（白底黑字），字幕圖通常最小
+#    - jpeg：灰階 JPEG，寬度上限 gemini_pdf_max_width、品質 gemini_pdf_jpeg_quality
+# 2. 將 PDF 切割成多個 chunk：未指定 chunk_size 時由 modules/chunk_sizer.py 依延遲、逾時、缺頁、
+#    輸出截斷逐塊調整頁數，學到的大小依模型保存，下次從這個值開始
+# 3. 呼叫 Gemini 逐塊 OCR；chunk 小於 gemini_inline_max_mb 時直接夾帶在請求裡（transport "auto"），
+#    超過才走 Files API（上傳 → 辨識 → 刪除）；genai.configure 與模型物件每個行程只建立一次
 # 4. 回傳 dict: {"subtitle0001": "文字", ...}
+# 請求超過滾動百分位延遲時送出避險請求，整體期限到了不再重試（見 modules/hedge.py）
 # ⚠️ 不自動寫入 JSON，由外層主程式決定
 
 from __future__ import annotations
-import os, re, json, math, time, glob
+import os, re, json, math, threading, time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from pypdf import PdfReader, PdfWriter
 from PIL import Image
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 import config
+from modules import chunk_sizer, hedge, image_source, metrics, rate_limit
 
 
 # --------- 圖片合併成 PDF ---------
-def _images_to_pdf(file_name: str) -> Path:
-    pdf_path = Path("data") / f"{file_name}.pdf"
-    if pdf_path.exists():
-        return pdf_path
-
-    folder = Path("data") / file_name
-    image_files = sorted(glob.glob(str(folder / "*.png")))
-    if not image_files:
-        raise FileNotFoundError(f"找不到任何圖片：{folder}/*.png")
-
-    os.makedirs(pdf_path.parent, exist_ok=True)
-    imgs = [Image.open(p).convert("RGB") for p in image_files]
+ENCODINGS = ("rgb", "gray", "bilevel", "jpeg")
+
+
+def _pdf_options(encoding: Optional[str]) -> Dict:
+    cfg = config.load_config()
+    encoding = str(encoding or cfg.get("gemini_pdf_encoding") or "rgb").lower()
+    if encoding not in ENCODINGS:
+        raise ValueError(f"未知的 PDF 編碼：{encoding}（可用：{', '.join(ENCODINGS)}）")
+    return {
+        "encoding": encoding,
+        "max_width": int(cfg.get("gemini_pdf_max_width") or 1280),
+        "quality": int(cfg.get("gemini_pdf_jpeg_quality") or 60),
+    }
+
+
+def _images_to_pdf(file_name: str, names: Optional[List[str]] = None,
+                   encoding: Optional[str] = None) -> Path:
+    """
+    names 有值時只合併這些圖片（依給定順序），輸出到另一個暫存 PDF，每次重新產生；
+    暫存檔名含行程 ID，同一個工作目錄裡的多個 worker（例如 cascade 分片）不會互相覆寫或刪除
+    """
+    opts = _pdf_options(encoding)
+    suffix = "" if opts["encoding"] == "rgb" else f".{opts['encoding']}"
+    if names is None:
+        pdf_path = Path("data") / f"{file_name}{suffix}.pdf"
+        if pdf_path.exists():
+            return pdf_path
+    else:
+        pdf_path = Path("data") / f"{file_name}.subset-{os.getpid()}{suffix}.pdf"
+
+    # 圖片來源：data/{file_name}.zip 或 data/{file_name}/ 資料夾
+    with image_source.open_source(file_name) as source:
+        image_files = source.names("*.png") if names is None else list(names)
+        if not image_files:
+            raise FileNotFoundError(f"找不到任何圖片：{source.label}/*.png")
+
+        os.makedirs(pdf_path.parent, exist_ok=True)
+        imgs = [_encode_page(source.open_image(p), opts) for p in image_files]
     try:
         first, rest = imgs[0], imgs[1:]
-        first.save(pdf_path, save_all=True, append_images=rest)
+        save_kwargs = {"quality": opts["quality"]} if opts["encoding"] == "jpeg" else {}
+        first.save(pdf_path, save_all=True, append_images=rest, **save_kwargs)
     finally:
         for im in imgs:
             im.close()
 
-    print(f"✅ 已合併 {len(image_files)} 張圖片為 PDF：{pdf_path}")
+    size_mb = pdf_path.stat().st_size / 1e6
+    print(f"✅ 已合併 {len(image_files)} 張圖片為 PDF：{pdf_path}（{opts['encoding']}，{size_mb:.2f} MB）")
     return pdf_path
 
 
+def _to_rgb(im: Image.Image) -> Image.Image:
+    rgb = im.convert("RGB")
+    if rgb is not im:
+        im.close()
+    return rgb
+
+
+def _encode_page(im: Image.Image, opts: Dict) -> Image.Image:
+    """依編碼把一張字幕圖轉成要放進 PDF 的影像"""
+    encoding = opts["encoding"]
+    rgb = _to_rgb(im)
+    if encoding == "rgb":
+        return rgb
+    gray = rgb.convert("L")
+    rgb.close()
+    if encoding == "jpeg" and gray.width > opts["max_width"]:
+        h = max(1, round(gray.height * opts["max_width"] / gray.width))
+        small = gray.resize((opts["max_width"], h), Image.LANCZOS)
+        gray.close()
+        gray = small
+    if encoding != "bilevel":
+        return gray
+    bw = _binarize(gray)
+    gray.close()
+    return bw
+
+
+def _binarize(gray: Image.Image) -> Image.Image:
+    """Otsu 門檻二值化，並讓佔多數的背景為白色（文字為黑）"""
+    hist = gray.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    best_t, best_var, w0, sum0 = 128, -1.0, 0, 0.0
+    for t in range(256):
+        w0 += hist[t]
+        if w0 == 0 or w0 == total:
+            continue
+        sum0 += t * hist[t]
+        m0, m1 = sum0 / w0, (sum_all - sum0) / (total - w0)
+        var = w0 * (total - w0) * (m0 - m1) ** 2
+        if var > best_var:
+            best_t, best_var = t, var
+    dark = sum(hist[:best_t + 1])
+    # 暗的一側佔多數 → 背景是暗的，反轉成白底
+    lut = [255 if (v > best_t) != (dark > total / 2) else 0 for v in range(256)]
+    return gray.point(lut).convert("1", dither=Image.Dither.NONE)
+
+
 # --------- PDF 拆塊 ---------
-def _split_pdf_into_chunks(pdf_path: Path, chunk_size: int = 100) -> List[Path]:
-    reader = PdfReader(str(pdf_path))
-    total_pages = len(reader.pages)
-    if total_pages == 0:
-        raise ValueError("PDF 沒有頁面")
+def _write_chunk(reader: PdfReader, start: int, end: int, chunk_file: Path) -> Path:
+    """把第 start ~ end-1 頁寫成一個 chunk PDF（chunk 大小由 ChunkSizer 逐塊決定）"""
+    writer = PdfWriter()
+    for j in range(start, end):
+        writer.add_page(reader.pages[j])
+    with open(chunk_file, "wb") as f:
+        writer.write(f)
+    return chunk_file
 
-    out: List[Path] = []
-    base = pdf_path.with_suffix("")
-    for i in range(0, total_pages, chunk_size):
-        writer = PdfWriter()
-        for j in range(i, min(i + chunk_size, total_pages)):
-            writer.add_page(reader.pages[j])
-        chunk_file = Path(f"{base}_chunk_{len(out)+1}.pdf")
-        with open(chunk_file, "wb") as f:
-            writer.write(f)
-        out.append(chunk_file)
-    return out
+
+# --------- Gemini 用戶端（每個行程設定一次） ---------
+TRANSPORTS = ("auto", "inline", "files")
+_SAFETY = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+_PROMPT = (
+    "這是一份由圖片組成的 PDF。請逐頁擷取所有繁體中文與英文文字。\n"
+    "每頁開頭務必以『第X頁』獨立一行表示頁碼。\n"
+    "輸出範例：\n第1頁\n<內容>\n第2頁\n<內容>\n"
+)
+_client_lock = threading.Lock()
+_client = {"api_key": None, "model": None}
+MODEL_NAME = "gemini-flash-latest"
+
+
+def _get_model(api_key: str):
+    """genai.configure 與模型物件每個行程只建立一次；api_key 改變時才重新設定"""
+    with _client_lock:
+        if _client["api_key"] != api_key or _client["model"] is None:
+            genai.configure(api_key=api_key)
+            _client["model"] = genai.GenerativeModel(
+                model_name=MODEL_NAME,
+                generation_config={"temperature": 0.1},
+                safety_settings=_SAFETY,
+            )
+            _client["api_key"] = api_key
+        return _client["model"]
+
+
+def _transport_for(size: int, transport: Optional[str] = None) -> str:
+    """
+    決定單一 chunk 的傳送方式（config 的 gemini_transport / gemini_inline_max_mb）：
+    auto：小於上限時直接夾帶在辨識請求裡（1 次 RPC），超過才走 Files API（上傳 / 辨識 / 刪除 3 次）
+    """
+    cfg = config.load_config()
+    transport = str(transport or cfg.get("gemini_transport") or "auto").lower()
+    if transport not in TRANSPORTS:
+        raise ValueError(f"未知的傳送方式：{transport}（可用：{', '.join(TRANSPORTS)}）")
+    if transport != "auto":
+        return transport
+    limit = float(cfg.get("gemini_inline_max_mb") or 18) * 1e6
+    return "inline" if size <= limit else "files"
 
 
 # --------- 單一 Gemini OCR ---------
-def _gemini_ocr_one(pdf_path: Path, api_key: str, timeout_sec: int = 600) -> str:
-    genai.configure(api_key=api_key)
+def _gemini_ocr_one(pdf_path: Path, api_key: str, timeout_sec: int = 600,
+                    stats: Optional[Dict] = None, cancel: Optional[threading.Event] = None,
+                    transport: Optional[str] = None) -> str:
+    """
+    stats 有提供時記錄 transport / rpcs / bytes / upload_seconds / generate_seconds / output_tokens / truncated
+    cancel 被設定時（避險請求已由另一份勝出）上傳完就不再送辨識
+    """
+    model = _get_model(api_key)
+    size = pdf_path.stat().st_size
+    transport = _transport_for(size, transport)
+    stats = {} if stats is None else stats
+    stats.update(transport=transport, rpcs=0, bytes=size, upload_seconds=0.0)
+
+    def generate(part):
+        if cancel is not None and cancel.is_set():
+            raise hedge.Cancelled()
+        t1 = time.perf_counter()
+        stats["rpcs"] += 1
+        metrics.inc("subtitle_gemini_rpcs_total", op="ocr", call="generate")
+        resp = model.generate_content([_PROMPT, part], request_options={"timeout": timeout_sec})
+        stats["generate_seconds"] = round(time.perf_counter() - t1, 3)
+        usage = getattr(resp, "usage_metadata", None)
+        stats["output_tokens"] = getattr(usage, "candidates_token_count", 0) or 0
+        candidates = getattr(resp, "candidates", None) or []
+        reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        stats["truncated"] = getattr(reason, "name", str(reason)) == "MAX_TOKENS"
+        return (resp.text or "").strip()
+
+    metrics.inc("subtitle_gemini_upload_bytes_total", size, op="ocr", transport=transport)
+    if transport == "inline":
+        return generate({"mime_type": "application/pdf", "data": pdf_path.read_bytes()})
+
+    t0 = time.perf_counter()
+    stats["rpcs"] += 1
+    metrics.inc("subtitle_gemini_rpcs_total", op="ocr", call="upload")
     remote = genai.upload_file(path=str(pdf_path))
+    upload_s = time.perf_counter() - t0
+    metrics.observe("subtitle_gemini_upload_seconds", upload_s, op="ocr")
+    stats["upload_seconds"] = round(upload_s, 3)
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-flash-latest",
-            generation_config={"temperature": 0.1},
-            safety_settings=[
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ],
-        )
-
-        prompt = (
-            "這是一份由圖片組成的 PDF。請逐頁擷取所有繁體中文與英文文字。\n"
-            "每頁開頭務必以『第X頁』獨立一行表示頁碼。\n"
-            "輸出範例：\n第1頁\n<內容>\n第2頁\n<內容>\n"
-        )
-
-        resp = model.generate_content([prompt, remote], request_options={"timeout": timeout_sec})
-        return (resp.text or "").strip()
+        return generate(remote)
     finally:
         try:
+            stats["rpcs"] += 1
+            metrics.inc("subtitle_gemini_rpcs_total", op="ocr", call="delete")
             genai.delete_file(remote.name)
         except Exception:
             pass
@@ -116,23 +259,48 @@ def _parse_pages_to_dict(full_text: str) -> Dict[int, str]:
     return out
 
 
+def _can_retry(deadline: hedge.Deadline, sleep_sec: float, pages: int) -> bool:
+    """等待 sleep_sec 再加上一次請求的預估時間，是否還在期限內"""
+    need = sleep_sec + (hedge.expected_seconds("ocr", pages) or 0)
+    if deadline.allows(need):
+        return True
+    metrics.inc("subtitle_gemini_deadline_exceeded_total")
+    print(f"⌛ 剩餘期限 {deadline.remaining():.0f}s 不足以再重試（約需 {need:.0f}s），放棄這個 chunk")
+    return False
+
+
 # --------- 主函式（給主程式呼叫） ---------
 def run(
     file_name: str,
     *,
-    chunk_size: int = 100,
+    chunk_size: Optional[int] = None,
     max_retries: int = 3,
     sleep_on_rate_limit: int = 40,
     timeout_sec: int = 600,
     api_key: Optional[str] = None,
+    on_result: Optional[Callable[[str, str], None]] = None,
+    names: Optional[List[str]] = None,
+    encoding: Optional[str] = None,
+    chunk_stats: Optional[List[Dict]] = None,
+    transport: Optional[str] = None,
+    deadline: Optional[hedge.Deadline] = None,
 ) -> Dict[str, str]:
     """
     執行流程：
       1) 若 data/{file_name}.pdf 不存在，從 data/{file_name}/*.png 建立
       2) 切塊 OCR
       3) 回傳字典 {"subtitle0001": "內容", ...}
+    每完成一個 chunk，就對其中每一頁呼叫 on_result(key, text)（若有提供）
+    chunk_size：每個 chunk 的頁數；None 時自動調整（見 modules/chunk_sizer.py）
+    names 有值時只辨識這些圖片，並以頁碼對回檔名作為 key（例如 cascade 只送低信心的圖片）
+    encoding：PDF 頁面編碼（見 ENCODINGS），未指定時讀 config 的 gemini_pdf_encoding
+    chunk_stats：有提供時，每個 chunk 附加一筆
+                 {chunk, pages, chunk_size, transport, rpcs, bytes, upload_seconds, generate_seconds, seconds, resize}
+    transport：見 TRANSPORTS，未指定時讀 config 的 gemini_transport
+    deadline：整體期限，未指定時依 config 的 gemini_job_deadline 從現在起算
     """
-    pdf_path = _images_to_pdf(file_name)
+    pdf_path = _images_to_pdf(file_name, names, encoding)
+    deadline = deadline or hedge.Deadline.from_config()
 
     if not api_key:
         cfg = config.load_config()
@@ -140,42 +308,107 @@ def run(
     if not api_key:
         raise ValueError("缺少 API Key")
 
-    chunk_files = _split_pdf_into_chunks(pdf_path, chunk_size=chunk_size)
+    reader = PdfReader(str(pdf_path))
+    total_pages = len(reader.pages)
+    if total_pages == 0:
+        raise ValueError("PDF 沒有頁面")
+    sizer = chunk_sizer.ChunkSizer(f"ocr/{MODEL_NAME}", fixed=chunk_size)
+    base = pdf_path.with_suffix("")
 
-    image_texts_by_page: Dict[int, str] = {}
+    # 依頁序累積；key 直接以累積順序編號，讓每個 chunk 完成時就能輸出
+    image_texts: Dict[str, str] = {}
+    t0 = time.perf_counter()
+    start, chunk_no = 0, 0
     try:
-        for chunk in chunk_files:
+        while start < total_pages:
+            end = min(start + sizer.size, total_pages)
+            pages = end - start
+            chunk = _write_chunk(reader, start, end, Path(f"{base}_chunk_{chunk_no + 1}.pdf"))
             text = None
-            for attempt in range(1, max_retries + 1):
-                try:
-                    text = _gemini_ocr_one(chunk, api_key=api_key, timeout_sec=timeout_sec)
-                    break
-                except (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable):
-                    if attempt == max_retries:
-                        raise
-                    time.sleep(sleep_on_rate_limit)
-                except Exception:
-                    if attempt == max_retries:
-                        raise
-                    time.sleep(2)
+            stats = {"chunk": chunk_no + 1, "chunk_size": pages}
+            t_chunk = time.perf_counter()
+
+            def request(cancel, chunk=chunk):
+                # 避險時兩份請求各自記錄，勝出的那份才併入 stats
+                own = {}
+                out = _gemini_ocr_one(chunk, api_key=api_key, timeout_sec=deadline.timeout(timeout_sec),
+                                      stats=own, cancel=cancel, transport=transport)
+                return out, own
 
-            if not text:
+            resplit = False
+            try:
+                for attempt in range(1, max_retries + 1):
+                    if attempt > 1:
+                        metrics.inc("subtitle_gemini_retries_total", op="ocr")
+                    try:
+                        rate_limit.acquire()
+                        with metrics.timer("subtitle_gemini_request_seconds", op="ocr"):
+                            text, own = hedge.call(request, op="ocr", units=pages, deadline=deadline)
+                        stats.update(own)
+                        metrics.inc("subtitle_gemini_requests_total", op="ocr", status="ok")
+                        break
+                    except hedge.DeadlineExceeded:
+                        raise
+                    except (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable) as e:
+                        status = "rate_limited" if isinstance(e, google_exceptions.ResourceExhausted) else "unavailable"
+                        metrics.inc("subtitle_gemini_requests_total", op="ocr", status=status)
+                        if status == "rate_limited":
+                            metrics.inc("subtitle_gemini_rate_limited_total", op="ocr")
+                        if attempt == max_retries or not _can_retry(deadline, sleep_on_rate_limit, pages):
+                            raise
+                        time.sleep(sleep_on_rate_limit)
+                    except Exception as e:
+                        metrics.inc("subtitle_gemini_requests_total", op="ocr", status="error")
+                        timed_out = isinstance(e, (google_exceptions.DeadlineExceeded, TimeoutError, ConnectionError))
+                        # 逾時：縮小 chunk 後從同一頁重送（不算在這個 chunk 的重試次數）
+                        if timed_out and sizer.on_timeout(type(e).__name__) and sizer.size < pages:
+                            resplit = True
+                            break
+                        if attempt == max_retries or not _can_retry(deadline, 2, pages):
+                            raise
+                        time.sleep(2)
+            finally:
+                try: os.remove(chunk)
+                except Exception: pass
+            if resplit:
                 continue
 
-            local = _parse_pages_to_dict(text)
-            base = len(image_texts_by_page)
+            stats["seconds"] = round(time.perf_counter() - t_chunk, 3)
+            local = _parse_pages_to_dict(text) if text else {}
+            print(f"📤 chunk {chunk_no + 1}（第 {start + 1}-{end} 頁 / 共 {total_pages}）："
+                  f"{stats.get('bytes', 0) / 1e6:.2f} MB，"
+                  f"{stats.get('transport', '-')}，RPC {stats.get('rpcs', 0)} 次，"
+                  f"上傳 {stats.get('upload_seconds', 0):.1f}s，辨識 {stats.get('generate_seconds', 0):.1f}s，"
+                  f"共 {stats['seconds']:.1f}s，回傳 {len(local)} 頁")
+            stats["resize"] = sizer.on_result(pages, len(local), stats.get("generate_seconds", stats["seconds"]),
+                                              truncated=stats.get("truncated", False))
+
             for k in sorted(local.keys()):
-                image_texts_by_page[base + k] = local[k].strip()
+                if names is not None:
+                    # 頁碼對回檔名；超出此 chunk 範圍的頁碼（模型編錯）略過
+                    pos = start + k - 1
+                    if not (start <= pos < end):
+                        continue
+                    key = names[pos]
+                else:
+                    key = f"subtitle_{len(image_texts) + 1:04d}.png"
+                image_texts[key] = local[k].strip()
+                if on_result is not None:
+                    on_result(key, image_texts[key])
+            if chunk_stats is not None:
+                chunk_stats.append({**stats, "pages": len(local)})
+            start, chunk_no = end, chunk_no + 1
     finally:
-        for f in chunk_files:
-            try: os.remove(f)
+        sizer.save()
+        if names is not None:
+            try: os.remove(pdf_path)
             except Exception: pass
 
-    # 轉成 subtitle_0001 形式
-    # 把原本的 key 生成處改成有底線形式
-    image_texts = {f"subtitle_{i:04d}.png": image_texts_by_page[p]
-        for i, p in enumerate(sorted(image_texts_by_page.keys()), 1)}
-
+    elapsed = time.perf_counter() - t0
+    metrics.inc("subtitle_ocr_images_total", len(image_texts), engine="gemini")
+    metrics.inc("subtitle_ocr_seconds_total", elapsed, engine="gemini")
+    if elapsed > 0:
+        metrics.set_gauge("subtitle_ocr_images_per_second", len(image_texts) / elapsed, engine="gemini")
 
     print(f"📘 OCR 完成：{file_name}（共 {len(image_texts)} 頁）")
     return image_texts
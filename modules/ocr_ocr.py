@@ -1,42 +1,302 @@
 import os
-from paddleocr import PaddleOCR
+import time
+import numpy as np
+import config
+from modules import image_source, metrics
+from modules.governor import ENV_THREADS
 
-ocr = PaddleOCR(
-    use_doc_orientation_classify=False,
-    use_doc_unwarping=False,
-    use_textline_orientation=False,
-)
+# 辨識模式（config 的 ocr_mode）：
+# - "full"：PaddleOCR 完整流程（文字偵測 + 辨識），每張圖先找文字框再辨識
+# - "rec"：字幕圖本來就是裁好的文字行，略過偵測，只跑辨識模型；
+#   依透明度 / 墨跡的水平投影切成單行，切不出合理的行時退回完整流程
+MODES = ("full", "rec")
 
-def run(file_name):
+# CPU 推論設定（config 的 paddle_*，可由 autotune_paddle.py 自動挑選後寫回 config）：
+# - paddle_cpu_threads：每個模型的推論執行緒數（0 = app.py 分配給此步驟的執行緒預算，沒有時用 PaddleOCR 預設）
+# - paddle_enable_mkldnn："on" / "off" / "auto"（auto = PaddleOCR 預設）
+# - paddle_precision："fp32" / "fp16"
+# - paddle_rec_batch_size：辨識模型一次處理的行數（rec 模式的批次，也用於完整流程的辨識階段）
+# - paddle_model_variant："default" / "server" / "mobile"（mobile 較輕、較快，準確度略低）
+VARIANTS = {
+    "default": {},
+    "server": {"det": "PP-OCRv5_server_det", "rec": "PP-OCRv5_server_rec"},
+    "mobile": {"det": "PP-OCRv5_mobile_det", "rec": "PP-OCRv5_mobile_rec"},
+}
+
+_ocr = None
+_rec = None
+_overrides = {}
+
+# 水平投影切行的參數
+_MIN_LINE_PX = 8        # 低於此高度的墨跡帶視為雜點
+_MAX_LINES = 4          # 超過就不信任切行結果
+_PAD_PX = 4             # 裁切時上下左右保留的邊
+
+
+def settings():
+    """目前生效的 CPU 推論設定（config 的 paddle_*，再套用 configure() 的覆寫）"""
+    cfg = {**config.load_config(), **_overrides}
+    out = {
+        "paddle_cpu_threads": int(cfg.get("paddle_cpu_threads") or 0) or int(os.environ.get(ENV_THREADS) or 0),
+        "paddle_enable_mkldnn": str(cfg.get("paddle_enable_mkldnn") or "auto").lower(),
+        "paddle_precision": str(cfg.get("paddle_precision") or "fp32").lower(),
+        "paddle_rec_batch_size": int(cfg.get("paddle_rec_batch_size") or 16),
+        "paddle_model_variant": str(cfg.get("paddle_model_variant") or "default").lower(),
+    }
+    if out["paddle_enable_mkldnn"] not in ("on", "off", "auto"):
+        raise ValueError(f"paddle_enable_mkldnn 應為 on / off / auto：{out['paddle_enable_mkldnn']}")
+    if out["paddle_model_variant"] not in VARIANTS:
+        raise ValueError(f"未知的 paddle_model_variant：{out['paddle_model_variant']}（可用：{', '.join(VARIANTS)}）")
+    return out
+
+
+def configure(overrides=None):
+    """覆寫 CPU 推論設定（None = 重新讀 config）；已建立的模型會丟棄，下次使用時依新設定重建"""
+    global _ocr, _rec, _overrides
+    _overrides = dict(overrides or {})
+    _ocr = _rec = None
+
+
+def _runtime_kwargs(s):
+    kwargs = {"device": "cpu", "precision": s["paddle_precision"]}
+    if s["paddle_cpu_threads"] > 0:
+        kwargs["cpu_threads"] = s["paddle_cpu_threads"]
+    if s["paddle_enable_mkldnn"] != "auto":
+        kwargs["enable_mkldnn"] = s["paddle_enable_mkldnn"] == "on"
+    return kwargs
+
+
+def _get_ocr():
+    """完整流程的 PaddleOCR，第一次使用時才建立（每個行程一次）"""
+    global _ocr
+    if _ocr is None:
+        from paddleocr import PaddleOCR
+        s = settings()
+        models = VARIANTS[s["paddle_model_variant"]]
+        kwargs = _runtime_kwargs(s)
+        if models:
+            kwargs.update(text_detection_model_name=models["det"], text_recognition_model_name=models["rec"])
+        _ocr = PaddleOCR(
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+            text_recognition_batch_size=s["paddle_rec_batch_size"],
+            **kwargs,
+        )
+    return _ocr
+
+
+def _get_rec():
+    """只有辨識模型（與完整流程使用的辨識模型相同）"""
+    global _rec
+    if _rec is None:
+        from paddleocr import TextRecognition
+        s = settings()
+        models = VARIANTS[s["paddle_model_variant"]]
+        kwargs = _runtime_kwargs(s)
+        if models:
+            kwargs["model_name"] = models["rec"]
+        _rec = TextRecognition(**kwargs)
+    return _rec
+
+
+def warm_up(mode=None):
+    mode = _resolve_mode(mode)
+    _get_ocr()
+    if mode == "rec":
+        _get_rec()
+
+
+def _resolve_mode(mode):
+    mode = str(mode or config.load_config().get("ocr_mode") or "full").lower()
+    if mode not in MODES:
+        raise ValueError(f"未知的 ocr_mode：{mode}（可用：{', '.join(MODES)}）")
+    return mode
+
+
+def _ocr_input(source, name):
+    """磁碟上的檔案直接給路徑；zip 內的圖片解碼成 BGR ndarray（PaddleOCR 的輸入格式）"""
+    path = source.local_path(name)
+    if path is not None:
+        return path
+    with source.open_image(name) as im:
+        return np.asarray(im.convert("RGB"))[:, :, ::-1].copy()
+
+
+def _full_predict(img):
+    """完整流程；回傳 (文字, 分數)，分數取各行辨識分數的最小值"""
+    res = _get_ocr().predict(img)[0]
+    texts, scores = res["rec_texts"], res["rec_scores"]
+    return " ".join(texts), float(min(scores)) if len(scores) else 0.0
+
+
+def _ink_mask(im):
+    """有透明度時以 alpha 判斷墨跡；否則以與背景（四角中位數）的差異判斷"""
+    if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+        return np.asarray(im.convert("RGBA"))[:, :, 3] > 32
+    gray = np.asarray(im.convert("L"), dtype=np.int16)
+    corners = np.array([gray[0, 0], gray[0, -1], gray[-1, 0], gray[-1, -1]])
+    return np.abs(gray - int(np.median(corners))) > 40
+
+
+def split_lines(ink):
+    """
+    以水平投影把墨跡切成文字行，回傳 [(top, bottom, left, right), ...]；
+    沒有墨跡回傳 []，看起來不像單純的幾行文字時回傳 None（交給完整流程）
+    """
+    h, w = ink.shape
+    rows = ink.any(axis=1)
+    if not rows.any():
+        return []
+    # 連續有墨跡的列組成一條帶；兩條帶之間的空白太小（< 3px）視為同一行
+    bands, start, gap = [], None, 0
+    for y, on in enumerate(rows):
+        if on:
+            if start is None:
+                start = y
+            gap = 0
+        elif start is not None:
+            gap += 1
+            if gap >= 3:
+                bands.append((start, y - gap + 1))
+                start, gap = None, 0
+    if start is not None:
+        bands.append((start, h - gap))
+    bands = [(t, b) for t, b in bands if b - t >= _MIN_LINE_PX]
+    if not bands or len(bands) > _MAX_LINES:
+        return None
+
+    lines = []
+    for t, b in bands:
+        cols = np.nonzero(ink[t:b].any(axis=0))[0]
+        left, right = int(cols[0]), int(cols[-1]) + 1
+        # 單行文字應該是扁長的；接近正方形代表切行可能失敗（例如多行擠在一起）
+        if (right - left) < 1.5 * (b - t):
+            return None
+        lines.append((max(0, t - _PAD_PX), min(h, b + _PAD_PX),
+                      max(0, left - _PAD_PX), min(w, right + _PAD_PX)))
+    return lines
+
+
+def _crop_lines(source, name):
+    """回傳該圖各行的 BGR ndarray；None 表示需要完整流程"""
+    with source.open_image(name) as im:
+        lines = split_lines(_ink_mask(im))
+        if not lines:
+            return lines
+        bgr = np.asarray(im.convert("RGB"))[:, :, ::-1]
+        return [np.ascontiguousarray(bgr[t:b, l:r]) for t, b, l, r in lines]
+
+
+def _run_rec(source, names, emit, stats):
+    """辨識模式：切行後批次送進辨識模型，切不出來的圖退回完整流程"""
+    rec = _get_rec()
+    batch_size = settings()["paddle_rec_batch_size"]
+    pending = []  # [(檔名, 行數)]
+    crops = []
+
+    def full(file):
+        stats["fallback"] += 1
+        try:
+            emit(file, *_full_predict(_ocr_input(source, file)))
+        except Exception as e:
+            print(f"⚠️ 無法辨識：{source.label}/{file} ({e})")
+            emit(file, "", 0.0)
+
+    def flush():
+        # 任何一次批次辨識失敗，這批的圖片都改用完整流程，不影響其他批次
+        if not crops:
+            return
+        batch = list(pending)
+        try:
+            results = rec.predict(crops, batch_size=batch_size)
+        except Exception as e:
+            print(f"⚠️ 辨識批次失敗，改用完整流程（{e}）")
+            results = None
+        finally:
+            pending.clear()
+            crops.clear()
+        if results is None:
+            for file, _ in batch:
+                full(file)
+            return
+        k = 0
+        for file, n in batch:
+            texts = [results[k + i]["rec_text"] for i in range(n)]
+            scores = [float(results[k + i]["rec_score"]) for i in range(n)]
+            k += n
+            emit(file, " ".join(t for t in texts if t), min(scores))
+
+    for file in names:
+        try:
+            lines = _crop_lines(source, file)
+        except Exception as e:
+            print(f"⚠️ 無法讀取：{source.label}/{file} ({e})")
+            lines = None
+        if lines == []:
+            flush()
+            emit(file, "", 0.0)
+            continue
+        if lines is None:
+            flush()
+            full(file)
+            continue
+        pending.append((file, len(lines)))
+        crops.extend(lines)
+        if len(crops) >= batch_size:
+            flush()
+    flush()
+
+
+def run(file_name, on_result=None, names=None, mode=None):
     """
     🔤 辨識英文圖片文字，回傳 {檔名: 文字} 字典
     參數：
-        file_name (str): 圖片資料夾名稱，例如 '輕量版__英文測試'
-        ocr: PaddleOCR 或其他 OCR 模型物件
+        file_name (str): 圖片資料夾（或 data/ 下同名 zip）名稱，例如 '輕量版__英文測試'
+        on_result (callable|None): 每辨識完一張就呼叫 on_result(檔名, 文字, score=辨識分數)，
+            供下游邊辨識邊讀取（例如 handoff.JsonlWriter）
+        names (list|None): 只辨識這些檔名（分片處理用）；None 表示全部
+        mode (str|None): "full" / "rec"；None 時讀 config 的 ocr_mode
     回傳：
         dict: {檔名: 辨識出的文字}
     """
-    # 指定要掃描的資料夾
-    folder_path = "data/" + file_name
+    mode = _resolve_mode(mode)
+
+    # 圖片來源：data/{file_name}.zip（直接從壓縮檔讀取）或 data/{file_name}/ 資料夾
+    source = image_source.open_source(file_name)
 
     # 建立空字典
     image_texts = {}
+    stats = {"fallback": 0}
+
+    def emit(file, text, score):
+        # 以檔名作為 key，辨識文字作為 value
+        image_texts[file] = text
+        if on_result is not None:
+            on_result(file, text, score=round(score, 4))
 
     # 遍歷所有檔案
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-
-            # 辨識
-            try:
-                text = " ".join(ocr.predict(file_path)[0]['rec_texts'])
-            except Exception as e:
-                print(f"⚠️ 無法辨識：{file_path} ({e})")
-                text = ""
-                pass
-
-            # 以檔名作為 key，辨識文字作為 value
-            image_texts[file] = text
-
-    print(f"✅ 已完成辨識，共 {len(image_texts)} 筆")
+    t0 = time.perf_counter()
+    with source:
+        names = source.names() if names is None else names
+        if mode == "rec":
+            _run_rec(source, names, emit, stats)
+        else:
+            for file in names:
+                # 辨識
+                try:
+                    text, score = _full_predict(_ocr_input(source, file))
+                except Exception as e:
+                    print(f"⚠️ 無法辨識：{source.label}/{file} ({e})")
+                    text, score = "", 0.0
+                emit(file, text, score)
+
+    elapsed = time.perf_counter() - t0
+    metrics.inc("subtitle_ocr_images_total", len(image_texts), engine="paddle")
+    metrics.inc("subtitle_ocr_seconds_total", elapsed, engine="paddle")
+    if elapsed > 0:
+        metrics.set_gauge("subtitle_ocr_images_per_second", len(image_texts) / elapsed, engine="paddle")
+
+    extra = f"（模式 {mode}" + (f"，{stats['fallback']} 張改用完整流程）" if mode == "rec" else "）")
+    print(f"✅ 已完成辨識，共 {len(image_texts)} 筆{extra}")
     return image_texts
@@ -0,0 +1,254 @@
+# modules/pipeline.py
+# 功能：在同一個行程內依序執行一部片（一組中英文字幕）的各步驟
+# 與 app.py /run 的流程相同：下載 → OCR → （翻譯）→ XML 轉 SRT → 合併
+# 給批次模式（batch.py）與工作佇列的 worker（worker.py）使用：每部片有自己的工作目錄（內含 data/ 與 output/），
+# 各模組的相對路徑 "data/"、"output/" 都以該目錄為準
+#
+# 模型只在每個行程載入一次：ocr_ocr 與 merge_srt._get_model() 都會快取已建立的模型
+
+from __future__ import annotations
+import contextlib, os, time, traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import config
+
+LANGS = ("en", "ch")
+
+
+def title_settings(title: Dict) -> Dict:
+    """以 config.json 為預設值，套上單部片的設定"""
+    cfg = config.load_config()
+    out = {k: cfg.get(k) for k in ("ocr", "translate", "api_key",
+                                  "xml_file_name_en", "xml_file_name_ch")}
+    out["ocr"] = out.get("ocr") or "paddle"
+    out.update({k: v for k, v in title.items() if v not in (None, "")})
+    out["ocr"] = str(out["ocr"]).lower()
+    out["translate"] = str(out.get("translate") or "none").lower()
+    return out
+
+
+def title_name(title: Dict) -> str:
+    return title.get("name") or title.get("file_name_en") or title.get("file_name_ch") or "untitled"
+
+
+@contextlib.contextmanager
+def workspace(path):
+    """切換到工作目錄（行程層級；一個 worker 同時只處理一部片）"""
+    path = Path(path)
+    (path / "data").mkdir(parents=True, exist_ok=True)
+    (path / "output").mkdir(parents=True, exist_ok=True)
+    prev = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(prev)
+
+
+# --------- 各步驟 ---------
+def stage_download(t: Dict) -> None:
+    from modules import load_en_images, load_ch_images
+    if t.get("drive_url_en"):
+        load_en_images.run(t["file_name_en"], t["drive_url_en"])
+    if t.get("drive_url_ch"):
+        load_ch_images.run(t["file_name_ch"], t["drive_url_ch"])
+
+
+def _ocr_runner(t: Dict):
+    """回傳 run(name, on_result, names=None)"""
+    if t["ocr"] in ("gemini", "cascade"):
+        from modules import ocr_cascade, ocr_gemini
+        engine = ocr_gemini if t["ocr"] == "gemini" else ocr_cascade
+        return lambda name, cb, names=None: engine.run(name, api_key=t.get("api_key") or None,
+                                                       on_result=cb, names=names)
+    from modules import ocr_ocr as engine
+    return lambda name, cb, names=None: engine.run(name, on_result=cb, names=names)
+
+
+def _xml_name(t: Dict, lang: str) -> str:
+    return t.get(f"xml_file_name_{lang}") or f"subtitle_{lang}.xml"
+
+
+def stage_ocr(t: Dict) -> None:
+    from modules import handoff, preflight
+    run = _ocr_runner(t)
+    for lang in LANGS:
+        name = t.get(f"file_name_{lang}")
+        if not name:
+            continue
+        try:
+            names = preflight.work_list(name, _xml_name(t, lang))
+            with handoff.JsonlWriter(handoff.texts_path(lang, prefer_existing=False)) as writer:
+                run(name, writer, names=names)
+        except FileNotFoundError:
+            print(f"沒有 {lang} 字幕圖片檔。")
+
+
+def stage_ocr_shard(t: Dict, lang: str, shard: int = 0, shards: int = 1) -> None:
+    """
+    辨識某語言圖片的第 shard 份（預檢的工作清單或依檔名排序後，每 shards 張取一張），寫到 handoff.shard_path()。
+    Gemini 只支援 shards=1（每個 worker 各自計算 gemini_rpm，分片會讓請求數倍增）；
+    cascade 可以分片：升級到 Gemini 的暫存 PDF 檔名含行程 ID，各分片互不干擾。
+    """
+    from modules import handoff, image_source, preflight
+    name = t.get(f"file_name_{lang}")
+    out = handoff.shard_path(lang, shard)
+    out.unlink(missing_ok=True)
+    if shards > 1 and t["ocr"] == "gemini":
+        raise ValueError("Gemini OCR 不支援分片")
+    run = _ocr_runner(t)
+    try:
+        names = preflight.work_list(name, _xml_name(t, lang))
+        if shards > 1:
+            if names is None:
+                with image_source.open_source(name) as src:
+                    names = src.names()
+            names = names[shard::shards]
+        with handoff.JsonlWriter(out) as writer:
+            run(name, writer, names=names)
+    except FileNotFoundError:
+        print(f"沒有 {lang} 字幕圖片檔。")
+
+
+def stage_ocr_collect(t: Dict, lang: str, shards: int = 1) -> None:
+    """把各分片的結果依檔名排序合併成 data/img_to_text_{lang}.jsonl"""
+    from modules import handoff
+    parts = [handoff.shard_path(lang, i) for i in range(shards)]
+    records = {}
+    for p in parts:
+        if p.exists():
+            for rec in handoff.iter_records(p):
+                records[rec["key"]] = rec
+    if not records:
+        print(f"沒有 {lang} 的 OCR 結果。")
+    else:
+        with handoff.JsonlWriter(handoff.texts_path(lang, prefer_existing=False)) as writer:
+            for key in sorted(records):
+                writer.write_record(records[key])
+        print(f"✅ 已合併 {lang} 的 {len(parts)} 個分片，共 {len(records)} 筆")
+    for p in parts:
+        p.unlink(missing_ok=True)
+
+
+def stage_translate(t: Dict) -> None:
+    from modules.trans_gemini import _gemini_trans
+    _gemini_trans(data_dir=os.path.abspath("data"), api_key=t.get("api_key") or None)
+
+
+def stage_xml_srt(t: Dict) -> None:
+    from modules import handoff, xml_srt
+    for lang in LANGS:
+        xml_name = _xml_name(t, lang)
+        if not os.path.exists(os.path.join("data", xml_name)):
+            print(f"沒有 {xml_name}，略過。")
+            continue
+        xml_srt.run(xml_name, handoff.load_texts(handoff.texts_path(lang)), make_backup=True)
+
+
+def stage_merge(t: Dict) -> None:
+    from modules.merge_srt import merge_bilingual_srt
+    merge_bilingual_srt(ch_srt_name="subtitle_ch.srt", en_srt_name="subtitle_en.srt", output_dir="output")
+
+
+STAGES = [
+    ("download", stage_download),
+    ("ocr", stage_ocr),
+    ("translate", stage_translate),
+    ("xml_to_srt", stage_xml_srt),
+    ("merge", stage_merge),
+]
+
+
+# 工作佇列的 task 種類 → 執行函式（參數為 title 設定與 task 的 payload）
+TASK_KINDS = {
+    "download": stage_download,
+    "ocr": stage_ocr_shard,
+    "ocr_collect": stage_ocr_collect,
+    "translate": stage_translate,
+    "xml_to_srt": stage_xml_srt,
+    "merge": stage_merge,
+}
+
+
+def plan_tasks(title: Dict, ocr_shards: int = 1) -> List[Dict]:
+    """
+    把一部片拆成工作佇列的 task（含相依）：
+    download → ocr 分片 ×N（每語言）→ ocr_collect → （translate）→ xml_to_srt → merge
+    """
+    t = title_settings(title)
+    shards = 1 if t["ocr"] == "gemini" else max(1, int(ocr_shards))
+    tasks = [{"name": "download", "kind": "download", "payload": {}, "deps": []}]
+    collected = []
+    for lang in LANGS:
+        if not t.get(f"file_name_{lang}"):
+            continue
+        names = [f"ocr_{lang}_{i}" for i in range(shards)]
+        tasks += [{"name": n, "kind": "ocr", "payload": {"lang": lang, "shard": i, "shards": shards},
+                   "deps": ["download"]} for i, n in enumerate(names)]
+        tasks.append({"name": f"ocr_collect_{lang}", "kind": "ocr_collect",
+                      "payload": {"lang": lang, "shards": shards}, "deps": names})
+        collected.append(f"ocr_collect_{lang}")
+    before_srt = collected or ["download"]
+    if t["translate"] != "none":
+        tasks.append({"name": "translate", "kind": "translate", "payload": {}, "deps": before_srt})
+        before_srt = ["translate"]
+    tasks.append({"name": "xml_to_srt", "kind": "xml_to_srt", "payload": {}, "deps": before_srt})
+    tasks.append({"name": "merge", "kind": "merge", "payload": {}, "deps": ["xml_to_srt"]})
+    return tasks
+
+
+def run_task(task: Dict) -> None:
+    """在 task 所屬 job 的工作目錄執行一個 task，輸出附加到 <work_dir>/logs/<task 名稱>.txt"""
+    t = title_settings(task["title"])
+    work_dir = Path(task["work_dir"])
+    with workspace(work_dir):
+        (work_dir / "logs").mkdir(exist_ok=True)
+        with open(work_dir / "logs" / f"{task['name']}.txt", "a", encoding="utf-8") as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            print(f"===== {task['name']}（第 {task['attempts']} 次，pid {os.getpid()}）=====", flush=True)
+            try:
+                TASK_KINDS[task["kind"]](t, **task["payload"])
+            except Exception:
+                traceback.print_exc()
+                raise
+
+
+def warm_up(engines: Optional[List[str]] = None) -> None:
+    """worker 啟動時預先載入模型"""
+    if {"paddle", "cascade"} & set(engines or ["paddle"]):
+        from modules import ocr_ocr
+        ocr_ocr.warm_up()
+    from modules import merge_srt
+    merge_srt._get_model()
+
+
+def run_title(title: Dict, work_dir) -> Dict:
+    """
+    執行一部片的完整流程，輸出寫到 work_dir/log.txt。
+    回傳 {"name", "ok", "timings": {步驟: 秒}, "failed_stage", "error", "work_dir"}
+    """
+    t = title_settings(title)
+    work_dir = Path(work_dir).resolve()
+    report = {"name": title_name(t), "ok": False, "timings": {}, "failed_stage": None,
+              "error": None, "work_dir": str(work_dir), "pid": os.getpid()}
+    with workspace(work_dir), open(work_dir / "log.txt", "w", encoding="utf-8") as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        for stage, fn in STAGES:
+            if stage == "translate" and t["translate"] == "none":
+                continue
+            print(f"===== {stage} =====", flush=True)
+            t0 = time.perf_counter()
+            try:
+                fn(t)
+            except Exception as e:
+                report["timings"][stage] = round(time.perf_counter() - t0, 3)
+                report["failed_stage"] = stage
+                report["error"] = f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+                return report
+            report["timings"][stage] = round(time.perf_counter() - t0, 3)
+    report["ok"] = True
+    from modules import uploads
+    uploads.release(t.get("drive_url_en"), t.get("drive_url_ch"))
+    return report
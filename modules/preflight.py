@@ -0,0 +1,101 @@
+# modules/preflight.py
+# 功能：OCR 前的預檢——只辨識字幕 XML 實際用到的圖片
+# 1. 解析 XML 中 <Event> 內的 <Graphic> 檔名（依出現順序、去除重複），即 xml_srt 會查詢的 key
+# 2. 與圖片來源（zip / 資料夾）比對：
+#    - 來源裡沒有的檔名（missing）事先列出、不送 OCR
+#    - 來源裡有、但 XML 沒用到的檔案（unreferenced，例如補位圖、非 PNG 檔）略過
+# 3. 回傳有序的工作清單，交給任一 OCR 引擎的 names 參數；
+#    Gemini 因此以檔名作為 key，不再依 PDF 頁序假設為 subtitle_{i:04d}.png
+#
+# 找不到 XML（或 config 的 ocr_preflight 為 "off"）時回傳 None，維持辨識全部圖片的舊行為
+
+from __future__ import annotations
+import os
+import xml.etree.ElementTree as ET
+from typing import List, NamedTuple, Optional
+
+import config
+from modules import image_source, metrics
+
+
+class WorkList(NamedTuple):
+    names: List[str]          # 要辨識的檔名（XML 順序）
+    missing: List[str]        # XML 有引用、來源裡找不到
+    unreferenced: List[str]   # 來源裡有、XML 沒引用
+
+
+def _local(tag: str) -> str:
+    return tag.split("}")[-1]
+
+
+def graphic_refs(xml_bytes: bytes) -> List[str]:
+    """<Event> 內 <Graphic> 的文字（檔名），依出現順序、去除重複"""
+    root = ET.fromstring(xml_bytes)
+    seen, refs = set(), []
+    for event in root.iter():
+        if _local(event.tag) != "Event":
+            continue
+        for elem in event.iter():
+            if _local(elem.tag) != "Graphic":
+                continue
+            name = (elem.text or "").strip()
+            if name and name not in seen:
+                seen.add(name)
+                refs.append(name)
+    return refs
+
+
+def _enabled() -> bool:
+    return str(config.load_config().get("ocr_preflight") or "on").lower() not in ("off", "0", "false")
+
+
+def _print_names(label: str, names: List[str], limit: int = 5) -> None:
+    more = f" …（另 {len(names) - limit} 個）" if len(names) > limit else ""
+    print(f"   {label} {len(names)} 個：{', '.join(names[:limit])}{more}")
+
+
+def build(file_name: str, xml_file_name: Optional[str] = None, data_dir: str = "data") -> Optional[WorkList]:
+    """
+    以 data/{xml_file_name}（不存在時改讀圖片包內的 subtitle.xml）建立工作清單並印出報告
+    沒有 XML 或 XML 沒有任何 <Graphic> 時回傳 None
+    """
+    if not _enabled():
+        return None
+    xml_path = os.path.join(data_dir, xml_file_name) if xml_file_name else None
+    with image_source.open_source(file_name, data_dir) as source:
+        if xml_path and os.path.isfile(xml_path):
+            with open(xml_path, "rb") as f:
+                xml, xml_label = f.read(), xml_path
+        else:
+            xml, xml_label = source.read_xml(), f"{source.label}/subtitle.xml"
+        if xml is None:
+            print(f"ℹ️ 找不到字幕 XML，辨識 {source.label} 的全部檔案")
+            return None
+        try:
+            refs = graphic_refs(xml)
+        except ET.ParseError as e:
+            print(f"⚠️ 無法解析 {xml_label}（{e}），辨識全部檔案")
+            return None
+        if not refs:
+            print(f"⚠️ {xml_label} 沒有任何 <Graphic>，辨識全部檔案")
+            return None
+        available = set(source.names())
+        names = [n for n in refs if n in source]
+        missing = [n for n in refs if n not in source]
+        referenced = set(refs)
+        unreferenced = sorted(available - referenced)
+
+    metrics.inc("subtitle_ocr_skipped_total", len(missing), reason="missing")
+    metrics.inc("subtitle_ocr_skipped_total", len(unreferenced), reason="unreferenced")
+    print(f"🧾 預檢 {xml_label}：引用 {len(refs)} 張，辨識 {len(names)} 張")
+    if missing:
+        _print_names("⚠️ 圖片包裡找不到", missing)
+    if unreferenced:
+        _print_names("略過未被引用的檔案", unreferenced)
+    return WorkList(names, missing, unreferenced)
+
+
+def work_list(file_name: str, xml_file_name: Optional[str] = None, data_dir: str = "data") -> Optional[List[str]]:
+    """build() 的簡便版本：只回傳要辨識的檔名清單（None = 全部）"""
+    wl = build(file_name, xml_file_name, data_dir)
+    return None if wl is None else wl.names
@@ -0,0 +1,113 @@
+# modules/profiling.py
+# 功能：步驟層級的效能剖析（預設關閉，由 app.py 依 config / 請求的 "profile" 開啟）
+# - "on"：cProfile + tracemalloc
+# - "sample"：再加上取樣式剖析（每隔數毫秒記錄主執行緒呼叫堆疊），輸出 collapsed stacks，
+#   可直接給 flamegraph.pl / speedscope 畫火焰圖
+#
+# 產出（放在 output/profiles/<job_id>/，可經由 /files/profiles/... 下載）：
+#   <stage>.pstats          cProfile 原始資料（python -m pstats / snakeviz 可開）
+#   <stage>.pstats.txt      依累計時間排序的前 60 名
+#   <stage>.alloc.txt       tracemalloc 峰值與結束時仍存活的配置前 30 名
+#   <stage>.collapsed       取樣堆疊（sample 模式）
+
+from __future__ import annotations
+import cProfile, io, os, pstats, sys, threading, time, tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Optional
+
+ENV_DIR = "SUBTITLE_PROFILE_DIR"
+ENV_MODE = "SUBTITLE_PROFILE_MODE"
+
+
+def normalize_mode(value) -> Optional[str]:
+    """把 config / 請求的值轉成 None / "on" / "sample" """
+    v = str(value or "").strip().lower()
+    if v in ("sample", "sampling"):
+        return "sample"
+    if v in ("on", "true", "1", "yes", "cprofile"):
+        return "on"
+    return None
+
+
+class StackSampler:
+    """背景執行緒定期取樣目標執行緒的堆疊，累計成 collapsed stacks"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(parts))] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+def profile_call(fn: Callable[[], object], out_dir, stage: str, mode: str = "on"):
+    """在剖析下執行 fn()，結束後（即使發生例外）寫出剖析檔"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sampler = StackSampler().start() if mode == "sample" else None
+    tracemalloc.start(25)
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    prof.enable()
+    try:
+        return fn()
+    finally:
+        prof.disable()
+        elapsed = time.perf_counter() - t0
+        if sampler is not None:
+            sampler.stop()
+        snap = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _write_reports(out_dir, stage, prof, snap, peak, elapsed, sampler)
+
+
+def _write_reports(out_dir: Path, stage: str, prof: cProfile.Profile, snap, peak: int,
+                   elapsed: float, sampler: Optional[StackSampler]) -> None:
+    prof.dump_stats(str(out_dir / f"{stage}.pstats"))
+
+    buf = io.StringIO()
+    stats = pstats.Stats(prof, stream=buf)
+    stats.sort_stats("cumulative").print_stats(60)
+    (out_dir / f"{stage}.pstats.txt").write_text(
+        f"stage: {stage}\nwall time: {elapsed:.3f}s\n\n" + buf.getvalue(), encoding="utf-8")
+
+    snap = snap.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    lines = [f"stage: {stage}", f"peak traced memory: {peak / 1e6:.1f} MB", "", "top 30 allocators live at stage end (by line):"]
+    for i, stat in enumerate(snap.statistics("lineno")[:30], 1):
+        frame = stat.traceback[0]
+        lines.append(f"{i:2d}. {frame.filename}:{frame.lineno}  {stat.size / 1e6:.2f} MB  ({stat.count} blocks)")
+    (out_dir / f"{stage}.alloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    if sampler is not None:
+        sampler.write_collapsed(out_dir / f"{stage}.collapsed")
+    print(f"🔍 剖析完成：{stage}（{elapsed:.1f}s），輸出於 {out_dir}", file=sys.stderr)
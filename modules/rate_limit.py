@@ -0,0 +1,74 @@
+# modules/rate_limit.py
+# 功能：Gemini 請求的速率限制（每分鐘請求數，config "gemini_rpm"，0 = 不限制）
+# - 單一行程：以本地鎖控制
+# - 批次模式（batch.py）：主行程建立 multiprocessing 的 Lock / Value，
+#   透過 worker initializer 呼叫 share()，所有 worker 共用同一份額度
+#
+# 用法：呼叫 Gemini 前先 rate_limit.acquire()
+
+from __future__ import annotations
+import threading, time
+from typing import Optional
+
+import config
+
+_local_lock = threading.Lock()
+_local_next = [0.0]
+
+_shared_lock = None
+_shared_next = None
+_rpm: Optional[float] = None
+
+
+def _get_rpm() -> float:
+    global _rpm
+    if _rpm is None:
+        try:
+            _rpm = float(config.load_config().get("gemini_rpm") or 0)
+        except (TypeError, ValueError):
+            _rpm = 0.0
+    return _rpm
+
+
+def configure(rpm: Optional[float]) -> None:
+    """覆寫每分鐘請求數（None = 重新讀 config）"""
+    global _rpm
+    _rpm = rpm
+
+
+def make_shared(ctx=None):
+    """主行程呼叫：建立可跨行程共用的 (lock, value)，交給 share()"""
+    import multiprocessing as mp
+    ctx = ctx or mp
+    return ctx.Lock(), ctx.Value("d", 0.0, lock=False)
+
+
+def share(lock, value, rpm: Optional[float] = None) -> None:
+    """worker 行程呼叫：改用跨行程共用的額度"""
+    global _shared_lock, _shared_next
+    _shared_lock, _shared_next = lock, value
+    if rpm is not None:
+        configure(rpm)
+
+
+def acquire() -> float:
+    """
+    取得一次請求額度；必要時等待。回傳實際等待秒數
+    """
+    rpm = _get_rpm()
+    if rpm <= 0:
+        return 0.0
+    interval = 60.0 / rpm
+    now = time.time()
+    if _shared_lock is not None:
+        with _shared_lock:
+            slot = max(now, _shared_next.value)
+            _shared_next.value = slot + interval
+    else:
+        with _local_lock:
+            slot = max(now, _local_next[0])
+            _local_next[0] = slot + interval
+    wait = slot - now
+    if wait > 0:
+        time.sleep(wait)
+    return wait
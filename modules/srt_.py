@@ -0,0 +1,222 @@
+# modules/srt_.py
+# 功能：
+# 1. iter_srt()：逐段（generator）解析 SRT，檔案或串流皆可，記憶體用量固定
+#    - 自動處理 UTF-8 BOM（含串接檔案中途出現的 BOM）與 CRLF / CR 換行
+#    - 字幕內容中的空行會保留，不會被誤判成段落結尾
+#    - 可一次傳入多個來源，或讀取多份 SRT 直接串接而成的檔案
+# 2. SrtWriter：緩衝後批次寫出
+# 3. 無損往返：Cue 保留原始序號、時間碼與內文，寫回後內容不變
+
+from __future__ import annotations
+import io, os, re
+from collections import deque
+from typing import IO, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+Source = Union[str, "os.PathLike[str]", IO[str], IO[bytes], Iterable[str]]
+
+
+class Cue(NamedTuple):
+    index: str
+    timecode: str
+    text: str
+
+    @property
+    def start(self) -> float:
+        return parse_timecode(self.timecode)[0]
+
+    @property
+    def end(self) -> float:
+        return parse_timecode(self.timecode)[1]
+
+
+# --------- 時間碼 ---------
+_TIME_LINE = re.compile(
+    r"^\s*(\d+:\d{1,2}:\d{1,2}[,.]\d{1,3})\s*-->\s*(\d+:\d{1,2}:\d{1,2}[,.]\d{1,3})"
+)
+
+
+def time_to_seconds(t: str) -> float:
+    """'HH:MM:SS,mmm' → 秒數（也接受 '.' 作為毫秒分隔）"""
+    h, m, s_milli = t.strip().split(":")
+    s, milli = re.split(r"[,.]", s_milli)
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(milli.ljust(3, "0")) / 1000.0
+
+
+def seconds_to_time(sec: float) -> str:
+    """秒數 → 'HH:MM:SS,mmm'（負值以 0 計）"""
+    total_ms = max(0, int(round(sec * 1000)))
+    h, total_ms = divmod(total_ms, 3600000)
+    m, total_ms = divmod(total_ms, 60000)
+    s, ms = divmod(total_ms, 1000)
+    return f"{h:02}:{m:02}:{s:02},{ms:03}"
+
+
+def parse_timecode(timecode: str) -> Tuple[float, float]:
+    """'00:00:01,000 --> 00:00:02,500' → (1.0, 2.5)"""
+    m = _TIME_LINE.match(timecode)
+    if not m:
+        raise ValueError(f"無法解析時間碼：{timecode!r}")
+    return time_to_seconds(m.group(1)), time_to_seconds(m.group(2))
+
+
+def format_timecode(start: float, end: float) -> str:
+    return f"{seconds_to_time(start)} --> {seconds_to_time(end)}"
+
+
+# --------- 讀取 ---------
+_NEWLINE = re.compile(r"\r\n|\r|\n")
+
+
+def _open_lines(source: Source) -> Tuple[Iterable[str], Optional[IO]]:
+    """回傳 (逐行迭代器, 需要關閉的檔案物件或 None)"""
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, "r", encoding="utf-8-sig", newline="")
+        return f, f
+    if isinstance(source, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(source, "mode", ""):
+        return io.TextIOWrapper(source, encoding="utf-8-sig", newline=""), None
+    return source, None
+
+
+def _split_lines(lines: Iterable[str]) -> Iterator[str]:
+    """去掉行尾換行（\\n / \\r\\n / \\r）與 BOM；傳入整段文字時也會再切行"""
+    for raw in lines:
+        if raw.endswith("\r\n"):
+            raw = raw[:-2]
+        elif raw.endswith(("\n", "\r")):
+            raw = raw[:-1]
+        for line in _NEWLINE.split(raw):
+            yield line.replace("\ufeff", "")
+
+
+def _iter_one(source: Source) -> Iterator[Cue]:
+    lines, owned = _open_lines(source)
+    try:
+        it = _split_lines(lines)
+        ahead: deque = deque()
+
+        def peek(n: int) -> Optional[str]:
+            while len(ahead) <= n:
+                try:
+                    ahead.append(next(it))
+                except StopIteration:
+                    return None
+            return ahead[n]
+
+        def is_cue_start() -> bool:
+            first, second = peek(0), peek(1)
+            return (first is not None and second is not None
+                    and first.strip().isdigit() and bool(_TIME_LINE.match(second)))
+
+        index = timecode = None
+        body: List[str] = []
+        while peek(0) is not None:
+            if is_cue_start():
+                if index is not None:
+                    yield Cue(index, timecode, _join_body(body))
+                index = ahead.popleft().strip()
+                timecode = ahead.popleft().strip()
+                body = []
+                continue
+            line = ahead.popleft()
+            if index is not None:
+                body.append(line)
+        if index is not None:
+            yield Cue(index, timecode, _join_body(body))
+    finally:
+        if owned is not None:
+            owned.close()
+
+
+def _join_body(body: List[str]) -> str:
+    # 段落之間的分隔空行不屬於內文；內文中間的空行保留
+    while body and not body[-1].strip():
+        body.pop()
+    return "\n".join(body)
+
+
+def iter_srt(*sources: Source) -> Iterator[Cue]:
+    """
+    逐段讀取一或多個 SRT 來源（路徑、文字/二進位串流、或逐行可迭代物件）。
+    多個來源依序串接輸出，不會重新編號。
+    """
+    for source in sources:
+        yield from _iter_one(source)
+
+
+def read_srt(*sources: Source) -> List[Cue]:
+    return list(iter_srt(*sources))
+
+
+# --------- 寫出 ---------
+CueLike = Union[Cue, Tuple[str, str, str], Mapping[str, object]]
+
+
+def _as_cue(rec: CueLike) -> Cue:
+    if isinstance(rec, Mapping):
+        return Cue(str(rec["index"]), str(rec["timecode"]), str(rec["text"]))
+    index, timecode, text = rec
+    return Cue(str(index), str(timecode), str(text))
+
+
+class SrtWriter:
+    """
+    緩衝式 SRT 寫出器；累積 buffer_cues 段後才寫入一次。
+
+    用法：
+        with SrtWriter("output/a.srt", renumber=True) as w:
+            for cue in cues:
+                w.write(cue)
+    """
+
+    def __init__(self, target: Union[str, "os.PathLike[str]", IO[str]], *,
+                 renumber: bool = False, newline: str = "\n",
+                 buffer_cues: int = 512, encoding: str = "utf-8"):
+        if isinstance(target, (str, os.PathLike)):
+            self._f = open(target, "w", encoding=encoding, newline="")
+            self._owned = True
+        else:
+            self._f = target
+            self._owned = False
+        self.renumber = renumber
+        self.newline = newline
+        self.buffer_cues = max(1, buffer_cues)
+        self.count = 0
+        self._buf: List[str] = []
+
+    def write(self, rec: CueLike) -> None:
+        cue = _as_cue(rec)
+        self.count += 1
+        index = str(self.count) if self.renumber else cue.index
+        nl = self.newline
+        text = cue.text.replace("\n", nl) if nl != "\n" else cue.text
+        self._buf.append(f"{index}{nl}{cue.timecode}{nl}{text}{nl}{nl}")
+        if len(self._buf) >= self.buffer_cues:
+            self.flush()
+
+    def write_many(self, recs: Iterable[CueLike]) -> int:
+        for rec in recs:
+            self.write(rec)
+        return self.count
+
+    def flush(self) -> None:
+        if self._buf:
+            self._f.write("".join(self._buf))
+            self._buf.clear()
+        self._f.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._owned:
+            self._f.close()
+
+    def __enter__(self) -> "SrtWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_srt(target, cues: Iterable[CueLike], *, renumber: bool = False, newline: str = "\n") -> int:
+    """寫出整份 SRT，回傳段數"""
+    with SrtWriter(target, renumber=renumber, newline=newline) as w:
+        return w.write_many(cues)
@@ -0,0 +1,31 @@
+# modules/stage_runner.py
+# 功能：以包裝方式執行步驟腳本
+# - 讓沒有 import metrics 的腳本也會回報 peak RSS 等指標
+# - 設定 SUBTITLE_PROFILE_DIR / SUBTITLE_PROFILE_MODE 時，整個步驟在剖析下執行（見 modules/profiling.py）
+# app.py 在啟用 metrics 或 profile 時改用：python -m modules.stage_runner <script.py> [args...]
+
+from __future__ import annotations
+import os, runpy, sys
+from pathlib import Path
+
+from modules import metrics  # noqa: F401 — 依環境變數自動啟用並註冊 atexit
+from modules import profiling
+
+
+def main(argv: list) -> None:
+    if not argv:
+        raise SystemExit("用法：python -m modules.stage_runner <script.py> [args...]")
+    script = argv[0]
+    sys.argv = list(argv)
+    run = lambda: runpy.run_path(script, run_name="__main__")
+
+    profile_dir = os.environ.get(profiling.ENV_DIR)
+    mode = profiling.normalize_mode(os.environ.get(profiling.ENV_MODE))
+    if profile_dir and mode:
+        profiling.profile_call(run, profile_dir, Path(script).stem, mode=mode)
+    else:
+        run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
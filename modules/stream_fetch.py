@@ -0,0 +1,321 @@
+# modules/stream_fetch.py
+# 功能：邊下載邊解壓
+# 1. download()：下載到路徑或可寫入物件；Google Drive 連結走 gdown，其餘 http(s) 直接串流
+#    （本機 http.server 即可當測試替身）
+# 2. StreamingUnzip：依 zip 的 local file header 逐段解壓，不需等整個 zip 下載完
+#    - 支援 stored / deflate、data descriptor、zip64
+#    - 遇到無法串流的項目（加密、其他壓縮法、stored + data descriptor）→ fallback，
+#      由呼叫端在下載完成後改用 zipfile 解壓
+# 3. PipelineSink：下載端寫入的資料同時 → 寫入 zip 檔、計算 SHA-256、送進解壓執行緒，
+#    並定期輸出進度（已下載 MB、MB/s、已解壓檔案數）
+
+from __future__ import annotations
+import contextlib, hashlib, os, queue, re, struct, threading, time, urllib.request, zlib
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Optional, Union
+
+_CHUNK = 1024 * 1024
+
+_LOCAL_SIG = 0x04034B50
+_DESC_SIG = 0x08074B50
+_CENTRAL_SIGS = (0x02014B50, 0x06054B50, 0x06064B50, 0x05054B50)
+
+
+class StreamingUnzip:
+    """
+    推送式（push）zip 解壓器：feed(bytes) 逐段餵資料，檔案一解完就寫到 dest。
+    self.fallback 為 True 表示遇到無法串流的內容，已停止解壓。
+    """
+
+    def __init__(self, dest: Union[str, os.PathLike], on_file: Optional[Callable[[str, int], None]] = None):
+        self.dest = Path(dest)
+        self.on_file = on_file
+        self.files = 0
+        self.total_bytes = 0
+        self.done = False
+        self.fallback: Optional[str] = None
+        self._buf = bytearray()
+        self._state = "header"
+        self._entry = None
+        self._out = None
+        self._dec = None
+        self._crc = 0
+        self._remaining = 0
+
+    # --------- 公開介面 ---------
+    def feed(self, data: bytes) -> None:
+        if self.done or self.fallback:
+            return
+        self._buf += data
+        while not self.done and not self.fallback and self._step():
+            pass
+
+    def close(self) -> None:
+        if not self.done and not self.fallback:
+            self._stop(f"zip 資料不完整（狀態：{self._state}）")
+
+    # --------- 內部狀態機 ---------
+    def _stop(self, reason: str) -> None:
+        self.fallback = reason
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def _step(self) -> bool:
+        """處理目前 buffer 中能處理的部分；需要更多資料時回傳 False"""
+        if self._state == "header":
+            return self._read_header()
+        if self._state == "data":
+            return self._read_data()
+        if self._state == "descriptor":
+            return self._read_descriptor()
+        return False
+
+    def _read_header(self) -> bool:
+        if len(self._buf) < 4:
+            return False
+        sig = struct.unpack_from("<I", self._buf)[0]
+        if sig in _CENTRAL_SIGS:
+            # 進入 central directory → 所有檔案都已解完
+            self.done = True
+            return False
+        if sig != _LOCAL_SIG:
+            self._stop(f"未知的 zip 區段簽章：{sig:#x}")
+            return False
+        if len(self._buf) < 30:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, nlen, xlen) = struct.unpack_from("<IHHHHHIIIHH", self._buf)
+        if len(self._buf) < 30 + nlen + xlen:
+            return False
+        raw_name = bytes(self._buf[30:30 + nlen])
+        extra = bytes(self._buf[30 + nlen:30 + nlen + xlen])
+        del self._buf[:30 + nlen + xlen]
+
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        usize, csize, zip64 = _zip64_sizes(extra, usize, csize)
+        has_desc = bool(flags & 0x08)
+
+        if flags & 0x01:
+            self._stop(f"加密項目無法串流解壓：{name}")
+            return False
+        if method not in (0, 8):
+            self._stop(f"不支援串流的壓縮方式 {method}：{name}")
+            return False
+        if has_desc and method == 0:
+            self._stop(f"stored + data descriptor 無法判斷長度：{name}")
+            return False
+
+        self._entry = {"name": name, "crc": crc, "csize": csize, "usize": usize,
+                       "method": method, "has_desc": has_desc, "zip64": zip64, "written": 0}
+        target = _safe_join(self.dest, name)
+        if name.endswith("/") or target is None:
+            if target is not None:
+                target.mkdir(parents=True, exist_ok=True)
+            self._out = None
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            self._out = open(target, "wb")
+        self._dec = zlib.decompressobj(-15) if method == 8 else None
+        self._crc = 0
+        self._remaining = None if has_desc else csize
+        self._state = "data"
+        return True
+
+    def _write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self._crc = zlib.crc32(chunk, self._crc)
+        self._entry["written"] += len(chunk)
+        if self._out is not None:
+            self._out.write(chunk)
+
+    def _read_data(self) -> bool:
+        if not self._buf and self._remaining != 0:
+            return False
+        if self._remaining is not None:
+            take = min(self._remaining, len(self._buf))
+            piece = bytes(self._buf[:take])
+            del self._buf[:take]
+            self._remaining -= take
+            self._write(self._dec.decompress(piece) if self._dec else piece)
+            if self._remaining > 0:
+                return False
+            if self._dec is not None:
+                self._write(self._dec.flush())
+        else:
+            # 長度未知（data descriptor）：靠 deflate 串流自己的結尾判斷
+            piece = bytes(self._buf)
+            self._buf.clear()
+            self._write(self._dec.decompress(piece))
+            if not self._dec.eof:
+                return False
+            self._buf[:0] = self._dec.unused_data
+        if self._entry["has_desc"]:
+            self._state = "descriptor"
+            return True
+        return self._finish_entry(self._entry["crc"])
+
+    def _read_descriptor(self) -> bool:
+        need = 24 if self._entry["zip64"] else 16
+        if len(self._buf) < need:
+            return False
+        off = 4 if struct.unpack_from("<I", self._buf)[0] == _DESC_SIG else 0
+        crc = struct.unpack_from("<I", self._buf, off)[0]
+        del self._buf[:off + (20 if self._entry["zip64"] else 12)]
+        return self._finish_entry(crc)
+
+    def _finish_entry(self, crc: int) -> bool:
+        entry = self._entry
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+            if (self._crc & 0xFFFFFFFF) != crc:
+                self._stop(f"CRC 不符：{entry['name']}")
+                return False
+            self.files += 1
+            self.total_bytes += entry["written"]
+            if self.on_file is not None:
+                self.on_file(entry["name"], entry["written"])
+        self._entry = None
+        self._dec = None
+        self._state = "header"
+        return True
+
+
+def _zip64_sizes(extra: bytes, usize: int, csize: int):
+    """讀 zip64 extra field（tag 0x0001），回傳 (usize, csize, 是否為 zip64)"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, pos)
+        if tag == 0x0001:
+            vals = extra[pos + 4:pos + 4 + size]
+            i = 0
+            if usize == 0xFFFFFFFF and i + 8 <= len(vals):
+                usize = struct.unpack_from("<Q", vals, i)[0]
+                i += 8
+            if csize == 0xFFFFFFFF and i + 8 <= len(vals):
+                csize = struct.unpack_from("<Q", vals, i)[0]
+            return usize, csize, True
+        pos += 4 + size
+    return usize, csize, False
+
+
+def _safe_join(dest: Path, name: str) -> Optional[Path]:
+    """與 zipfile.extract 相同的規則：去掉磁碟代號、絕對路徑與 '..'"""
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts
+             if p not in ("", ".", "..", "/") and not re.match(r"^[A-Za-z]:$", p)]
+    if not parts:
+        return None
+    return dest.joinpath(*parts)
+
+
+class PipelineSink:
+    """
+    給下載端寫入的檔案物件：
+    - 原始 bytes 寫入 zip_path（留給下載快取）並計算 SHA-256
+    - 另一條執行緒同步串流解壓到 extract_dir
+    - 每 progress_every 秒輸出一次進度
+    """
+
+    def __init__(self, zip_path, extract_dir=None, *, label: str = "",
+                 total: Optional[int] = None, progress_every: float = 2.0):
+        self.label = f"[{label}] " if label else ""
+        self.total = total
+        self.bytes = 0
+        self.sha = hashlib.sha256()
+        self._f = open(zip_path, "wb")
+        self._t0 = time.monotonic()
+        self._last = self._t0
+        self._every = progress_every
+        self._last_file = ""
+        self.unzip = StreamingUnzip(extract_dir, on_file=self._on_file) if extract_dir is not None else None
+        self._q: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=64)
+        self._worker = None
+        if self.unzip is not None:
+            self._worker = threading.Thread(target=self._consume, daemon=True)
+            self._worker.start()
+
+    def _on_file(self, name: str, size: int) -> None:
+        self._last_file = name
+
+    def _consume(self) -> None:
+        while True:
+            data = self._q.get()
+            if data is None:
+                break
+            try:
+                self.unzip.feed(data)
+            except Exception as e:
+                self.unzip._stop(f"解壓失敗：{e}")
+
+    # --------- 檔案物件介面（gdown / urllib 端使用） ---------
+    def write(self, data: bytes) -> int:
+        self._f.write(data)
+        self.sha.update(data)
+        self.bytes += len(data)
+        if self._worker is not None:
+            self._q.put(bytes(data))
+        now = time.monotonic()
+        if now - self._last >= self._every:
+            self._last = now
+            self.report()
+        return len(data)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.monotonic() - self._t0, 1e-6)
+        total = f" / {self.total / 1e6:.1f}" if self.total else ""
+        files = ""
+        if self.unzip is not None:
+            files = f"，已解壓 {self.unzip.files} 個檔案"
+            if self._last_file and not final:
+                files += f"（最新：{self._last_file}）"
+        tag = "完成" if final else "下載中"
+        print(f"{self.label}{tag}：{self.bytes / 1e6:.1f}{total} MB"
+              f"（{self.bytes / 1e6 / elapsed:.2f} MB/s）{files}", flush=True)
+
+    def close(self) -> str:
+        """結束寫入並等解壓完成，回傳 sha256"""
+        self._f.close()
+        if self._worker is not None:
+            self._q.put(None)
+            self._worker.join()
+            self.unzip.close()
+        self.report(final=True)
+        return self.sha.hexdigest()
+
+
+def _is_drive(url: str) -> bool:
+    return "drive.google.com" in url or "docs.google.com" in url
+
+
+def download(url: str, output: Union[str, BinaryIO], *, quiet: bool = True) -> None:
+    """
+    下載 url 到 output（路徑或有 write() 的物件）。
+    Google Drive 用 gdown；其他 http(s) 直接以 urllib 串流（會先設定 output.total 供進度顯示）。
+    "upload:<id>"（modules/uploads.py）只會從下載快取取得，不會走到這裡下載。
+    """
+    if url.startswith("upload:"):
+        # 上傳完成時已放進下載快取；走到這裡代表保留期限（upload_pin_hours）過後已被淘汰
+        raise FileNotFoundError(f"找不到上傳的檔案（保留期限過後已被快取淘汰，請重新上傳）：{url}")
+    if _is_drive(url):
+        import gdown
+        gdown.download(url=url, output=output, fuzzy=True, quiet=quiet)
+        return
+
+    with urllib.request.urlopen(url) as resp:
+        length = resp.headers.get("Content-Length")
+        if length and hasattr(output, "total"):
+            output.total = int(length)
+        received = 0
+        with contextlib.ExitStack() as stack:
+            if isinstance(output, (str, os.PathLike)):
+                output = stack.enter_context(open(output, "wb"))
+            for block in iter(lambda: resp.read(_CHUNK), b""):
+                output.write(block)
+                received += len(block)
+        # 連線提早中斷時 read() 只會回傳空值，不會丟例外；不檢查的話半個 zip 會被當成完整下載
+        if length and received != int(length):
+            raise IOError(f"下載不完整：收到 {received} / {length} bytes（{url}）")
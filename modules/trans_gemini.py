@@ -1,11 +1,14 @@
 import os
 import json
 import re
-from typing import Dict
+import time
+from typing import Dict, Iterator
 
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 
+from modules import handoff, hedge, metrics, rate_limit
+
 
 def _load_config(project_root: str) -> Dict:
     """
@@ -35,36 +38,72 @@ def _get_api_key_from_config(cfg: Dict) -> str:
     return api_key
 
 
-def _load_subtitle_dict_from_json(data_dir: str) -> Dict[str, str]:
+def _find_subtitle_source(data_dir: str, follow: bool = False, timeout: float | None = 600,
+                          lang: str | None = None, since: float | None = None) -> str:
     """
-    從 data 資料夾中找到第一個 json 檔作為字幕字典
+    從 data 資料夾中找到字幕中繼檔（優先 .jsonl，其次舊版 .json）
     （注意：只掃描 data/，不會讀到根目錄的 config.json）
+    follow=True 時若尚未產生，會等待 OCR 階段建立 .jsonl（最多 timeout 秒，None = 不限）
+    lang：只接受該語言的中繼檔 img_to_text_{lang}.jsonl（與 OCR 同時執行時由呼叫端指定）
+    since：忽略修改時間早於此時間戳的檔案（上一次執行留下、已有 _eof 的舊中繼檔）
     """
     if not os.path.isdir(data_dir):
-        raise FileNotFoundError(f"找不到 data 資料夾：{data_dir}")
-
-    json_files = [
-        f for f in os.listdir(data_dir)
-        if f.lower().endswith(".json")
-    ]
-
-    if not json_files:
-        raise FileNotFoundError(f"{data_dir} 中找不到任何 json 檔")
+        if not follow:
+            raise FileNotFoundError(f"找不到 data 資料夾：{data_dir}")
+        os.makedirs(data_dir, exist_ok=True)
+
+    def fresh(name):
+        if since is None:
+            return True
+        try:
+            # 留 1 秒給檔案系統的時間戳精度
+            return os.path.getmtime(os.path.join(data_dir, name)) >= since - 1
+        except FileNotFoundError:
+            return False
+
+    def candidates(jsonl_only=False):
+        names = sorted(os.listdir(data_dir))
+        if lang:
+            names = [n for n in names if os.path.splitext(n)[0] == f"img_to_text_{lang}"]
+        jsonl = [f for f in names if f.lower().endswith(".jsonl") and fresh(f)]
+        if jsonl or jsonl_only:
+            return jsonl
+        return [f for f in names if f.lower().endswith(".json") and fresh(f)]
+
+    found = candidates()
+    if not found and follow:
+        print("等待 OCR 階段產生字幕中繼檔...")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not found and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.5)
+            found = candidates(jsonl_only=True)
+
+    if not found:
+        raise FileNotFoundError(f"{data_dir} 中找不到任何 jsonl / json 檔")
 
     # 若有多個就使用第一個
-    if len(json_files) > 1:
-        print(f"警告：{data_dir} 中有多個 json，將使用第一個：{json_files[0]}")
+    if len(found) > 1:
+        print(f"警告：{data_dir} 中有多個字幕檔，將使用第一個：{found[0]}")
 
-    json_path = os.path.join(data_dir, json_files[0])
-    print(f"使用字幕 JSON 檔案：{json_path}")
+    path = os.path.join(data_dir, found[0])
+    print(f"使用字幕檔案：{path}")
+    return path
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
 
-    if not isinstance(data, dict):
-        raise ValueError("字幕 JSON 應為 dict 格式 {key: value}")
-
-    return {str(k): ("" if v is None else str(v)) for k, v in data.items()}
+def _iter_subtitle_batches(path: str, batch_size: int, follow: bool = False,
+                           idle_timeout: float | None = None) -> Iterator[Dict[str, str]]:
+    """
+    逐批讀取字幕 {key: value}；follow=True 時邊等上游寫入邊分批輸出，
+    上游超過 idle_timeout 秒沒有寫入（例如 OCR 中途當掉、沒寫 _eof）時丟 TimeoutError
+    """
+    batch: Dict[str, str] = {}
+    for rec in handoff.iter_records(path, follow=follow, idle_timeout=idle_timeout):
+        batch[str(rec["key"])] = "" if rec.get("text") is None else str(rec["text"])
+        if batch_size and len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
 
 
 def _parse_gemini_output(text: str, subtitle_dict: Dict[str, str]) -> Dict[str, str]:
@@ -101,51 +140,54 @@ def _detect_language(text: str) -> str:
     return "en"
 
 
-def _gemini_trans() -> Dict[str, str]:
+def _request_with_retries(model, prompt: str, n_items: int, deadline: hedge.Deadline,
+                          max_retries: int = 3, timeout_sec: int = 600, sleep_on_rate_limit: int = 40):
     """
-    主要流程：
-    1. 從 config.json 讀取 API key
-    2. 從 data/ 掃描字幕 JSON
-    3. 呼叫 Gemini 翻譯（中→英、英→中）
-    4. 將結果輸出到 data/img_to_text_{語言}.json
-       - 若原始字幕為中文 → 語言代碼 'en'
-       - 若原始字幕為英文 → 語言代碼 'ch'
-    5. 回傳翻譯結果 dict
+    送出翻譯請求；超過滾動百分位延遲時避險，暫時性錯誤（429 / 503 / 逾時）在期限內重試
+    """
+    def request(cancel):
+        return model.generate_content(prompt, request_options={"timeout": deadline.timeout(timeout_sec)})
+
+    for attempt in range(1, max_retries + 1):
+        if attempt > 1:
+            metrics.inc("subtitle_gemini_retries_total", op="translate")
+        try:
+            rate_limit.acquire()
+            with metrics.timer("subtitle_gemini_request_seconds", op="translate"):
+                resp = hedge.call(request, op="translate", units=n_items, deadline=deadline)
+            metrics.inc("subtitle_gemini_requests_total", op="translate", status="ok")
+            return resp
+        except hedge.DeadlineExceeded:
+            raise
+        except (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+                google_exceptions.DeadlineExceeded) as e:
+            if isinstance(e, google_exceptions.ResourceExhausted):
+                metrics.inc("subtitle_gemini_requests_total", op="translate", status="rate_limited")
+                metrics.inc("subtitle_gemini_rate_limited_total", op="translate")
+                wait_sec = sleep_on_rate_limit
+            else:
+                metrics.inc("subtitle_gemini_requests_total", op="translate", status="unavailable")
+                wait_sec = 2
+            need = wait_sec + (hedge.expected_seconds("translate", n_items) or 0)
+            if attempt == max_retries:
+                raise
+            if not deadline.allows(need):
+                metrics.inc("subtitle_gemini_deadline_exceeded_total")
+                print(f"剩餘期限 {deadline.remaining():.0f}s 不足以再重試，放棄這一批")
+                raise
+            print(f"Gemini 暫時無法回應（{e}），{wait_sec}s 後重試（第 {attempt + 1} 次）")
+            time.sleep(wait_sec)
+        except Exception:
+            metrics.inc("subtitle_gemini_requests_total", op="translate", status="error")
+            raise
+
+
+def _translate_batch(model, subtitle_dict: Dict[str, str],
+                     deadline: hedge.Deadline | None = None) -> Dict[str, str]:
+    """
+    翻譯一批字幕，回傳 {key: 翻譯後文字}
+    deadline：整體期限（見 modules/hedge.py），未指定時不限制
     """
-    # 設定路徑
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(current_dir)
-    data_dir = os.path.join(project_root, "data")
-
-    # 讀取 config.json 並取得 API key
-    cfg = _load_config(project_root)
-    api_key = _get_api_key_from_config(cfg)
-
-    # 設定 Gemini
-    genai.configure(api_key=api_key)
-
-    # 載入字幕
-    subtitle_dict = _load_subtitle_dict_from_json(data_dir)
-
-    # 偵測原文語言（用第一筆即可）
-    first_text = next(iter(subtitle_dict.values()), "")
-    src_lang = _detect_language(first_text)
-    # 原文是中文 → 翻成英文 → 檔名用 en
-    # 原文是英文 → 翻成中文 → 檔名用 ch
-    output_lang = "en" if src_lang == "ch" else "ch"
-
-    # 準備模型
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        generation_config={"temperature": 0.1},
-        safety_settings=[
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ],
-    )
-
     # 建立 prompt
     prompt = (
         "請你扮演專業翻譯員。我會提供一個 Python 字典格式的字幕列表，"
@@ -158,10 +200,14 @@ def _gemini_trans() -> Dict[str, str]:
     parts = [f"{{{k}：{v}}}" for k, v in subtitle_dict.items()]
     prompt += ", ".join(parts)
 
-    print("正在向 Gemini 發送翻譯請求...")
+    print(f"正在向 Gemini 發送翻譯請求（{len(subtitle_dict)} 筆）...")
 
     try:
-        resp = model.generate_content(prompt)
+        resp = _request_with_retries(model, prompt, len(subtitle_dict), deadline or hedge.Deadline())
+        usage = getattr(resp, "usage_metadata", None)
+        if usage is not None:
+            metrics.inc("subtitle_translation_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+            metrics.inc("subtitle_translation_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, kind="output")
         raw_output = (resp.text or "").strip()
 
         print("\n--- Gemini 原始輸出 ---")
@@ -181,13 +227,87 @@ def _gemini_trans() -> Dict[str, str]:
         print(f"翻譯過程發生錯誤：{e}")
         result_dict = {k: f"翻譯失敗：{e}" for k in subtitle_dict}
 
-    # 輸出 JSON 檔
-    output_filename = f"img_to_text_{output_lang}.json"
-    output_path = os.path.join(data_dir, output_filename)
+    return result_dict
+
+
+def _gemini_trans(follow: bool = False, batch_size: int | None = None,
+                  data_dir: str | None = None, api_key: str | None = None,
+                  source_lang: str | None = None, since: float | None = None) -> Dict[str, str]:
+    """
+    主要流程：
+    1. 從 config.json 讀取 API key
+    2. 從 data/ 找字幕中繼檔（.jsonl 優先，相容 .json）
+    3. 分批呼叫 Gemini 翻譯（中→英、英→中）；follow=True 時可與 OCR 同時執行，
+       OCR 每寫滿一批就先翻譯一批
+    4. 將結果逐筆輸出到 data/img_to_text_{語言}.jsonl
+       - 若原始字幕為中文 → 語言代碼 'en'
+       - 若原始字幕為英文 → 語言代碼 'ch'
+    5. 回傳翻譯結果 dict
+    data_dir / api_key 可由批次模式指定（預設為專案的 data/ 與 config.json 的 key）
+    source_lang：只讀 OCR 的 img_to_text_{source_lang}.jsonl（與 OCR 同時執行時指定，避免讀到別的語言）
+    since：忽略早於此時間戳的中繼檔；follow=True 且未指定時以現在為準（不讀上一次執行留下的檔案）
+    """
+    # 設定路徑
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    data_dir = data_dir or os.path.join(project_root, "data")
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(result_dict, f, ensure_ascii=False, indent=2)
+    # 讀取 config.json 並取得 API key
+    cfg = _load_config(project_root)
+    api_key = api_key or _get_api_key_from_config(cfg)
+    if batch_size is None:
+        batch_size = int(cfg.get("trans_batch_size") or 100)
+    idle_timeout = float(cfg.get("trans_follow_idle_timeout") or 600) if follow else None
+    if follow and since is None:
+        since = time.time()
 
-    print(f"翻譯完成，已輸出：{output_path}")
+    # 設定 Gemini
+    genai.configure(api_key=api_key)
+
+    # 找字幕來源
+    source_path = _find_subtitle_source(data_dir, follow=follow, timeout=idle_timeout or 600,
+                                        lang=source_lang, since=since)
+
+    # 準備模型
+    model = genai.GenerativeModel(
+        model_name="gemini-2.5-flash",
+        generation_config={"temperature": 0.1},
+        safety_settings=[
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+        ],
+    )
+
+    # 整體期限從開始翻譯起算（config 的 gemini_job_deadline，0 = 不限制）
+    deadline = hedge.Deadline(float(cfg.get("gemini_job_deadline") or 0))
+
+    result_dict: Dict[str, str] = {}
+    writer = None
+    try:
+        for batch in _iter_subtitle_batches(source_path, batch_size, follow=follow, idle_timeout=idle_timeout):
+            if writer is None:
+                # 偵測原文語言（用第一筆即可）
+                first_text = next(iter(batch.values()), "")
+                src_lang = _detect_language(first_text)
+                # 原文是中文 → 翻成英文 → 檔名用 en
+                # 原文是英文 → 翻成中文 → 檔名用 ch
+                output_lang = "en" if src_lang == "ch" else "ch"
+                output_path = handoff.texts_path(output_lang, data_dir, prefer_existing=False)
+                writer = handoff.JsonlWriter(output_path)
+
+            translated = _translate_batch(model, batch, deadline)
+            for k, v in translated.items():
+                writer.write(k, v)
+            result_dict.update(translated)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print("字幕檔沒有任何內容，略過翻譯。")
+    else:
+        print(f"翻譯完成，已輸出：{writer.path}")
 
     return result_dict
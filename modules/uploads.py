@@ -0,0 +1,204 @@
+# modules/uploads.py
+# 功能：可續傳的分段上傳（字幕圖片 zip 直接從操作人員的電腦送進來，不必經過雲端硬碟）
+# 1. create()：建立上傳，回傳 upload_id
+# 2. write_part()：從目前的 offset 接續寫入一段，串流寫到磁碟並比對該段的 SHA-256；
+#    比對失敗會截回原本的 offset；確認寫入（fsync）後才更新 offset
+# 3. status()：查詢已確認的 offset，中斷後從這裡續傳
+# 4. complete()：檢查總大小 / 整體 SHA-256，把檔案移入下載快取，URL 為 "upload:<upload_id>"
+#    之後 load_*_images 以這個 URL 直接命中快取，不會再下載
+#    快取項目保留（不被 LRU 淘汰）upload_pin_hours 小時，status() 的 expires 為保留到期時間；
+#    使用這個上傳的工作完成時以 release() 提早解除，之後與一般下載一樣依 LRU 淘汰
+#
+# 目錄結構（預設 cache/uploads/）：
+#   <id>.json   狀態（檔名、預期大小、已確認的 offset、各段雜湊）
+#   <id>.part   已寫入的內容
+
+from __future__ import annotations
+import hashlib, json, os, re, threading, time, uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+import config
+from modules import download_cache
+
+SCHEME = "upload:"
+_CHUNK = 1024 * 1024
+_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class UploadError(Exception):
+    """status 為建議的 HTTP 狀態碼；offset 為目前已確認的位置"""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _lock(upload_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def upload_dir() -> Path:
+    root = Path(config.load_config().get("upload_dir") or "cache/uploads")
+    if not root.is_absolute():
+        root = Path(config.CONFIG_PATH).parent / root
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def url_for(upload_id: str) -> str:
+    return SCHEME + upload_id
+
+
+def _paths(upload_id: str):
+    if not _ID.match(upload_id or ""):
+        raise UploadError("upload_id 格式錯誤", status=404)
+    root = upload_dir()
+    return root / f"{upload_id}.json", root / f"{upload_id}.part"
+
+
+def _load(upload_id: str) -> Dict:
+    meta_path, _ = _paths(upload_id)
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        raise UploadError("找不到這個上傳", status=404)
+
+
+def _save(meta: Dict) -> None:
+    meta_path, _ = _paths(meta["id"])
+    tmp = meta_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, meta_path)
+
+
+def _public(meta: Dict) -> Dict:
+    out = {k: meta.get(k) for k in ("id", "filename", "size", "offset", "complete")}
+    if meta.get("complete"):
+        out["url"] = url_for(meta["id"])
+        out["sha256"] = meta.get("sha256")
+        # cached 為 False 時 url 已無法使用（已被淘汰），需要重新上傳
+        entry = download_cache.DownloadCache().entry(out["url"])
+        out["cached"] = entry is not None
+        out["expires"] = entry.get("pinned_until") if entry else None
+    return out
+
+
+def create(filename: str, size: Optional[int] = None, sha256: Optional[str] = None) -> Dict:
+    if size is not None and int(size) < 0:
+        raise UploadError("size 不可為負數")
+    upload_id = uuid.uuid4().hex
+    meta = {"id": upload_id, "filename": os.path.basename(filename or "package.zip"),
+            "size": None if size is None else int(size), "sha256": (sha256 or "").lower() or None,
+            "offset": 0, "parts": [], "complete": False, "created": time.time()}
+    _, part_path = _paths(upload_id)
+    part_path.touch()
+    _save(meta)
+    return _public(meta)
+
+
+def status(upload_id: str) -> Dict:
+    return _public(_load(upload_id))
+
+
+def _hash_range(path: Path, offset: int, length: int) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        left = length
+        while left > 0:
+            block = f.read(min(_CHUNK, left))
+            if not block:
+                break
+            h.update(block)
+            left -= len(block)
+    return h.hexdigest()
+
+
+def write_part(upload_id: str, offset: int, stream: BinaryIO, part_sha256: str,
+               length: Optional[int] = None) -> Dict:
+    """
+    從 offset 寫入一段。offset 必須等於目前已確認的位置；
+    重送已確認過的段（回覆遺失時）若內容雜湊相同，直接回傳目前狀態。
+    """
+    part_sha256 = (part_sha256 or "").lower()
+    if not part_sha256:
+        raise UploadError("缺少該段的 SHA-256")
+    with _lock(upload_id):
+        meta = _load(upload_id)
+        _, part_path = _paths(upload_id)
+        if meta["complete"]:
+            raise UploadError("上傳已完成", status=409, offset=meta["offset"])
+        current = meta["offset"]
+        if offset != current:
+            done = next((p for p in meta["parts"] if p["offset"] == offset), None)
+            if done is not None and done["sha256"] == part_sha256:
+                return _public(meta)
+            raise UploadError(f"offset 不符，目前為 {current}", status=409, offset=current)
+
+        h = hashlib.sha256()
+        written = 0
+        try:
+            with open(part_path, "r+b") as f:
+                f.seek(offset)
+                while length is None or written < length:
+                    block = stream.read(_CHUNK if length is None else min(_CHUNK, length - written))
+                    if not block:
+                        break
+                    if meta["size"] is not None and offset + written + len(block) > meta["size"]:
+                        raise UploadError("超過宣告的檔案大小", offset=current)
+                    f.write(block)
+                    h.update(block)
+                    written += len(block)
+                if length is not None and written != length:
+                    raise UploadError("連線中斷，該段未完整收到", offset=current)
+                if h.hexdigest() != part_sha256:
+                    raise UploadError("該段 SHA-256 不符", status=422, offset=current)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            # 沒確認的部分一律丟掉，下次從原本的 offset 重送
+            with open(part_path, "r+b") as f:
+                f.truncate(current)
+            raise
+
+        meta["parts"].append({"offset": offset, "length": written, "sha256": part_sha256})
+        meta["offset"] = offset + written
+        _save(meta)
+        return _public(meta)
+
+
+def complete(upload_id: str) -> Dict:
+    """檢查完整性後移入下載快取；回傳含 url 的狀態"""
+    with _lock(upload_id):
+        meta = _load(upload_id)
+        if meta["complete"]:
+            return _public(meta)
+        _, part_path = _paths(upload_id)
+        if meta["size"] is not None and meta["offset"] != meta["size"]:
+            raise UploadError(f"尚未上傳完成（{meta['offset']}/{meta['size']}）", status=409, offset=meta["offset"])
+        sha = download_cache.sha256_file(part_path)
+        if meta["sha256"] and sha != meta["sha256"]:
+            raise UploadError("整體 SHA-256 不符", status=422, offset=meta["offset"])
+        hours = float(config.load_config().get("upload_pin_hours") or 0)
+        pin_until = time.time() + hours * 3600 if hours > 0 else None
+        download_cache.DownloadCache().add(url_for(upload_id), part_path, sha=sha, pin_until=pin_until)
+        meta.update(complete=True, sha256=sha, size=meta["offset"], completed=time.time())
+        _save(meta)
+        print(f"📦 上傳完成：{meta['filename']}（{meta['size'] / 1e6:.1f} MB）→ {url_for(upload_id)}")
+        return _public(meta)
+
+
+def release(*urls: Optional[str]) -> None:
+    """使用上傳的工作完成後呼叫：解除其中 "upload:<id>" 的快取保留（其他 URL 略過）"""
+    cache = None
+    for url in urls:
+        if url and url.startswith(SCHEME):
+            cache = cache or download_cache.DownloadCache()
+            if cache.unpin(url):
+                print(f"📦 已解除上傳的快取保留：{url}")
@@ -3,6 +3,7 @@ import re
 import html
 import shutil
 import xml.etree.ElementTree as ET
+from modules import srt_
 
 # 固定參數
 FPS = 23.976
@@ -69,20 +70,16 @@ def run(xml_file_name: str, image_texts: dict, save_path: str | None = None, mak
     )
     graphic_re = re.compile(r"<Graphic[^>]*>(.*?)</Graphic>", flags=re.DOTALL)
 
-    subs = []
-    for m in event_re.finditer(xml_text):
-        in_tc, out_tc, body = m.group(1), m.group(2), m.group(3)
-        lines = [html.unescape(x.strip()) for x in graphic_re.findall(body)]
-        text_block = "\n".join([l for l in lines if l]) or ""
-        if not text_block:
-            continue
-        start = tc_to_srt_time(in_tc, FPS)
-        end = tc_to_srt_time(out_tc, FPS)
-        subs.append((start, end, text_block))
-
-    with open(output_srt, "w", encoding="utf-8") as f:
-        for i, (st, et, tx) in enumerate(subs, 1):
-            f.write(f"{i}\n{st} --> {et}\n{tx}\n\n")
+    with srt_.SrtWriter(output_srt) as writer:
+        for m in event_re.finditer(xml_text):
+            in_tc, out_tc, body = m.group(1), m.group(2), m.group(3)
+            lines = [html.unescape(x.strip()) for x in graphic_re.findall(body)]
+            text_block = "\n".join([l for l in lines if l]) or ""
+            if not text_block:
+                continue
+            start = tc_to_srt_time(in_tc, FPS)
+            end = tc_to_srt_time(out_tc, FPS)
+            writer.write((writer.count + 1, f"{start} --> {end}", text_block))
 
-    print(f"🎬 完成！輸出：{output_srt}（共 {len(subs)} 段）")
+    print(f"🎬 完成！輸出：{output_srt}（共 {writer.count} 段）")
     return replaced, output_srt
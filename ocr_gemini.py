@@ -1,17 +1,18 @@
 from config import load_config
-from modules import ocr_gemini
-import json
+from modules import ocr_gemini, handoff, preflight
 
 if __name__ == "__main__":
     cfg = load_config()
 
     # 英文字幕辨識
     try:
-        image_texts_en = ocr_gemini.run(cfg["file_name_en"])
+        # 逐筆寫入 data/img_to_text_en.jsonl，下游可邊辨識邊讀取
+        with handoff.JsonlWriter(handoff.texts_path("en", prefer_existing=False)) as writer:
+            # 只辨識字幕 XML 引用到的圖片（沒有 XML 時辨識全部）
+            names = preflight.work_list(cfg["file_name_en"], cfg["xml_file_name_en"])
+            image_texts_en = ocr_gemini.run(cfg["file_name_en"], on_result=writer, names=names)
         if image_texts_en:
             print(image_texts_en)
-            with open("data/img_to_text_en.json", "w", encoding="utf-8") as f:
-                json.dump(image_texts_en, f, ensure_ascii=False, indent=2)
         else:
             print("英文字幕辨識結果 image_texts_en 為空。")
     except FileNotFoundError:
@@ -21,11 +22,13 @@ if __name__ == "__main__":
 
     # 中文字幕辨識
     try:
-        image_texts_ch = ocr_gemini.run(cfg["file_name_ch"])
+        # 逐筆寫入 data/img_to_text_ch.jsonl，下游可邊辨識邊讀取
+        with handoff.JsonlWriter(handoff.texts_path("ch", prefer_existing=False)) as writer:
+            # 只辨識字幕 XML 引用到的圖片（沒有 XML 時辨識全部）
+            names = preflight.work_list(cfg["file_name_ch"], cfg["xml_file_name_ch"])
+            image_texts_ch = ocr_gemini.run(cfg["file_name_ch"], on_result=writer, names=names)
         if image_texts_ch:
             print(image_texts_ch)
-            with open("data/img_to_text_ch.json", "w", encoding="utf-8") as f:
-                json.dump(image_texts_ch, f, ensure_ascii=False, indent=2)
         else:
             print("中文字幕辨識結果 image_texts_ch 為空。")
     except FileNotFoundError:
@@ -0,0 +1,114 @@
+# tests/test_job_queue.py
+# 工作佇列：多個本機 worker 行程共用同一個暫存 SQLite 檔
+# - 每個 task 只執行一次
+# - worker 被 kill 後租約過期，由其他 worker 重做
+# - 相依順序：task 開始時，所有相依 task 都已結束
+#
+# worker 行程執行 worker.work_loop()，task 種類 "probe" 只在這些行程裡註冊（見 _WORKER）
+
+import json, os, signal, socket, subprocess, sys, time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from modules import job_queue  # noqa: E402
+
+_WORKER = """
+import json, os, sys, time
+from modules import pipeline
+import worker
+
+log, queue_path, lease = sys.argv[1], sys.argv[2], float(sys.argv[3])
+
+def probe(t, name, sleep=0.0, hang_once=None):
+    start = time.time()
+    if hang_once and not os.path.exists(hang_once):
+        open(hang_once, "w").close()
+        time.sleep(3600)
+    time.sleep(sleep)
+    line = json.dumps({"name": name, "pid": os.getpid(), "start": start, "end": time.time()})
+    with open(log, "a", encoding="utf-8") as f:
+        f.write(line + "\\n")
+
+pipeline.TASK_KINDS["probe"] = probe
+worker.work_loop(queue_path, lease=lease, idle_exit=2, poll=0.1)
+"""
+
+
+def _start_worker(tmp_path, lease=30.0):
+    return subprocess.Popen([sys.executable, "-c", _WORKER, str(tmp_path / "runs.jsonl"),
+                             str(tmp_path / "queue.sqlite"), str(lease)],
+                            cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _runs(tmp_path):
+    path = tmp_path / "runs.jsonl"
+    if not path.exists():
+        return []
+    return [json.loads(l) for l in path.read_text(encoding="utf-8").splitlines() if l]
+
+
+def _wait_all(procs, timeout=60):
+    for p in procs:
+        _, err = p.communicate(timeout=timeout)
+        assert p.returncode == 0, err.decode("utf-8", "replace")
+
+
+def _task(name, deps=(), **payload):
+    return {"name": name, "kind": "probe", "payload": {"name": name, **payload}, "deps": list(deps)}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = job_queue.JobQueue(str(tmp_path / "queue.sqlite"))
+    yield q
+    q.close()
+
+
+def test_each_task_runs_once_in_dependency_order(tmp_path, queue):
+    # 與 plan_tasks 相同的形狀：download → 分片 ×N → collect → xml_to_srt → merge
+    shards = [f"ocr_{i}" for i in range(12)]
+    tasks = [_task("download", sleep=0.2)]
+    tasks += [_task(n, ["download"], sleep=0.1) for n in shards]
+    tasks += [_task("ocr_collect", shards), _task("xml_to_srt", ["ocr_collect"]), _task("merge", ["xml_to_srt"])]
+    job_id = queue.enqueue_job({"name": "probe"}, tmp_path / "work", tasks)
+
+    _wait_all([_start_worker(tmp_path) for _ in range(4)])
+
+    runs = _runs(tmp_path)
+    assert sorted(r["name"] for r in runs) == sorted(t["name"] for t in tasks)
+    assert len({r["pid"] for r in runs if r["name"] in shards}) > 1, "分片應分散到多個 worker"
+    by_name = {r["name"]: r for r in runs}
+    for t in tasks:
+        for dep in t["deps"]:
+            assert by_name[dep]["end"] <= by_name[t["name"]]["start"], f"{t['name']} 早於相依 {dep} 開始"
+    job = queue.job_status(job_id)
+    assert job["status"] == "done"
+    assert all(t["attempts"] == 1 for t in job["tasks"])
+
+
+def test_killed_worker_lease_expires_and_task_is_retried(tmp_path, queue):
+    marker = tmp_path / "hung"
+    job_id = queue.enqueue_job({"name": "probe"}, tmp_path / "work",
+                               [_task("ocr_0", hang_once=str(marker)), _task("merge", ["ocr_0"])])
+
+    first = _start_worker(tmp_path, lease=1.0)
+    deadline = time.monotonic() + 30
+    while not marker.exists():
+        assert time.monotonic() < deadline, "worker 未領取 task"
+        time.sleep(0.05)
+    first.send_signal(signal.SIGKILL)
+    first.wait()
+
+    _wait_all([_start_worker(tmp_path, lease=1.0)])
+
+    job = queue.job_status(job_id)
+    assert job["status"] == "done"
+    tasks = {t["name"]: t for t in job["tasks"]}
+    assert tasks["ocr_0"]["attempts"] == 2
+    assert tasks["ocr_0"]["lease_owner"] != f"{socket.gethostname()}:{first.pid}"
+    assert [r["name"] for r in _runs(tmp_path)] == ["ocr_0", "merge"]
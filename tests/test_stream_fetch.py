@@ -0,0 +1,181 @@
+# tests/test_stream_fetch.py
+# 邊下載邊解壓：以本機 http.server 當 Drive 的替身
+# - stored / deflate / data descriptor 的 zip 都能串流解壓，結果與 zipfile 相同
+# - stored + data descriptor 無法串流 → 下載完成後改用 zipfile 解壓
+# - 下載中斷（Content-Length 不足）時丟出例外，不寫入快取
+# - download_assets.py 產生的 data/ 與舊流程（下載完再 zipfile 解壓、搬移資料夾）相同
+
+import http.server, io, os, random, runpy, shutil, sys, threading, zipfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import config  # noqa: E402
+from modules import download_cache, stream_fetch  # noqa: E402
+
+
+class _Unseekable(io.RawIOBase):
+    """zipfile 寫到不可 seek 的串流時，每個項目都會加上 data descriptor"""
+
+    def __init__(self):
+        self.buf = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.buf.write(b)
+
+
+def _members(seed):
+    rnd = random.Random(seed)
+    members = {"pkg/subtitle.xml": b"<BDN><Events><Event><Graphic>0001.png</Graphic></Event></Events></BDN>"}
+    for i in range(1, 6):
+        # 一半可壓縮、一半亂數，每個檔案跨越好幾次 feed
+        members[f"pkg/{i:04d}.png"] = bytes(rnd.randrange(256) for _ in range(40_000)) + b"\0" * 60_000
+    members["pkg/sub/extra.txt"] = b"nested"
+    members["__MACOSX/pkg/._0001.png"] = b"resource fork"
+    return members
+
+
+def _make_zip(kind, seed=0):
+    members = _members(seed)
+    method = zipfile.ZIP_STORED if kind.startswith("stored") else zipfile.ZIP_DEFLATED
+    if kind.endswith("descriptor"):
+        out = _Unseekable()
+        with zipfile.ZipFile(out, "w", method) as z:
+            for name, data in members.items():
+                z.writestr(name, data)
+        return out.buf.getvalue()
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", method) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    return out.getvalue()
+
+
+def _tree(path):
+    path = Path(path)
+    return {p.relative_to(path).as_posix(): p.read_bytes() for p in sorted(path.rglob("*")) if p.is_file()}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    files = {}
+
+    def do_GET(self):
+        name = self.path.lstrip("/")
+        truncated = name.startswith("truncated/")
+        data = self.files.get(name.split("/", 1)[-1] if truncated else name)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        # truncated/：宣告完整長度，只送一半就斷線
+        self.wfile.write(data[:len(data) // 2] if truncated else data)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.files = {}
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield _Handler.files, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    values = {**config.DEFAULT_CFG, "download_cache_dir": str(tmp_path / "cache"), "image_source": "dir"}
+    monkeypatch.setattr(config, "load_config", lambda: dict(values))
+    monkeypatch.chdir(tmp_path)
+    return values
+
+
+@pytest.mark.parametrize("kind", ["stored", "deflated", "deflated_descriptor"])
+def test_streaming_unzip_matches_zipfile(tmp_path, kind):
+    blob = _make_zip(kind)
+    if kind.endswith("descriptor"):
+        assert all(i.flag_bits & 0x08 for i in zipfile.ZipFile(io.BytesIO(blob)).infolist())
+    unzip = stream_fetch.StreamingUnzip(tmp_path / "stream")
+    for i in range(0, len(blob), 4093):  # 刻意不對齊 header / 資料邊界
+        unzip.feed(blob[i:i + 4093])
+    unzip.close()
+    assert unzip.done and not unzip.fallback
+    zipfile.ZipFile(io.BytesIO(blob)).extractall(tmp_path / "zipfile")
+    assert _tree(tmp_path / "stream") == _tree(tmp_path / "zipfile")
+
+
+def test_streaming_unzip_falls_back_on_stored_descriptor_and_truncation(tmp_path):
+    unzip = stream_fetch.StreamingUnzip(tmp_path / "a")
+    unzip.feed(_make_zip("stored_descriptor"))
+    assert unzip.fallback and "data descriptor" in unzip.fallback
+
+    blob = _make_zip("deflated")
+    unzip = stream_fetch.StreamingUnzip(tmp_path / "b")
+    unzip.feed(blob[:len(blob) // 2])
+    unzip.close()
+    assert not unzip.done and "不完整" in unzip.fallback
+
+
+@pytest.mark.parametrize("kind", ["stored", "deflated", "deflated_descriptor", "stored_descriptor"])
+def test_cache_tree_matches_zipfile_over_http(tmp_path, server, cfg, kind, capsys):
+    files, base = server
+    files["pkg.zip"] = _make_zip(kind)
+    url = f"{base}/pkg.zip"
+    cache = download_cache.DownloadCache()
+    sha = cache.fetch_streaming(url, lambda out: stream_fetch.download(url, out))
+    fell_back = "改為下載完成後解壓" in capsys.readouterr().out
+    assert fell_back == (kind == "stored_descriptor")
+
+    zipfile.ZipFile(io.BytesIO(files["pkg.zip"])).extractall(tmp_path / "expected")
+    expected = {k: v for k, v in _tree(tmp_path / "expected").items() if not k.startswith("__MACOSX/")}
+    assert _tree(cache.ensure_tree(sha)) == expected
+
+
+def test_truncated_download_raises_and_is_not_cached(tmp_path, server, cfg):
+    files, base = server
+    files["pkg.zip"] = _make_zip("deflated")
+    url = f"{base}/truncated/pkg.zip"
+    cache = download_cache.DownloadCache()
+    with pytest.raises(IOError, match="下載不完整"):
+        cache.fetch_streaming(url, lambda out: stream_fetch.download(url, out))
+    assert cache.lookup(url) is None
+    assert not any(cache.trees.iterdir())
+    assert not any(cache.tmp.iterdir())
+
+
+def _old_download_then_unzip(blob, file_name, lang, work_dir):
+    """原本的流程：整個 zip 下載完才以 zipfile 解壓（去掉 __MACOSX），再把第一層資料夾改名"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    zipfile.ZipFile(io.BytesIO(blob)).extractall(work_dir)
+    shutil.rmtree(work_dir / "__MACOSX", ignore_errors=True)
+    dirs = [d for d in sorted(os.listdir(work_dir)) if (work_dir / d).is_dir() and not d.startswith("subtitle")]
+    os.rename(work_dir / dirs[0], work_dir / file_name)
+    os.rename(work_dir / file_name / "subtitle.xml", work_dir / f"subtitle_{lang}.xml")
+
+
+def test_download_assets_matches_old_path(tmp_path, server, cfg):
+    files, base = server
+    # 兩個 zip 的第一層同名（pkg/），同時下載時不能互相覆蓋
+    files["en.zip"], files["ch.zip"] = _make_zip("deflated", seed=1), _make_zip("deflated_descriptor", seed=2)
+    cfg.update(file_name_en="英文", drive_url_en=f"{base}/en.zip", file_name_ch="中文", drive_url_ch=f"{base}/ch.zip")
+
+    runpy.run_path(str(ROOT / "download_assets.py"), run_name="__main__")
+
+    old = tmp_path / "old"
+    _old_download_then_unzip(files["en.zip"], "英文", "en", old)
+    _old_download_then_unzip(files["ch.zip"], "中文", "ch", old)
+    assert _tree(tmp_path / "data") == _tree(old)
+    assert _tree(tmp_path / "data/英文") != _tree(tmp_path / "data/中文")
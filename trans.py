@@ -1,6 +1,13 @@
+import argparse
 from modules.trans_gemini import _gemini_trans
 
 if __name__ == "__main__":
-    result = _gemini_trans()
+    ap = argparse.ArgumentParser(description="以 Gemini 翻譯 OCR 中繼檔")
+    # --follow：與 OCR 同時執行，邊讀取 OCR 中繼檔邊分批翻譯
+    ap.add_argument("--follow", action="store_true")
+    ap.add_argument("--lang", default=None, help="只讀這個語言的 OCR 中繼檔（en / ch）")
+    ap.add_argument("--since", type=float, default=None,
+                    help="忽略修改時間早於此 Unix 時間戳的中繼檔（--follow 時預設為啟動時間）")
+    args = ap.parse_args()
+    result = _gemini_trans(follow=args.follow, source_lang=args.lang, since=args.since)
     print(result)
-
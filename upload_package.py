@@ -0,0 +1,109 @@
+# upload_package.py
+# 把本機的字幕圖片 zip 分段上傳到 app.py（/uploads），中斷後重跑同一個指令會從已確認的位置續傳
+#
+# 用法：
+#     python upload_package.py 再見柏林中文.zip [--server http://127.0.0.1:5000]
+#
+# 完成後印出 upload:<id>，貼到網頁的「雲端硬碟連結」欄位（或 batch manifest 的 drive_url_*）即可
+# 續傳狀態記在 <zip>.upload.json，上傳完成後刪除
+
+import argparse, hashlib, json, os, sys, time
+import urllib.error, urllib.request
+from pathlib import Path
+
+
+def _request(method, url, body=None, headers=None):
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def _json(method, url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    return _request(method, url, body, {"Content-Type": "application/json"} if body else {})
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def upload(path, server, retries=5):
+    path = Path(path)
+    state_path = path.with_name(path.name + ".upload.json")
+    size = path.stat().st_size
+    state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else {}
+
+    if state.get("server") == server and state.get("size") == size and state.get("mtime") == path.stat().st_mtime:
+        code, meta = _json("GET", f"{server}/uploads/{state['id']}")
+        if code != 200:
+            print(f"無法續傳（{meta.get('error')}），重新開始")
+            state = {}
+    else:
+        state = {}
+
+    if not state:
+        code, meta = _json("POST", f"{server}/uploads",
+                           {"filename": path.name, "size": size, "sha256": sha256_file(path)})
+        if code != 200:
+            raise SystemExit(f"建立上傳失敗：{meta.get('error')}")
+        state = {"server": server, "id": meta["id"], "size": size, "mtime": path.stat().st_mtime,
+                 "part_size": meta.get("part_size") or 8 * 1024 * 1024}
+        state_path.write_text(json.dumps(state), encoding="utf-8")
+
+    upload_id, part_size = state["id"], state["part_size"]
+    offset = meta.get("offset", 0)
+    if offset:
+        print(f"從 {offset / 1e6:.1f} MB 續傳")
+    t0, sent, failures = time.perf_counter(), 0, 0
+    with open(path, "rb") as f:
+        while offset < size and not meta.get("complete"):
+            f.seek(offset)
+            part = f.read(part_size)
+            headers = {"Upload-Offset": str(offset), "X-Part-SHA256": hashlib.sha256(part).hexdigest(),
+                       "Content-Type": "application/octet-stream"}
+            try:
+                code, meta = _request("PUT", f"{server}/uploads/{upload_id}", part, headers)
+            except (urllib.error.URLError, OSError) as e:
+                code, meta = None, {"error": str(e)}
+            if code == 200:
+                sent += meta["offset"] - offset
+                offset, failures = meta["offset"], 0
+                rate = sent / max(time.perf_counter() - t0, 1e-6) / 1e6
+                print(f"  {offset / 1e6:8.1f} / {size / 1e6:.1f} MB  {rate:.1f} MB/s", flush=True)
+                continue
+            failures += 1
+            if failures > retries:
+                raise SystemExit(f"上傳中斷：{meta.get('error')}（重跑同一指令即可續傳）")
+            print(f"⚠️ {meta.get('error')}，{2 ** failures}s 後重試")
+            time.sleep(2 ** failures)
+            if meta.get("offset") is None:
+                code, status = _json("GET", f"{server}/uploads/{upload_id}")
+                meta = status if code == 200 else meta
+            offset = meta.get("offset", offset)
+
+    code, meta = _json("POST", f"{server}/uploads/{upload_id}/complete")
+    if code != 200:
+        raise SystemExit(f"完成上傳失敗：{meta.get('error')}")
+    state_path.unlink(missing_ok=True)
+    return meta["url"]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="分段上傳字幕圖片 zip（可續傳）")
+    ap.add_argument("zip_path")
+    ap.add_argument("--server", default=os.environ.get("SUBTITLE_SERVER", "http://127.0.0.1:5000"))
+    args = ap.parse_args(argv)
+    url = upload(args.zip_path, args.server.rstrip("/"))
+    print(f"✅ 上傳完成：{url}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# worker.py
+# 從工作佇列（modules/job_queue.py）領取 task 並執行；可在多台機器上各開任意數量
+#
+# 用法：
+#     python worker.py [--processes 4] [--queue /mnt/shared/queue.sqlite] [--lease 300]
+#                      [--kinds ocr,ocr_collect] [--idle-exit 60] [--gemini-rpm 10]
+#
+# - 每個行程一次只做一個 task，在該 job 的工作目錄（見 config 的 queue_work_dir）內執行
+# - 執行期間背景執行緒定期 heartbeat 延長租約；行程當掉時租約過期，task 會由其他 worker 重做
+# - --kinds 可讓某台機器只做特定種類的 task（例如 GPU 機只做 ocr）
+# - --idle-exit N：連續 N 秒沒有可做的 task 就結束（測試 / 批次用；預設常駐）
+
+import argparse, multiprocessing as mp, sys, threading, time, traceback
+
+from modules import job_queue, pipeline, rate_limit, uploads
+
+
+def _heartbeat(queue_path, task_id, worker_id, lease, stop):
+    q = job_queue.JobQueue(queue_path)
+    try:
+        while not stop.wait(lease / 3):
+            if not q.heartbeat(task_id, worker_id, lease):
+                print(f"⚠️ task {task_id} 的租約已被收回", file=sys.stderr, flush=True)
+                return
+    finally:
+        q.close()
+
+
+def work_loop(queue_path=None, lease=300.0, kinds=None, idle_exit=0.0, poll=2.0):
+    q = job_queue.JobQueue(queue_path)
+    worker_id = job_queue.default_worker_id()
+    idle_since = time.monotonic()
+    done = 0
+    while True:
+        task = q.claim(worker_id, lease_seconds=lease, kinds=kinds)
+        if task is None:
+            if idle_exit and time.monotonic() - idle_since > idle_exit:
+                break
+            time.sleep(poll)
+            continue
+
+        label = f"{task['job_id']}/{task['name']}"
+        print(f"[{worker_id}] ▶ {label}（第 {task['attempts']} 次）", flush=True)
+        stop = threading.Event()
+        hb = threading.Thread(target=_heartbeat, args=(q.path, task["id"], worker_id, lease, stop), daemon=True)
+        hb.start()
+        t0 = time.perf_counter()
+        try:
+            pipeline.run_task(task)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            ok = False
+        else:
+            ok = True
+        finally:
+            stop.set()
+            hb.join()
+        elapsed = round(time.perf_counter() - t0, 3)
+
+        if ok:
+            accepted = q.complete(task["id"], worker_id, {"seconds": elapsed, "worker": worker_id})
+            print(f"[{worker_id}] ✔ {label} {elapsed:.1f}s" + ("" if accepted else "（租約已失效，結果未採用）"), flush=True)
+            if accepted and (q.job_status(task["job_id"]) or {}).get("status") == "done":
+                # 整個 job 完成：解除上傳 zip 的快取保留
+                uploads.release(task["title"].get("drive_url_en"), task["title"].get("drive_url_ch"))
+        else:
+            q.fail(task["id"], worker_id, error)
+            print(f"[{worker_id}] ✖ {label}：{error}", flush=True)
+        done += 1
+        idle_since = time.monotonic()
+    q.close()
+    return done
+
+
+def _process_main(lock, value, rpm, queue_path, lease, kinds, idle_exit):
+    rate_limit.share(lock, value, rpm)
+    try:
+        work_loop(queue_path, lease=lease, kinds=kinds, idle_exit=idle_exit)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        raise
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="字幕流程工作佇列 worker")
+    ap.add_argument("--processes", type=int, default=1, help="本機 worker 行程數")
+    ap.add_argument("--queue", default=None, help="佇列 SQLite 檔（預設 config 的 queue_path）")
+    ap.add_argument("--lease", type=float, default=300, help="租約秒數（heartbeat 每 1/3 租約一次）")
+    ap.add_argument("--kinds", default="", help="只領取這些種類的 task，逗號分隔")
+    ap.add_argument("--idle-exit", type=float, default=0, help="閒置超過幾秒就結束（0 = 常駐）")
+    ap.add_argument("--gemini-rpm", type=float, default=None, help="本機所有行程共用的 Gemini 每分鐘請求數")
+    args = ap.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()] or None
+    ctx = mp.get_context("spawn")
+    lock, value = rate_limit.make_shared(ctx)
+    procs = [ctx.Process(target=_process_main, name=f"worker-{i}",
+                         args=(lock, value, args.gemini_rpm, args.queue, args.lease, kinds, args.idle_exit))
+             for i in range(max(1, args.processes))]
+    for p in procs:
+        p.start()
+    print(f"已啟動 {len(procs)} 個 worker 行程（pid {', '.join(str(p.pid) for p in procs)}）", flush=True)
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.join()
+    return 0 if all(p.exitcode == 0 for p in procs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,14 @@
 from config import load_config
-from modules import xml_srt
-import json
+from modules import xml_srt, handoff
 
 if __name__ == "__main__":
     cfg = load_config()
 
-    # 讀取 OCR 結果
-    with open("data/img_to_text_en.json", "r", encoding="utf-8") as f:
-        image_texts_en = json.load(f)
-        # print(image_texts_en)
+    # 讀取 OCR 結果（.jsonl 中繼檔；相容舊版 .json）
+    image_texts_en = handoff.load_texts(handoff.texts_path("en"))
 
-    with open("data/img_to_text_ch.json", "r", encoding="utf-8") as f:
-        image_texts_ch = json.load(f)
-        print('成功')
+    image_texts_ch = handoff.load_texts(handoff.texts_path("ch"))
+    print('成功')
 
     # 產生英文 SRT
     xml_srt.run(cfg["xml_file_name_en"], image_texts_en, make_backup=True)